@@ -0,0 +1,40 @@
+"""054_table_embedding_vector
+
+Revision ID: 3c7c94ff2fb5
+Revises: 5755c0b95839
+Create Date: 2026-10-18 10:12:41.285106
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '3c7c94ff2fb5'
+down_revision = '5755c0b95839'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("CREATE EXTENSION IF NOT EXISTS vector;")
+    # embeddings were stored as json arrays, which is also the text form of a vector
+    for table in ['core_table', 'core_datasource']:
+        op.execute(f"ALTER TABLE {table} ALTER COLUMN embedding TYPE vector "
+                   f"USING NULLIF(TRIM(embedding), '')::vector")
+        # one hnsw index per dimension of the stored embeddings, new dimensions are indexed when first saved
+        dimensions = op.get_bind().execute(sa.text(
+            f"SELECT DISTINCT vector_dims(embedding) FROM {table} WHERE embedding IS NOT NULL")).scalars().all()
+        for dimension in dimensions:
+            op.execute(f"CREATE INDEX IF NOT EXISTS {table}_embedding_hnsw_{dimension} ON {table} "
+                       f"USING hnsw ((embedding::vector({dimension})) vector_cosine_ops) "
+                       f"WHERE vector_dims(embedding) = {dimension}")
+
+
+def downgrade():
+    for table in ['core_table', 'core_datasource']:
+        index_names = op.get_bind().execute(sa.text(
+            "SELECT indexname FROM pg_indexes WHERE tablename = :table AND indexname LIKE :prefix"),
+            {'table': table, 'prefix': f'{table}_embedding_hnsw_%'}).scalars().all()
+        for index_name in index_names:
+            op.execute(f"DROP INDEX IF EXISTS {index_name}")
+        op.execute(f"ALTER TABLE {table} ALTER COLUMN embedding TYPE text USING embedding::text")
@@ -0,0 +1,35 @@
+"""055_embedding_hnsw_index
+
+Revision ID: 81ac1d98c87d
+Revises: 3c7c94ff2fb5
+Create Date: 2026-10-18 11:02:17.904512
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '81ac1d98c87d'
+down_revision = '3c7c94ff2fb5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # one hnsw index per dimension of the stored embeddings, new dimensions are indexed when first saved
+    for table in ['terminology', 'data_training']:
+        dimensions = op.get_bind().execute(sa.text(
+            f"SELECT DISTINCT vector_dims(embedding) FROM {table} WHERE embedding IS NOT NULL")).scalars().all()
+        for dimension in dimensions:
+            op.execute(f"CREATE INDEX IF NOT EXISTS {table}_embedding_hnsw_{dimension} ON {table} "
+                       f"USING hnsw ((embedding::vector({dimension})) vector_cosine_ops) "
+                       f"WHERE vector_dims(embedding) = {dimension}")
+
+
+def downgrade():
+    for table in ['terminology', 'data_training']:
+        index_names = op.get_bind().execute(sa.text(
+            "SELECT indexname FROM pg_indexes WHERE tablename = :table AND indexname LIKE :prefix"),
+            {'table': table, 'prefix': f'{table}_embedding_hnsw_%'}).scalars().all()
+        for index_name in index_names:
+            op.execute(f"DROP INDEX IF EXISTS {index_name}")
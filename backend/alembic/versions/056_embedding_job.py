@@ -0,0 +1,39 @@
+"""056_embedding_job
+
+Revision ID: 9e2f4b7c1a36
+Revises: 81ac1d98c87d
+Create Date: 2026-10-18 15:21:44.630217
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '9e2f4b7c1a36'
+down_revision = '81ac1d98c87d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'embedding_job',
+        sa.Column('id', sa.BigInteger(), sa.Identity(always=True), nullable=False),
+        sa.Column('entity_type', sa.String(length=32), nullable=False),
+        sa.Column('entity_id', sa.BigInteger(), nullable=False),
+        sa.Column('status', sa.String(length=16), nullable=False),
+        sa.Column('version', sa.BigInteger(), nullable=False),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('error', sa.Text(), nullable=True),
+        sa.Column('run_at', sa.DateTime(), nullable=False),
+        sa.Column('pending_since', sa.DateTime(), nullable=False),
+        sa.Column('update_time', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('entity_type', 'entity_id', name='embedding_job_entity_key')
+    )
+    op.create_index('embedding_job_status_run_at_idx', 'embedding_job', ['status', 'run_at'])
+
+
+def downgrade():
+    op.drop_index('embedding_job_status_run_at_idx', table_name='embedding_job')
+    op.drop_table('embedding_job')
@@ -0,0 +1,28 @@
+"""057_table_embedding_version
+
+Revision ID: 4d8a6c2e9f13
+Revises: 9e2f4b7c1a36
+Create Date: 2026-10-18 16:05:12.418734
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '4d8a6c2e9f13'
+down_revision = '9e2f4b7c1a36'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'table_embedding_version',
+        sa.Column('ds_id', sa.BigInteger(), nullable=False),
+        sa.Column('version', sa.BigInteger(), nullable=False),
+        sa.PrimaryKeyConstraint('ds_id')
+    )
+
+
+def downgrade():
+    op.drop_table('table_embedding_version')
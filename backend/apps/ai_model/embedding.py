@@ -1,12 +1,21 @@
+import hashlib
 import os.path
+import re
 import threading
+import time
+import unicodedata
+from collections import OrderedDict
 from typing import Optional
+from urllib.parse import urlparse
 
+import httpx
+import orjson
 from langchain_core.embeddings import Embeddings
 from langchain_huggingface import HuggingFaceEmbeddings
 from pydantic import BaseModel
 
 from common.core.config import settings
+from common.utils.utils import SQLBotLogUtil
 
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
 
@@ -15,6 +24,7 @@ class EmbeddingModelInfo(BaseModel):
     folder: str
     name: str
     device: str = 'cpu'
+    backend: str = settings.EMBEDDING_BACKEND
 
 
 local_embedding_model = EmbeddingModelInfo(folder=settings.LOCAL_MODEL_PATH,
@@ -27,12 +37,68 @@ locks = {}
 _embedding_model: dict[str, Optional[Embeddings]] = {}
 
 
+def get_torch_model_args(config: EmbeddingModelInfo) -> tuple[str, dict]:
+    return config.name, {'device': config.device}
+
+
+def get_onnx_model_args(config: EmbeddingModelInfo) -> tuple[str, dict]:
+    onnx_file = os.path.join(settings.LOCAL_MODEL_PATH, settings.EMBEDDING_ONNX_FILE)
+    # the exported model folder has its own tokenizer and config, the model files are in its onnx folder
+    model_name = os.path.dirname(os.path.dirname(onnx_file))
+    if not os.path.exists(onnx_file):
+        # sentence-transformers falls back to exporting an unquantized model on every load
+        SQLBotLogUtil.warning(f"ONNX embedding model {onnx_file} not found, "
+                              f"run scripts/export_onnx_embedding_model.py to create it")
+    return model_name, {'device': config.device, 'backend': 'onnx',
+                        'model_kwargs': {'file_name': os.path.relpath(onnx_file, model_name),
+                                         'provider': 'CPUExecutionProvider'}}
+
+
+# backend -> sentence-transformers model name and kwargs, pooling and normalization are the same for all of them
+embedding_backends = {
+    'torch': get_torch_model_args,
+    'onnx': get_onnx_model_args,
+}
+
+
+class EmbeddingServerClient(Embeddings):
+    """Embeddings from the shared embedding server (apps/ai_model/embedding_server.py) at EMBEDDING_SERVER_URL."""
+
+    def __init__(self, url: str, timeout: float):
+        parsed = urlparse(url)
+        if parsed.scheme == 'unix':
+            self._client = httpx.Client(transport=httpx.HTTPTransport(uds=parsed.path),
+                                        base_url='http://embedding-server', timeout=timeout)
+        else:
+            self._client = httpx.Client(base_url=url, timeout=timeout)
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        if not texts:
+            return []
+        response = self._client.post('/embeddings', json={'texts': texts})
+        response.raise_for_status()
+        return response.json()['embeddings']
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embed_documents([text])[0]
+
+
 class EmbeddingModelCache:
 
     @staticmethod
     def _new_instance(config: EmbeddingModelInfo = local_embedding_model):
-        return HuggingFaceEmbeddings(model_name=config.name, cache_folder=config.folder,
-                                     model_kwargs={'device': config.device},
+        if settings.EMBEDDING_SERVER_URL:
+            return EmbeddingServerClient(settings.EMBEDDING_SERVER_URL, settings.EMBEDDING_SERVER_TIMEOUT)
+        return EmbeddingModelCache.new_local_instance(config)
+
+    @staticmethod
+    def new_local_instance(config: EmbeddingModelInfo = local_embedding_model):
+        get_model_args = embedding_backends.get(config.backend)
+        if get_model_args is None:
+            raise ValueError(f"Unknown embedding backend: {config.backend}")
+        model_name, model_kwargs = get_model_args(config)
+        return HuggingFaceEmbeddings(model_name=model_name, cache_folder=config.folder,
+                                     model_kwargs=model_kwargs,
                                      encode_kwargs={'normalize_embeddings': True}
                                      )
 
@@ -61,3 +127,145 @@ class EmbeddingModelCache:
                     _embedding_model[key] = model_instance
 
         return model_instance
+
+
+_query_lock = threading.Lock()
+
+# cache key -> (expire time, embedding), least recently used first
+_queries: "OrderedDict[str, tuple[float, list[float]]]" = OrderedDict()
+
+_query_stats = {"hits": 0, "redis_hits": 0, "misses": 0, "evictions": 0}
+
+_redis_client = None
+
+_redis_prefix = 'sqlbot-embedding-cache'
+
+
+def normalize_query_text(text: str) -> str:
+    # full width forms and runs of whitespace do not change the meaning of a question
+    return re.sub(r'\s+', ' ', unicodedata.normalize('NFKC', text)).strip()
+
+
+def get_query_cache_key(text: str, key: str = settings.DEFAULT_EMBEDDING_MODEL) -> str:
+    digest = hashlib.sha256(normalize_query_text(text).encode('utf-8')).hexdigest()
+    # int8 vectors of the onnx backend differ slightly from the torch ones
+    return f"{key}:{settings.EMBEDDING_BACKEND}:{digest}"
+
+
+def _get_redis():
+    global _redis_client
+    if settings.CACHE_TYPE.lower() != "redis":
+        return None
+    if _redis_client is None:
+        import redis
+        _redis_client = redis.Redis.from_url(settings.CACHE_REDIS_URL or "redis://localhost:6379/0")
+    return _redis_client
+
+
+class EmbeddingQueryCache:
+    """Query embeddings shared by all requests, keyed by model and normalized text."""
+
+    @staticmethod
+    def embed_query(text: str, key: str = settings.DEFAULT_EMBEDDING_MODEL) -> list[float]:
+        if not settings.EMBEDDING_CACHE_ENABLED:
+            return EmbeddingModelCache.get_model(key).embed_query(text)
+        cache_key = get_query_cache_key(text, key)
+        embedding = EmbeddingQueryCache.get(cache_key)
+        if embedding is None:
+            embedding = EmbeddingModelCache.get_model(key).embed_query(normalize_query_text(text))
+            EmbeddingQueryCache.put(cache_key, embedding)
+        return embedding
+
+    @staticmethod
+    def get(cache_key: str) -> Optional[list[float]]:
+        now = time.monotonic()
+        with _query_lock:
+            entry = _queries.get(cache_key)
+            if entry is not None:
+                if entry[0] > now:
+                    _queries.move_to_end(cache_key)
+                    _query_stats["hits"] += 1
+                    return entry[1]
+                del _queries[cache_key]
+
+        embedding = EmbeddingQueryCache._redis_get(cache_key)
+        with _query_lock:
+            if embedding is not None:
+                _query_stats["redis_hits"] += 1
+                EmbeddingQueryCache._put_local(cache_key, embedding)
+                return embedding
+            _query_stats["misses"] += 1
+        return None
+
+    @staticmethod
+    def put(cache_key: str, embedding: list[float]):
+        with _query_lock:
+            EmbeddingQueryCache._put_local(cache_key, embedding)
+        EmbeddingQueryCache._redis_put(cache_key, embedding)
+
+    @staticmethod
+    def _put_local(cache_key: str, embedding: list[float]):
+        _queries[cache_key] = (time.monotonic() + settings.EMBEDDING_CACHE_TTL, embedding)
+        _queries.move_to_end(cache_key)
+        while len(_queries) > settings.EMBEDDING_CACHE_MAX_SIZE:
+            _queries.popitem(last=False)
+            _query_stats["evictions"] += 1
+
+    @staticmethod
+    def _redis_get(cache_key: str) -> Optional[list[float]]:
+        try:
+            client = _get_redis()
+            if client is None:
+                return None
+            value = client.get(f"{_redis_prefix}:{cache_key}")
+            return orjson.loads(value) if value else None
+        except Exception as e:
+            SQLBotLogUtil.warning(f"Read embedding cache from redis failed: {e}")
+            return None
+
+    @staticmethod
+    def _redis_put(cache_key: str, embedding: list[float]):
+        try:
+            client = _get_redis()
+            if client is not None:
+                client.setex(f"{_redis_prefix}:{cache_key}", settings.EMBEDDING_CACHE_TTL,
+                             orjson.dumps(embedding, option=orjson.OPT_SERIALIZE_NUMPY))
+        except Exception as e:
+            SQLBotLogUtil.warning(f"Write embedding cache to redis failed: {e}")
+
+    @staticmethod
+    def clear():
+        with _query_lock:
+            _queries.clear()
+
+    @staticmethod
+    def stats() -> dict:
+        with _query_lock:
+            lookups = _query_stats["hits"] + _query_stats["redis_hits"] + _query_stats["misses"]
+            hit_rate = (_query_stats["hits"] + _query_stats["redis_hits"]) / lookups if lookups else 0.0
+            return {**_query_stats, "hit_rate": round(hit_rate, 4), "size": len(_queries),
+                    "enabled": settings.EMBEDDING_CACHE_ENABLED, "redis": settings.CACHE_TYPE.lower() == "redis"}
+
+
+class EmbeddingContext:
+    """Query embeddings of one request, each distinct text is embedded once however many retrieval steps use it."""
+
+    def __init__(self, key: str = settings.DEFAULT_EMBEDDING_MODEL):
+        self.key = key
+        self._lock = threading.Lock()
+        self._queries: dict[str, list[float]] = {}
+
+    def embed_query(self, text: str) -> list[float]:
+        with self._lock:
+            embedding = self._queries.get(text)
+        if embedding is None:
+            embedding = EmbeddingQueryCache.embed_query(text, self.key)
+            with self._lock:
+                self._queries[text] = embedding
+        return embedding
+
+
+def embed_query(text: str, context: Optional[EmbeddingContext] = None) -> list[float]:
+    if context is not None:
+        return context.embed_query(text)
+    return EmbeddingQueryCache.embed_query(text)
@@ -0,0 +1,150 @@
+"""
+Shared embedding server, loads the local embedding model once for all uvicorn workers that set EMBEDDING_SERVER_URL.
+
+Run from the backend directory:
+    python -m apps.ai_model.embedding_server
+"""
+import asyncio
+import time
+from typing import Optional
+from urllib.parse import urlparse
+
+from fastapi import FastAPI
+from fastapi.concurrency import asynccontextmanager
+from langchain_core.embeddings import Embeddings
+from pydantic import BaseModel
+
+from apps.ai_model.embedding import EmbeddingModelCache
+from common.core.config import settings
+from common.utils.utils import SQLBotLogUtil
+
+
+class EmbeddingRequest(BaseModel):
+    texts: list[str]
+
+
+class MicroBatcher:
+    """Embeds the texts of concurrent requests together, one forward pass at a time."""
+
+    def __init__(self, model: Embeddings, max_batch_size: int, max_wait: float):
+        self.model = model
+        self.max_batch_size = max(max_batch_size, 1)
+        self.max_wait = max_wait
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def embed(self, texts: list[str]) -> list[list[float]]:
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((texts, future))
+        return await future
+
+    async def _next_batch(self) -> list[tuple[list[str], asyncio.Future]]:
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        count = len(batch[0][0])
+        deadline = loop.time() + self.max_wait
+        while count < self.max_batch_size:
+            try:
+                # requests already waiting join at once, later ones until the deadline
+                item = self._queue.get_nowait()
+            except asyncio.QueueEmpty:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+            batch.append(item)
+            count += len(item[0])
+        return batch
+
+    async def _embed_each(self, batch: list[tuple[list[str], asyncio.Future]]):
+        # one bad request fails the whole batch, embed the requests alone so only that one fails
+        for item_texts, future in batch:
+            try:
+                embeddings = await asyncio.to_thread(self.model.embed_documents, item_texts)
+            except Exception as e:
+                SQLBotLogUtil.error(f"Embed {len(item_texts)} text(s) failed: {e}")
+                if not future.done():
+                    future.set_exception(e)
+                continue
+            if not future.done():
+                future.set_result(embeddings)
+
+    async def _run(self):
+        while True:
+            batch = await self._next_batch()
+            texts = [text for item_texts, _ in batch for text in item_texts]
+            try:
+                embeddings = await asyncio.to_thread(self.model.embed_documents, texts)
+            except Exception as e:
+                if len(batch) > 1:
+                    SQLBotLogUtil.warning(f"Embed {len(texts)} text(s) of {len(batch)} requests failed, "
+                                          f"retry them one by one: {e}")
+                    await self._embed_each(batch)
+                    continue
+                SQLBotLogUtil.error(f"Embed {len(texts)} text(s) failed: {e}")
+                if not batch[0][1].done():
+                    batch[0][1].set_exception(e)
+                continue
+            index = 0
+            for item_texts, future in batch:
+                if not future.done():
+                    future.set_result(embeddings[index:index + len(item_texts)])
+                index += len(item_texts)
+
+
+batcher: Optional[MicroBatcher] = None
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global batcher
+    start_time = time.time()
+    model = await asyncio.to_thread(EmbeddingModelCache.new_local_instance)
+    SQLBotLogUtil.info(f"Embedding model loaded with the {settings.EMBEDDING_BACKEND} backend, "
+                       f"cost {time.time() - start_time:.2f}s")
+    batcher = MicroBatcher(model, settings.EMBEDDING_SERVER_MAX_BATCH_SIZE, settings.EMBEDDING_SERVER_MAX_WAIT / 1000)
+    batcher.start()
+    yield
+    await batcher.stop()
+
+
+app = FastAPI(title="SQLBot embedding server", lifespan=lifespan)
+
+
+@app.post("/embeddings")
+async def embeddings(request: EmbeddingRequest):
+    return {"embeddings": await batcher.embed(request.texts) if request.texts else []}
+
+
+@app.get("/health")
+async def health():
+    return {"status": "ok"}
+
+
+def main():
+    import uvicorn
+    url = urlparse(settings.EMBEDDING_SERVER_URL or 'http://127.0.0.1:8002')
+    if url.scheme == 'unix':
+        uvicorn.run(app, uds=url.path)
+    else:
+        # a url without port uses the default port of its scheme, like the clients do
+        uvicorn.run(app, host=url.hostname or '127.0.0.1', port=url.port or (443 if url.scheme == 'https' else 80))
+
+
+if __name__ == '__main__':
+    main()
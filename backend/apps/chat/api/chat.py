@@ -11,10 +11,11 @@ from sqlalchemy import and_, select
 
 from apps.chat.curd.chat import list_chats, get_chat_with_records, create_chat, rename_chat, \
     delete_chat, get_chat_chart_data, get_chat_predict_data, get_chat_with_records_with_data, get_chat_record_by_id, \
-    format_json_data, format_json_list_data, get_chart_config, list_recent_questions
+    format_json_data, format_json_list_data, format_json_column, get_chart_config, list_recent_questions
 from apps.chat.models.chat_model import CreateChat, ChatRecord, RenameChat, ChatQuestion, AxisObj
 from apps.chat.task.llm import LLMService
 from common.core.deps import CurrentAssistant, SessionDep, CurrentUser, Trans
+from common.utils.cancellation import CancellationRegistry
 from common.utils.data_format import DataFormat
 
 router = APIRouter(tags=["Data Q&A"], prefix="/chat")
@@ -132,7 +133,7 @@ async def recommend_questions(session: SessionDep, current_user: CurrentUser, ch
 
         return StreamingResponse(_err(e), media_type="text/event-stream")
 
-    return StreamingResponse(llm_service.await_result(), media_type="text/event-stream")
+    return StreamingResponse(llm_service.await_result_async(), media_type="text/event-stream")
 
 @router.get("/recent_questions/{datasource_id}")
 async def recommend_questions(session: SessionDep, current_user: CurrentUser, datasource_id: int):
@@ -166,7 +167,21 @@ async def stream_sql(session: SessionDep, current_user: CurrentUser, request_que
 
         return StreamingResponse(_err(e), media_type="text/event-stream")
 
-    return StreamingResponse(llm_service.await_result(), media_type="text/event-stream")
+    return StreamingResponse(llm_service.await_result_async(), media_type="text/event-stream")
+
+
+@router.post("/record/{chat_record_id}/cancel")
+async def cancel_record(session: SessionDep, current_user: CurrentUser, chat_record_id: int):
+    record = get_chat_record_by_id(session, chat_record_id)
+    if not record:
+        raise HTTPException(status_code=404, detail=f"Chat record with id {chat_record_id} not found")
+    if record.create_by != current_user.id:
+        raise HTTPException(status_code=403, detail="No permission to cancel this chat record")
+
+    def inner():
+        return CancellationRegistry.cancel(chat_record_id, 'cancelled by user')
+
+    return {"cancelled": await asyncio.to_thread(inner)}
 
 
 @router.post("/record/{chat_record_id}/{action_type}")
@@ -207,7 +222,7 @@ async def analysis_or_predict(session: SessionDep, current_user: CurrentUser, ch
 
         return StreamingResponse(_err(e), media_type="text/event-stream")
 
-    return StreamingResponse(llm_service.await_result(), media_type="text/event-stream")
+    return StreamingResponse(llm_service.await_result_async(), media_type="text/event-stream")
 
 
 @router.get("/record/{chat_record_id}/excel/export")
@@ -221,12 +236,11 @@ async def export_excel(session: SessionDep, chat_record_id: int, trans: Trans):
 
     is_predict_data = chat_record.predict_record_id is not None
 
-    _origin_data = format_json_data(get_chat_chart_data(chat_record_id=chat_record_id, session=session))
-
-    _base_field = _origin_data.get('fields')
-    _data = _origin_data.get('data')
+    _base_field, _columns = DataFormat.get_columns(get_chat_chart_data(chat_record_id=chat_record_id,
+                                                                        session=session))
+    row_count = len(_columns[0]) if _columns else 0
 
-    if not _data:
+    if not row_count:
         raise HTTPException(
             status_code=500,
             detail=trans("i18n_excel_export.data_is_empty")
@@ -248,17 +262,21 @@ async def export_excel(session: SessionDep, chat_record_id: int, trans: Trans):
 
     _predict_data = []
     if is_predict_data:
-        _predict_data = format_json_list_data(get_chat_predict_data(chat_record_id=chat_record_id, session=session))
+        _predict_data = get_chat_predict_data(chat_record_id=chat_record_id, session=session) or []
 
     def inner():
 
-        data_list = DataFormat.convert_large_numbers_in_object_array(_data + _predict_data)
-
-        md_data, _fields_list = DataFormat.convert_object_array_for_pandas(fields, data_list)
+        # build the sheet column by column, predicted rows are appended to each column
+        index = {field: idx for idx, field in enumerate(_base_field)}
+        data_columns = []
+        for field in fields:
+            column = _columns[index[field.value]] if field.value in index else [None] * row_count
+            column = format_json_column(column + [row.get(field.value) for row in _predict_data])
+            data_columns.append(DataFormat.convert_large_numbers_in_column(column))
 
         # data, _fields_list, col_formats = LLMService.format_pd_data(fields, _data + _predict_data)
 
-        df = pd.DataFrame(md_data, columns=_fields_list)
+        df = DataFormat.columns_to_dataframe(fields, [field.value for field in fields], data_columns)
 
         buffer = io.BytesIO()
 
@@ -13,6 +13,7 @@ from apps.datasource.crud.recommended_problem import get_datasource_recommended,
 from apps.datasource.models.datasource import CoreDatasource, DsRecommendedProblem
 from apps.system.crud.assistant import AssistantOutDsFactory
 from common.core.deps import CurrentAssistant, SessionDep, CurrentUser
+from common.utils.data_format import DataFormat
 from common.utils.utils import extract_nested_json
 
 
@@ -132,35 +133,45 @@ def get_last_execute_sql_error(session: SessionDep, chart_id: int):
 
 def format_json_data(origin_data: dict):
     result = {'fields': origin_data.get('fields') if origin_data.get('fields') else []}
-    _list = origin_data.get('data') if origin_data.get('data') else []
+    # stored data may be columnar, return row objects to the client
+    _list = DataFormat.get_object_array(origin_data) or []
     data = format_json_list_data(_list)
     result['data'] = data
 
     return result
 
 
+def format_json_value(value):
+    if value is not None:
+        # 检查是否为数字且需要特殊处理
+        if isinstance(value, (int, float)):
+            # 整数且超过15位 → 转字符串并标记为文本列
+            if isinstance(value, int) and len(str(abs(value))) > 15:
+                value = str(value)
+            # 小数且超过15位有效数字 → 转字符串并标记为文本列
+            elif isinstance(value, float):
+                decimal_str = format(value, '.16f').rstrip('0').rstrip('.')
+                if len(decimal_str) > 15:
+                    value = str(value)
+    return value
+
+
 def format_json_list_data(origin_data: list[dict]):
     data = []
     for _data in origin_data if origin_data else []:
         _row = {}
         for key, value in _data.items():
-            if value is not None:
-                # 检查是否为数字且需要特殊处理
-                if isinstance(value, (int, float)):
-                    # 整数且超过15位 → 转字符串并标记为文本列
-                    if isinstance(value, int) and len(str(abs(value))) > 15:
-                        value = str(value)
-                    # 小数且超过15位有效数字 → 转字符串并标记为文本列
-                    elif isinstance(value, float):
-                        decimal_str = format(value, '.16f').rstrip('0').rstrip('.')
-                        if len(decimal_str) > 15:
-                            value = str(value)
-            _row[key] = value
+            _row[key] = format_json_value(value)
         data.append(_row)
 
     return data
 
 
+def format_json_column(column: list):
+    """same rules as format_json_list_data, for one column of columnar data"""
+    return [format_json_value(value) for value in column]
+
+
 def get_chat_chart_data(session: SessionDep, chat_record_id: int):
     stmt = select(ChatRecord.data).where(and_(ChatRecord.id == chat_record_id))
     res = session.execute(stmt)
@@ -1,6 +1,8 @@
+import asyncio
 import concurrent
 import json
 import os
+import threading
 import traceback
 import urllib.parse
 import warnings
@@ -9,7 +11,6 @@ from datetime import datetime
 from typing import Any, List, Optional, Union, Dict, Iterator
 
 import orjson
-import pandas as pd
 import requests
 import sqlparse
 from langchain.chat_models.base import BaseChatModel
@@ -22,6 +23,7 @@ from sqlbot_xpack.custom_prompt.models.custom_prompt_model import CustomPromptTy
 from sqlbot_xpack.license.license_manage import SQLBotLicenseUtil
 from sqlmodel import Session
 
+from apps.ai_model.embedding import EmbeddingContext
 from apps.ai_model.model_factory import LLMConfig, LLMFactory, get_default_config
 from apps.chat.curd.chat import save_question, save_sql_answer, save_sql, \
     save_error_message, save_sql_exec_data, save_chart_answer, save_chart, \
@@ -34,24 +36,31 @@ from apps.chat.models.chat_model import ChatQuestion, ChatRecord, Chat, RenameCh
     ChatFinishStep, AxisObj
 from apps.data_training.curd.data_training import get_training_template
 from apps.datasource.crud.datasource import get_table_schema
-from apps.datasource.crud.permission import get_row_permission_filters, is_normal_user
+from apps.datasource.crud.permission import get_row_permission_filters, is_normal_user, get_permission_fingerprint
 from apps.datasource.embedding.ds_embedding import get_ds_embedding
 from apps.datasource.models.datasource import CoreDatasource
-from apps.db.db import exec_sql, get_version, check_connection
+from apps.db.constant import DB
+from apps.db.db import exec_sql, get_version, check_connection, get_ds_conf_hash
+from apps.db.result_cache import QueryResultCache
+from apps.db.sql_limit import apply_row_limit
 from apps.system.crud.assistant import AssistantOutDs, AssistantOutDsFactory, get_assistant_ds
 from apps.system.schemas.system_schema import AssistantOutDsSchema
 from apps.terminology.curd.terminology import get_terminology_template
 from common.core.config import settings
 from common.core.db import engine
 from common.core.deps import CurrentAssistant, CurrentUser
-from common.error import SingleMessageError, SQLBotDBError, ParseSQLResultError, SQLBotDBConnectionError
+from common.error import SingleMessageError, SQLBotDBError, ParseSQLResultError, SQLBotDBConnectionError, \
+    TaskCancelledError, DatasourceBusyError
+from common.utils.cancellation import CancellationToken, CancellationRegistry
 from common.utils.data_format import DataFormat
-from common.utils.utils import SQLBotLogUtil, extract_nested_json, prepare_for_orjson
+from common.utils.utils import SQLBotLogUtil, extract_nested_json
 
 warnings.filterwarnings("ignore")
 
 base_message_count_limit = 6
 
+sql_data_limit = 1000
+
 executor = ThreadPoolExecutor(max_workers=200)
 
 dynamic_ds_types = [1, 3]
@@ -82,6 +91,7 @@ class LLMService:
 
     chunk_list: List[str] = []
     future: Future
+    cancel_token: CancellationToken
 
     last_execute_sql_error: str = None
     articles_number: int = 4
@@ -90,6 +100,9 @@ class LLMService:
                  current_assistant: Optional[CurrentAssistant] = None, no_reasoning: bool = False,
                  embedding: bool = False, config: LLMConfig = None):
         self.chunk_list = []
+        self.cancel_token = CancellationToken()
+        # question embeddings shared by all retrieval steps of this request
+        self.embedding_context = EmbeddingContext()
         self.current_user = current_user
         self.current_assistant = current_assistant
         chat_id = chat_question.chat_id
@@ -112,7 +125,8 @@ class LLMService:
                     raise SingleMessageError("No available datasource configuration found")
                 chat_question.engine = (ds.type_name if ds.type != 'excel' else 'PostgreSQL') + get_version(ds)
                 chat_question.db_schema = get_table_schema(session=session, current_user=current_user, ds=ds,
-                                                           question=chat_question.question, embedding=embedding)
+                                                           question=chat_question.question, embedding=embedding,
+                                                           embedding_context=self.embedding_context)
 
         self.generate_sql_logs = list_generate_sql_logs(session=session, chart_id=chat_id)
         self.generate_chart_logs = list_generate_chart_logs(session=session, chart_id=chat_id)
@@ -164,6 +178,20 @@ class LLMService:
         except Exception as e:
             return True
 
+    def cancel(self, reason: str = 'cancelled'):
+        """Stop the llm stream and the running sql of this task."""
+        if not self.cancel_token.cancelled:
+            SQLBotLogUtil.info(f"Cancel chat task: {reason}")
+        self.cancel_token.cancel(reason)
+
+    def register_cancel(self):
+        if getattr(self, 'record', None) is not None and self.record.id is not None:
+            CancellationRegistry.register(self.record.id, self.cancel_token)
+
+    def unregister_cancel(self):
+        if getattr(self, 'record', None) is not None and self.record.id is not None:
+            CancellationRegistry.unregister(self.record.id, self.cancel_token)
+
     def init_messages(self):
         last_sql_messages: List[dict[str, Any]] = self.generate_sql_logs[-1].messages if len(
             self.generate_sql_logs) > 0 else []
@@ -225,12 +253,13 @@ class LLMService:
         fields = self.get_fields_from_chart(_session)
         self.chat_question.fields = orjson.dumps(fields).decode()
         data = get_chat_chart_data(_session, self.record.id)
-        self.chat_question.data = orjson.dumps(data.get('data')).decode()
+        self.chat_question.data = orjson.dumps(DataFormat.get_object_array(data)).decode()
         analysis_msg: List[Union[BaseMessage, dict[str, Any]]] = []
 
         ds_id = self.ds.id if isinstance(self.ds, CoreDatasource) else None
         self.chat_question.terminologies = get_terminology_template(_session, self.chat_question.question,
-                                                                    self.current_user.oid, ds_id)
+                                                                    self.current_user.oid, ds_id,
+                                                                    self.embedding_context)
         if SQLBotLicenseUtil.valid():
             self.chat_question.custom_prompt = find_custom_prompts(_session, CustomPromptTypeEnum.ANALYSIS,
                                                                    self.current_user.oid, ds_id)
@@ -251,7 +280,7 @@ class LLMService:
         full_thinking_text = ''
         full_analysis_text = ''
         token_usage = {}
-        res = process_stream(self.llm.stream(analysis_msg), token_usage)
+        res = process_stream(self.llm.stream(analysis_msg), token_usage, cancel_token=self.cancel_token)
         for chunk in res:
             if chunk.get('content'):
                 full_analysis_text += chunk.get('content')
@@ -277,7 +306,7 @@ class LLMService:
         fields = self.get_fields_from_chart(_session)
         self.chat_question.fields = orjson.dumps(fields).decode()
         data = get_chat_chart_data(_session, self.record.id)
-        self.chat_question.data = orjson.dumps(data.get('data')).decode()
+        self.chat_question.data = orjson.dumps(DataFormat.get_object_array(data)).decode()
 
         if SQLBotLicenseUtil.valid():
             ds_id = self.ds.id if isinstance(self.ds, CoreDatasource) else None
@@ -301,7 +330,7 @@ class LLMService:
         full_thinking_text = ''
         full_predict_text = ''
         token_usage = {}
-        res = process_stream(self.llm.stream(predict_msg), token_usage)
+        res = process_stream(self.llm.stream(predict_msg), token_usage, cancel_token=self.cancel_token)
         for chunk in res:
             if chunk.get('content'):
                 full_predict_text += chunk.get('content')
@@ -331,7 +360,7 @@ class LLMService:
                 session=_session,
                 current_user=self.current_user, ds=self.ds,
                 question=self.chat_question.question,
-                embedding=False)
+                embedding=False, embedding_context=self.embedding_context)
 
         guess_msg: List[Union[BaseMessage, dict[str, Any]]] = []
         guess_msg.append(SystemMessage(content=self.chat_question.guess_sys_question(self.articles_number)))
@@ -353,7 +382,7 @@ class LLMService:
         full_thinking_text = ''
         full_guess_text = ''
         token_usage = {}
-        res = process_stream(self.llm.stream(guess_msg), token_usage)
+        res = process_stream(self.llm.stream(guess_msg), token_usage, cancel_token=self.cancel_token)
         for chunk in res:
             if chunk.get('content'):
                 full_guess_text += chunk.get('content')
@@ -404,7 +433,8 @@ class LLMService:
             if settings.TABLE_EMBEDDING_ENABLED and (
                     not self.current_assistant or (self.current_assistant and self.current_assistant.type != 1)):
                 _ds_list = get_ds_embedding(_session, self.current_user, _ds_list, self.out_ds_instance,
-                                            self.chat_question.question, self.current_assistant)
+                                            self.chat_question.question, self.current_assistant,
+                                            self.embedding_context)
                 # yield {'content': '{"id":' + str(ds.get('id')) + '}'}
 
             _ds_list_dict = []
@@ -424,7 +454,7 @@ class LLMService:
                                                                                          msg in datasource_msg])
 
             token_usage = {}
-            res = process_stream(self.llm.stream(datasource_msg), token_usage)
+            res = process_stream(self.llm.stream(datasource_msg), token_usage, cancel_token=self.cancel_token)
             for chunk in res:
                 if chunk.get('content'):
                     full_text += chunk.get('content')
@@ -476,7 +506,8 @@ class LLMService:
                         self.ds)
                     self.chat_question.db_schema = get_table_schema(session=_session,
                                                                     current_user=self.current_user, ds=self.ds,
-                                                                    question=self.chat_question.question)
+                                                                    question=self.chat_question.question,
+                                                                    embedding_context=self.embedding_context)
                     _engine_type = self.chat_question.engine
                     _chat.engine_type = _ds.type_name
                 # save chat
@@ -509,13 +540,15 @@ class LLMService:
             ds_id = self.ds.id if isinstance(self.ds, CoreDatasource) else None
 
             self.chat_question.terminologies = get_terminology_template(_session, self.chat_question.question, oid,
-                                                                        ds_id)
+                                                                        ds_id, self.embedding_context)
             if self.current_assistant and self.current_assistant.type == 1:
                 self.chat_question.data_training = get_training_template(_session, self.chat_question.question,
-                                                                         oid, None, self.current_assistant.id)
+                                                                         oid, None, self.current_assistant.id,
+                                                                         self.embedding_context)
             else:
                 self.chat_question.data_training = get_training_template(_session, self.chat_question.question,
-                                                                         oid, ds_id)
+                                                                         oid, ds_id,
+                                                                         embedding_context=self.embedding_context)
             if SQLBotLicenseUtil.valid():
                 self.chat_question.custom_prompt = find_custom_prompts(_session, CustomPromptTypeEnum.GENERATE_SQL,
                                                                        oid, ds_id)
@@ -542,7 +575,7 @@ class LLMService:
         full_thinking_text = ''
         full_sql_text = ''
         token_usage = {}
-        res = process_stream(self.llm.stream(self.sql_message), token_usage)
+        res = process_stream(self.llm.stream(self.sql_message), token_usage, cancel_token=self.cancel_token)
         for chunk in res:
             if chunk.get('content'):
                 full_sql_text += chunk.get('content')
@@ -582,7 +615,7 @@ class LLMService:
         full_thinking_text = ''
         full_dynamic_text = ''
         token_usage = {}
-        res = process_stream(self.llm.stream(dynamic_sql_msg), token_usage)
+        res = process_stream(self.llm.stream(dynamic_sql_msg), token_usage, cancel_token=self.cancel_token)
         for chunk in res:
             if chunk.get('content'):
                 full_dynamic_text += chunk.get('content')
@@ -640,7 +673,7 @@ class LLMService:
         full_thinking_text = ''
         full_filter_text = ''
         token_usage = {}
-        res = process_stream(self.llm.stream(permission_sql_msg), token_usage)
+        res = process_stream(self.llm.stream(permission_sql_msg), token_usage, cancel_token=self.cancel_token)
         for chunk in res:
             if chunk.get('content'):
                 full_filter_text += chunk.get('content')
@@ -695,7 +728,7 @@ class LLMService:
         full_thinking_text = ''
         full_chart_text = ''
         token_usage = {}
-        res = process_stream(self.llm.stream(self.chart_message), token_usage)
+        res = process_stream(self.llm.stream(self.chart_message), token_usage, cancel_token=self.cancel_token)
         for chunk in res:
             if chunk.get('content'):
                 full_chart_text += chunk.get('content')
@@ -852,15 +885,14 @@ class LLMService:
 
     def save_sql_data(self, session: Session, data_obj: Dict[str, Any]):
         try:
-            data_result = data_obj.get('data')
-            limit = 1000
-            if data_result:
-                data_result = prepare_for_orjson(data_result)
-                if data_result and len(data_result) > limit and settings.GENERATE_SQL_QUERY_LIMIT_ENABLED:
-                    data_obj['data'] = data_result[:limit]
-                    data_obj['limit'] = limit
-                else:
-                    data_obj['data'] = data_result
+            columns = data_obj.get('columns')
+            limit = sql_data_limit
+            if columns and len(columns[0]) > limit and settings.GENERATE_SQL_QUERY_LIMIT_ENABLED:
+                data_obj['columns'] = [column[:limit] for column in columns]
+                data_obj['limit'] = limit
+            # rows over the limit were not read at all
+            if data_obj.get('truncated'):
+                data_obj['limit'] = limit
             return save_sql_exec_data(session=session, record_id=self.record.id,
                                       data=orjson.dumps(data_obj).decode())
         except Exception as e:
@@ -869,21 +901,39 @@ class LLMService:
     def finish(self, session: Session):
         return finish_record(session=session, record_id=self.record.id)
 
-    def execute_sql(self, sql: str):
+    def execute_sql(self, sql: str, session: Optional[Session] = None):
         """Execute SQL query
 
         Args:
             ds: Data source instance
             sql: SQL query statement
+            session: used to check the permissions of current user when result cache is enabled
 
         Returns:
             Query results
         """
-        SQLBotLogUtil.info(f"Executing SQL on ds_id {self.ds.id}: {sql}")
         try:
-            return exec_sql(ds=self.ds, sql=sql, origin_column=False)
+            max_rows = sql_data_limit if settings.GENERATE_SQL_QUERY_LIMIT_ENABLED else 0
+            if max_rows > 0 and settings.SQL_LIMIT_PUSHDOWN_ENABLED:
+                # let the database cut the result, one row more tells whether it is truncated
+                db = DB.get_db(self.ds.type)
+                # the cached server version decides between FETCH FIRST and ROWNUM on oracle
+                version = get_version(self.ds) if db == DB.oracle else None
+                sql = apply_row_limit(sql, db, max_rows + 1, version)
+            SQLBotLogUtil.info(f"Executing SQL on ds_id {self.ds.id}: {sql}")
+            if settings.QUERY_RESULT_CACHE_ENABLED and session is not None and isinstance(self.ds, CoreDatasource):
+                fingerprint = get_permission_fingerprint(session, self.current_user, self.ds)
+                return QueryResultCache.get_or_execute(
+                    self.ds.id, get_ds_conf_hash(self.ds), sql, fingerprint,
+                    lambda: exec_sql(ds=self.ds, sql=sql, origin_column=False, max_rows=max_rows,
+                                     cancel_token=self.cancel_token, arrow=True), max_rows)
+            return exec_sql(ds=self.ds, sql=sql, origin_column=False, max_rows=max_rows,
+                            cancel_token=self.cancel_token, arrow=True)
         except Exception as e:
-            if isinstance(e, ParseSQLResultError):
+            if self.cancel_token.cancelled:
+                # the driver error of a cancelled statement is not a failure of the sql
+                self.cancel_token.raise_if_cancelled()
+            if isinstance(e, (ParseSQLResultError, DatasourceBusyError)):
                 raise e
             else:
                 err = traceback.format_exc(limit=1, chain=True)
@@ -897,29 +947,60 @@ class LLMService:
             return None
 
     def await_result(self):
-        while self.is_running():
+        try:
+            while self.is_running():
+                while True:
+                    chunk = self.pop_chunk()
+                    if chunk is not None:
+                        yield chunk
+                    else:
+                        break
             while True:
                 chunk = self.pop_chunk()
-                if chunk is not None:
+                if chunk is None:
+                    break
+                yield chunk
+        except GeneratorExit:
+            # response closed before the task finished, this generator already runs on its own thread
+            if not self.future.done():
+                self.cancel('client disconnected')
+            raise
+
+    async def await_result_async(self):
+        """Same chunks as await_result without holding a thread, the task is cancelled once the client
+        disconnects."""
+        try:
+            while True:
+                done = self.future.done()
+                chunk = self.pop_chunk()
+                while chunk is not None:
                     yield chunk
-                else:
+                    chunk = self.pop_chunk()
+                if done:
                     break
-        while True:
-            chunk = self.pop_chunk()
-            if chunk is None:
-                break
-            yield chunk
+                await asyncio.sleep(0.1)
+        except (asyncio.CancelledError, GeneratorExit):
+            if not self.future.done():
+                # cancel callbacks may talk to the datasource, keep them off the event loop and off the task
+                # executor, which may be saturated by the tasks to cancel
+                threading.Thread(target=self.cancel, args=('client disconnected',), name='chat-cancel',
+                                 daemon=True).start()
+            raise
 
     def run_task_async(self, in_chat: bool = True, stream: bool = True,
                        finish_step: ChatFinishStep = ChatFinishStep.GENERATE_CHART):
         if in_chat:
             stream = True
+        self.register_cancel()
         self.future = executor.submit(self.run_task_cache, in_chat, stream, finish_step)
 
     def run_task_cache(self, in_chat: bool = True, stream: bool = True,
                        finish_step: ChatFinishStep = ChatFinishStep.GENERATE_CHART):
-        for chunk in self.run_task(in_chat, stream, finish_step):
-            self.chunk_list.append(chunk)
+        try:
+            for chunk in self.run_task(in_chat, stream, finish_step):
+                self.chunk_list.append(chunk)
+        finally:
+            self.unregister_cancel()
 
     def run_task(self, in_chat: bool = True, stream: bool = True,
                  finish_step: ChatFinishStep = ChatFinishStep.GENERATE_CHART):
@@ -931,13 +1012,15 @@ class LLMService:
                 oid = self.ds.oid if isinstance(self.ds, CoreDatasource) else 1
                 ds_id = self.ds.id if isinstance(self.ds, CoreDatasource) else None
                 self.chat_question.terminologies = get_terminology_template(_session, self.chat_question.question,
-                                                                            oid, ds_id)
+                                                                            oid, ds_id, self.embedding_context)
                 if self.current_assistant and self.current_assistant.type == 1:
                     self.chat_question.data_training = get_training_template(_session, self.chat_question.question,
-                                                                             oid, None, self.current_assistant.id)
+                                                                             oid, None, self.current_assistant.id,
+                                                                             self.embedding_context)
                 else:
                     self.chat_question.data_training = get_training_template(_session, self.chat_question.question,
-                                                                             oid, ds_id)
+                                                                             oid, ds_id,
+                                                                             embedding_context=self.embedding_context)
                 if SQLBotLicenseUtil.valid():
                     self.chat_question.custom_prompt = find_custom_prompts(_session,
                                                                            CustomPromptTypeEnum.GENERATE_SQL,
@@ -970,12 +1053,14 @@ class LLMService:
                     session=_session,
                     current_user=self.current_user,
                     ds=self.ds,
-                    question=self.chat_question.question)
+                    question=self.chat_question.question,
+                    embedding_context=self.embedding_context)
             else:
                 self.validate_history_ds(_session)
 
+            self.cancel_token.raise_if_cancelled()
             # check connection
-            connected = check_connection(ds=self.ds, trans=None)
+            connected = check_connection(ds=self.ds, trans=None, use_cache=True)
             if not connected:
                 raise SQLBotDBConnectionError('Connect DB failed')
 
@@ -1067,16 +1152,16 @@ class LLMService:
                     yield json_result
                 return
 
-            result = self.execute_sql(sql=real_execute_sql)
+            self.cancel_token.raise_if_cancelled()
+            result = self.execute_sql(sql=real_execute_sql, session=_session)
 
-            _data = DataFormat.convert_large_numbers_in_object_array(result.get('data'))
-            result["data"] = _data
+            result["columns"] = DataFormat.process_result_columns(result.get('columns'))
 
             self.save_sql_data(session=_session, data_obj=result)
             if in_chat:
                 yield 'data:' + orjson.dumps({'content': 'execute-success', 'type': 'sql-data'}).decode() + '\n\n'
             if not stream:
-                json_result['data'] = get_chat_chart_data(_session, self.record.id)
+                json_result['data'] = DataFormat.to_object_result(get_chat_chart_data(_session, self.record.id))
 
             if finish_step.value <= ChatFinishStep.QUERY_DATA.value:
                 if stream:
@@ -1087,15 +1172,14 @@ class LLMService:
                         for field in result.get('fields'):
                             _column_list.append(AxisObj(name=field, value=field))
 
-                        md_data, _fields_list = DataFormat.convert_object_array_for_pandas(_column_list,
-                                                                                           result.get('data'))
+                        df = DataFormat.columns_to_dataframe(_column_list, result.get('fields'),
+                                                             result.get('columns'))
 
                         # data, _fields_list, col_formats = self.format_pd_data(_column_list, result.get('data'))
 
-                        if not _data or not _fields_list:
+                        if df.empty:
                             yield 'The SQL execution result is empty.\n\n'
                         else:
-                            df = pd.DataFrame(_data, columns=_fields_list)
                             df_safe = DataFormat.safe_convert_to_string(df)
                             markdown_table = df_safe.to_markdown(index=False)
                             yield markdown_table + '\n\n'
@@ -1103,6 +1187,7 @@ class LLMService:
                     yield json_result
                 return
 
+            self.cancel_token.raise_if_cancelled()
             # generate chart
             chart_res = self.generate_chart(_session, chart_type)
             full_chart_text = ''
@@ -1146,14 +1231,13 @@ class LLMService:
                         _column_list.append(
                             AxisObj(name=field if not _fields.get(field) else _fields.get(field), value=field))
 
-                    md_data, _fields_list = DataFormat.convert_object_array_for_pandas(_column_list, result.get('data'))
+                    df = DataFormat.columns_to_dataframe(_column_list, result.get('fields'), result.get('columns'))
 
                     # data, _fields_list, col_formats = self.format_pd_data(_column_list, result.get('data'))
 
-                    if not md_data or not _fields_list:
+                    if df.empty:
                         yield 'The SQL execution result is empty.\n\n'
                     else:
-                        df = pd.DataFrame(md_data, columns=_fields_list)
                         df_safe = DataFormat.safe_convert_to_string(df)
                         markdown_table = df_safe.to_markdown(index=False)
                         yield markdown_table + '\n\n'
@@ -1182,7 +1266,9 @@ class LLMService:
         except Exception as e:
             traceback.print_exc()
             error_msg: str
-            if isinstance(e, SingleMessageError):
+            if isinstance(e, TaskCancelledError) or self.cancel_token.cancelled:
+                error_msg = orjson.dumps({'message': 'Task cancelled', 'type': 'cancelled'}).decode()
+            elif isinstance(e, SingleMessageError):
                 error_msg = str(e)
             elif isinstance(e, SQLBotDBConnectionError):
                 error_msg = orjson.dumps(
@@ -1235,11 +1321,15 @@ class LLMService:
 
     def run_analysis_or_predict_task_async(self, session: Session, action_type: str, base_record: ChatRecord):
         self.set_record(save_analysis_predict_record(session, base_record, action_type))
+        self.register_cancel()
         self.future = executor.submit(self.run_analysis_or_predict_task_cache, action_type)
 
     def run_analysis_or_predict_task_cache(self, action_type: str):
-        for chunk in self.run_analysis_or_predict_task(action_type):
-            self.chunk_list.append(chunk)
+        try:
+            for chunk in self.run_analysis_or_predict_task(action_type):
+                self.chunk_list.append(chunk)
+        finally:
+            self.unregister_cancel()
 
     def run_analysis_or_predict_task(self, action_type: str):
         _session = None
@@ -1280,7 +1370,9 @@ class LLMService:
             self.finish(_session)
         except Exception as e:
             error_msg: str
-            if isinstance(e, SingleMessageError):
+            if isinstance(e, TaskCancelledError) or self.cancel_token.cancelled:
+                error_msg = orjson.dumps({'message': 'Task cancelled', 'type': 'cancelled'}).decode()
+            elif isinstance(e, SingleMessageError):
                 error_msg = str(e)
             else:
                 error_msg = orjson.dumps({'message': str(e), 'traceback': traceback.format_exc(limit=1)}).decode()
@@ -1390,7 +1482,8 @@ def process_stream(res: Iterator[BaseMessageChunk],
                    token_usage: Dict[str, Any] = None,
                    enable_tag_parsing: bool = settings.PARSE_REASONING_BLOCK_ENABLED,
                    start_tag: str = settings.DEFAULT_REASONING_CONTENT_START,
-                   end_tag: str = settings.DEFAULT_REASONING_CONTENT_END
+                   end_tag: str = settings.DEFAULT_REASONING_CONTENT_END,
+                   cancel_token: Optional[CancellationToken] = None
                    ):
     if token_usage is None:
         token_usage = {}
@@ -1399,6 +1492,11 @@ def process_stream(res: Iterator[BaseMessageChunk],
     pending_start_tag = ''  # 用于缓存可能被截断的开始标签部分
 
     for chunk in res:
+        if cancel_token is not None and cancel_token.cancelled:
+            # 关闭模型的流式响应，不再继续生成
+            if hasattr(res, 'close'):
+                res.close()
+            cancel_token.raise_if_cancelled()
         SQLBotLogUtil.info(chunk)
         reasoning_content_chunk = ''
         content = chunk.content
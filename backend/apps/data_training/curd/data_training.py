@@ -8,7 +8,8 @@ import dicttoxml
 from sqlalchemy import and_, select, func, delete, update, or_
 from sqlalchemy import text
 
-from apps.ai_model.embedding import EmbeddingModelCache
+from apps.ai_model.embedding import EmbeddingModelCache, EmbeddingContext, embed_query
+from apps.datasource.embedding.utils import ensure_hnsw_index, format_vector_sql, set_hnsw_search_options
 from apps.data_training.models.data_training_model import DataTrainingInfo, DataTraining, DataTrainingInfoResult
 from apps.datasource.models.datasource import CoreDatasource
 from apps.system.models.system_model import AssistantModel
@@ -452,7 +453,7 @@ def run_fill_empty_embeddings(session_maker):
         session_maker.remove()
 
 
-def save_embeddings(session_maker, ids: List[int]):
+def save_embeddings(session_maker, ids: List[int], raise_errors: bool = False):
     if not settings.EMBEDDING_ENABLED:
         return
 
@@ -467,6 +468,8 @@ def save_embeddings(session_maker, ids: List[int]):
         model = EmbeddingModelCache.get_model()
 
         results = model.embed_documents(_question_list)
+        if results:
+            ensure_hnsw_index('data_training', len(results[0]))
 
         for index in range(len(results)):
             item = results[index]
@@ -476,36 +479,44 @@ def save_embeddings(session_maker, ids: List[int]):
 
     except Exception:
         traceback.print_exc()
+        if raise_errors:
+            raise
     finally:
         session_maker.remove()
 
 
+# nearest questions first so the hnsw index can be used, the similarity threshold is applied to them afterwards
 embedding_sql = f"""
 SELECT id, datasource, question, similarity
 FROM
-(SELECT id, datasource, question, oid, enabled,
-( 1 - (embedding <=> :embedding_array) ) AS similarity
+(SELECT id, datasource, question,
+( 1 - {{distance}} ) AS similarity
 FROM data_training AS child
+WHERE {{dimension_filter}} and oid = :oid and datasource = :datasource and enabled = true
+ORDER BY {{distance}}
+LIMIT {settings.EMBEDDING_DATA_TRAINING_TOP_COUNT}
 ) TEMP
-WHERE similarity > {settings.EMBEDDING_DATA_TRAINING_SIMILARITY} and oid = :oid and datasource = :datasource and enabled = true
+WHERE similarity > {settings.EMBEDDING_DATA_TRAINING_SIMILARITY}
 ORDER BY similarity DESC
-LIMIT {settings.EMBEDDING_DATA_TRAINING_TOP_COUNT}
 """
 embedding_sql_in_advanced_application = f"""
 SELECT id, advanced_application, question, similarity
 FROM
-(SELECT id, advanced_application, question, oid, enabled,
-( 1 - (embedding <=> :embedding_array) ) AS similarity
+(SELECT id, advanced_application, question,
+( 1 - {{distance}} ) AS similarity
 FROM data_training AS child
+WHERE {{dimension_filter}} and oid = :oid and advanced_application = :advanced_application and enabled = true
+ORDER BY {{distance}}
+LIMIT {settings.EMBEDDING_DATA_TRAINING_TOP_COUNT}
 ) TEMP
-WHERE similarity > {settings.EMBEDDING_DATA_TRAINING_SIMILARITY} and oid = :oid and advanced_application = :advanced_application and enabled = true
+WHERE similarity > {settings.EMBEDDING_DATA_TRAINING_SIMILARITY}
 ORDER BY similarity DESC
-LIMIT {settings.EMBEDDING_DATA_TRAINING_TOP_COUNT}
 """
 
 
 def select_training_by_question(session: SessionDep, question: str, oid: int, datasource: Optional[int] = None,
-                                advanced_application_id: Optional[int] = None):
+                                advanced_application_id: Optional[int] = None,
+                                embedding_context: Optional[EmbeddingContext] = None):
     if question.strip() == "":
         return []
 
@@ -536,16 +547,16 @@ def select_training_by_question(session: SessionDep, question: str, oid: int, da
     if settings.EMBEDDING_ENABLED:
         with session.begin_nested():
             try:
-                model = EmbeddingModelCache.get_model()
-
-                embedding = model.embed_query(question)
+                embedding = embed_query(question, embedding_context)
+                dimension = len(embedding)
+                set_hnsw_search_options(session)
 
                 if advanced_application_id is not None:
-                    results = session.execute(text(embedding_sql_in_advanced_application),
+                    results = session.execute(text(format_vector_sql(embedding_sql_in_advanced_application, dimension)),
                                               {'embedding_array': str(embedding), 'oid': oid,
                                                'advanced_application': advanced_application_id})
                 else:
-                    results = session.execute(text(embedding_sql),
+                    results = session.execute(text(format_vector_sql(embedding_sql, dimension)),
                                               {'embedding_array': str(embedding), 'oid': oid, 'datasource': datasource})
 
                 for row in results:
@@ -610,12 +621,14 @@ def to_xml_string(_dict: list[dict] | dict, root: str = 'sql-examples') -> str:
 
 
 def get_training_template(session: SessionDep, question: str, oid: Optional[int] = 1, datasource: Optional[int] = None,
-                          advanced_application_id: Optional[int] = None) -> str:
+                          advanced_application_id: Optional[int] = None,
+                          embedding_context: Optional[EmbeddingContext] = None) -> str:
     if not oid:
         oid = 1
     if not datasource and not advanced_application_id:
         return ''
-    _results = select_training_by_question(session, question, oid, datasource, advanced_application_id)
+    _results = select_training_by_question(session, question, oid, datasource, advanced_application_id,
+                                           embedding_context)
     if _results and len(_results) > 0:
         data_training = to_xml_string(_results)
         template = get_base_data_training_template().format(data_training=data_training)
@@ -10,15 +10,20 @@ import orjson
 import pandas as pd
 from fastapi import APIRouter, File, UploadFile, HTTPException
 
+from apps.db.async_db import async_exec_sql
+from apps.db.bulkhead import DsBulkhead
 from apps.db.db import get_schema
 from apps.db.engine import get_engine_conn
+from apps.db.result_cache import QueryResultCache
 from common.core.config import settings
 from common.core.deps import SessionDep, CurrentUser, Trans
+from common.utils.data_format import DataFormat
 from common.utils.utils import SQLBotLogUtil
 from ..crud.datasource import get_datasource_list, check_status, create_ds, update_ds, delete_ds, getTables, getFields, \
-    execSql, update_table_and_fields, getTablesByDs, chooseTables, preview, updateTable, updateField, get_ds, fieldEnum, \
-    check_status_by_id
+    update_table_and_fields, getTablesByDs, chooseTables, get_preview_sql, updateTable, updateField, get_ds, \
+    get_field_enum_sql, get_field_enum_values, check_status_by_id, get_ws_ds
 from ..crud.field import get_fields_by_table_id
+from ..crud.schema_refresh import SchemaRefresher
 from ..crud.table import get_tables_by_ds_id
 from ..models.datasource import CoreDatasource, CreateDatasource, TableObj, CoreTable, CoreField
 
@@ -59,6 +64,33 @@ async def check_by_id(session: SessionDep, trans: Trans, ds_id: int):
     return await asyncio.to_thread(inner)
 
 
+@router.get("/queryCache/stats")
+async def query_cache_stats():
+    return QueryResultCache.stats()
+
+
+@router.get("/bulkhead/stats")
+async def bulkhead_stats():
+    return DsBulkhead.stats()
+
+
+@router.post("/schemaRefresh/{id}")
+async def schema_refresh(session: SessionDep, user: CurrentUser, id: int):
+    get_ws_ds(session, user, id)
+    return SchemaRefresher.trigger(id)
+
+
+@router.get("/schemaRefresh/status")
+async def schema_refresh_status_list(session: SessionDep, user: CurrentUser):
+    return SchemaRefresher.get_all_status({ds.id for ds in get_datasource_list(session=session, user=user)})
+
+
+@router.get("/schemaRefresh/status/{id}")
+async def schema_refresh_status(session: SessionDep, user: CurrentUser, id: int):
+    get_ws_ds(session, user, id)
+    return SchemaRefresher.get_status(id)
+
+
 @router.post("/add", response_model=CoreDatasource)
 async def add(session: SessionDep, trans: Trans, user: CurrentUser, ds: CreateDatasource):
     def inner():
@@ -85,7 +117,9 @@ async def update(session: SessionDep, trans: Trans, user: CurrentUser, ds: CoreD
 
 @router.post("/delete/{id}", response_model=CoreDatasource)
 async def delete(session: SessionDep, id: int):
-    return delete_ds(session, id)
+    ds = delete_ds(session, id)
+    SchemaRefresher.invalidate(id)
+    return ds
 
 
 @router.post("/getTables/{id}")
@@ -145,17 +179,18 @@ class TestObj(BaseModel):
 @router.post("/execSql/{id}")
 async def exec_sql(session: SessionDep, id: int, obj: TestObj):
     def inner():
-        data = execSql(session, id, obj.sql)
-        try:
-            data_obj = data.get('data')
-            # print(orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS).decode())
-            print(orjson.dumps(data_obj).decode())
-        except Exception:
-            traceback.print_exc()
+        return get_ds(session, id)
 
-        return data
+    ds = await asyncio.to_thread(inner)
+    data = DataFormat.to_object_result(await async_exec_sql(ds, obj.sql, True))
+    try:
+        data_obj = data.get('data')
+        # print(orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS).decode())
+        print(orjson.dumps(data_obj).decode())
+    except Exception:
+        traceback.print_exc()
 
-    return await asyncio.to_thread(inner)
+    return data
 
 
 @router.post("/tableList/{id}")
@@ -185,27 +220,36 @@ async def edit_field(session: SessionDep, field: CoreField):
 
 @router.post("/previewData/{id}")
 async def preview_data(session: SessionDep, trans: Trans, current_user: CurrentUser, id: int, data: TableObj):
-    def inner():
-        try:
-            return preview(session, current_user, id, data)
-        except Exception as e:
+    try:
+        def inner():
+            return get_preview_sql(session, current_user, id, data)
+
+        ds, sql = await asyncio.to_thread(inner)
+        if not sql:
+            return {"fields": [], "data": [], "sql": ''}
+        return DataFormat.to_object_result(await async_exec_sql(ds, sql, True))
+    except Exception as e:
+        def inner():
             ds = session.query(CoreDatasource).filter(CoreDatasource.id == id).first()
             # check ds status
-            status = check_status(session, trans, ds, True)
-            if status:
-                SQLBotLogUtil.error(f"Preview failed: {e}")
-                raise HTTPException(status_code=500, detail=f'Preview Failed: {e.args}')
+            return check_status(session, trans, ds, True)
 
-    return await asyncio.to_thread(inner)
+        status = await asyncio.to_thread(inner)
+        if status:
+            SQLBotLogUtil.error(f"Preview failed: {e}")
+            raise HTTPException(status_code=500, detail=f'Preview Failed: {e.args}')
 
 
 # not used
 @router.post("/fieldEnum/{id}")
 async def field_enum(session: SessionDep, id: int):
     def inner():
-        return fieldEnum(session, id)
+        return get_field_enum_sql(session, id)
 
-    return await asyncio.to_thread(inner)
+    ds, sql = await asyncio.to_thread(inner)
+    if not sql:
+        return []
+    return get_field_enum_values(await async_exec_sql(ds, sql, True))
 
 
 # @router.post("/uploadExcel")
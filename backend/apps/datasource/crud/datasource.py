@@ -7,14 +7,20 @@ from sqlalchemy import and_, text
 from sqlbot_xpack.permissions.models.ds_rules import DsRules
 from sqlmodel import select
 
+from apps.ai_model.embedding import EmbeddingContext
 from apps.datasource.crud.permission import get_column_permission_fields, get_row_permission_filters, is_normal_user
 from apps.datasource.embedding.table_embedding import calc_table_embedding
+from apps.datasource.embedding.table_matrix import TableEmbeddingMatrixCache
 from apps.datasource.utils.utils import aes_decrypt
 from apps.db.constant import DB
-from apps.db.db import get_tables, get_fields, exec_sql, check_connection
+from apps.db.db import get_tables, get_fields, get_all_fields, exec_sql, check_connection
+from apps.db.ds_health import DsHealthCache
+from apps.db.ds_pool import DsPoolCache
+from apps.db.result_cache import QueryResultCache
 from apps.db.engine import get_engine_config, get_engine_conn
 from common.core.config import settings
 from common.core.deps import SessionDep, CurrentUser, Trans
+from common.utils.data_format import DataFormat
 from common.utils.embedding_threads import run_save_table_embeddings, run_save_ds_embeddings
 from common.utils.utils import deepcopy_ignore_extra
 from .table import get_tables_by_ds_id
@@ -105,6 +111,10 @@ def update_ds(session: SessionDep, trans: Trans, user: CurrentUser, ds: CoreData
         setattr(record, field, value)
     session.add(record)
     session.commit()
+    # configuration may be changed, drop cached connections
+    DsPoolCache.invalidate(ds.id)
+    QueryResultCache.invalidate(ds.id)
+    DsHealthCache.invalidate(ds.id)
 
     run_save_ds_embeddings([ds.id])
     return ds
@@ -128,6 +138,10 @@ def delete_ds(session: SessionDep, id: int):
 
     session.delete(term)
     session.commit()
+    DsPoolCache.invalidate(id)
+    QueryResultCache.invalidate(id)
+    DsHealthCache.invalidate(id)
+    TableEmbeddingMatrixCache.invalidate(id)
     delete_table_by_ds_id(session, id)
     delete_field_by_ds_id(session, id)
     return {
@@ -158,84 +172,119 @@ def getFieldsByDs(session: SessionDep, ds: CoreDatasource, table_name: str):
     return fields
 
 
+# advisory lock class of the table and field sync of one datasource, the second key is the datasource id
+ds_schema_lock_class = 5001
+
+
+def lock_ds_schema(session: SessionDep, ds_id: int, wait: bool = True) -> bool:
+    """Serialize table syncs of a datasource across processes, the lock is released with the transaction."""
+    func = 'pg_advisory_xact_lock' if wait else 'pg_try_advisory_xact_lock'
+    row = session.execute(text(f"SELECT {func}(:lock_class, CAST(:ds_id % 2147483647 AS integer))"),
+                          {"lock_class": ds_schema_lock_class, "ds_id": ds_id}).first()
+    return wait or bool(row[0])
+
+
+def get_ws_ds(session: SessionDep, user: CurrentUser, id: int) -> CoreDatasource:
+    """Datasource of the current workspace of the user."""
+    ds = session.get(CoreDatasource, id)
+    current_oid = user.oid if user.oid is not None else 1
+    if ds is None or ds.oid != current_oid:
+        raise HTTPException(status_code=404, detail=f"Datasource with id {id} not found")
+    return ds
+
+
 def execSql(session: SessionDep, id: int, sql: str):
     ds = session.exec(select(CoreDatasource).where(CoreDatasource.id == id)).first()
-    return exec_sql(ds, sql, True)
+    return DataFormat.to_object_result(exec_sql(ds, sql, True))
 
 
 def sync_table(session: SessionDep, ds: CoreDatasource, tables: List[CoreTable]):
-    id_list = []
+    # waits for a schema refresh of the datasource in any process
+    lock_ds_schema(session, ds.id)
+    # load existing tables and fields once, write everything in one transaction
+    table_records = {}
+    for record in session.query(CoreTable).filter(CoreTable.ds_id == ds.id).order_by(CoreTable.id).all():
+        table_records.setdefault(record.table_name, record)
+
+    new_tables = []
     for item in tables:
-        statement = select(CoreTable).where(and_(CoreTable.ds_id == ds.id, CoreTable.table_name == item.table_name))
-        record = session.exec(statement).first()
+        record = table_records.get(item.table_name)
         # update exist table, only update table_comment
         if record is not None:
             item.id = record.id
-            id_list.append(record.id)
-
             record.table_comment = item.table_comment
-            session.add(record)
-            session.commit()
         else:
             # save new table
             table = CoreTable(ds_id=ds.id, checked=True, table_name=item.table_name, table_comment=item.table_comment,
                               custom_comment=item.table_comment)
             session.add(table)
-            session.flush()
-            session.refresh(table)
-            item.id = table.id
-            id_list.append(table.id)
-            session.commit()
-
-        # sync field
-        fields = getFieldsByDs(session, ds, item.table_name)
-        sync_fields(session, ds, item, fields)
+            new_tables.append((item, table))
+    session.flush()
+    for item, table in new_tables:
+        item.id = table.id
+    id_list = [item.id for item in tables]
 
     if len(id_list) > 0:
         session.query(CoreTable).filter(and_(CoreTable.ds_id == ds.id, CoreTable.id.not_in(id_list))).delete(
             synchronize_session=False)
         session.query(CoreField).filter(and_(CoreField.ds_id == ds.id, CoreField.table_id.not_in(id_list))).delete(
             synchronize_session=False)
-        session.commit()
     else:  # delete all tables and fields in this ds
         session.query(CoreTable).filter(CoreTable.ds_id == ds.id).delete(synchronize_session=False)
         session.query(CoreField).filter(CoreField.ds_id == ds.id).delete(synchronize_session=False)
-        session.commit()
+
+    # sync field, fields of all tables are read by one catalog query if the ds type supports it
+    if len(id_list) > 0:
+        all_fields = get_all_fields(ds, [item.table_name for item in tables])
+        field_records = {}
+        for record in session.query(CoreField).filter(CoreField.table_id.in_(id_list)).order_by(CoreField.id).all():
+            field_records.setdefault(record.table_id, []).append(record)
+        for item in tables:
+            if all_fields is not None:
+                fields = all_fields.get(item.table_name, [])
+            else:
+                fields = getFieldsByDs(session, ds, item.table_name)
+            sync_fields(session, ds, item, fields, field_records.get(item.id, []), commit=False)
+    session.commit()
 
     # do table embedding
     run_save_table_embeddings(id_list)
     run_save_ds_embeddings([ds.id])
 
 
-def sync_fields(session: SessionDep, ds: CoreDatasource, table: CoreTable, fields: List[ColumnSchema]):
+def sync_fields(session: SessionDep, ds: CoreDatasource, table: CoreTable, fields: List[ColumnSchema],
+                records: Optional[List[CoreField]] = None, commit: bool = True):
+    if records is None:
+        records = session.query(CoreField).filter(CoreField.table_id == table.id).order_by(CoreField.id).all()
+    record_map = {}
+    for record in records:
+        record_map.setdefault(record.field_name, record)
+
     id_list = []
+    new_fields = []
     for index, item in enumerate(fields):
-        statement = select(CoreField).where(
-            and_(CoreField.table_id == table.id, CoreField.field_name == item.fieldName))
-        record = session.exec(statement).first()
+        record = record_map.get(item.fieldName)
         if record is not None:
             item.id = record.id
             id_list.append(record.id)
-
-            record.field_comment = item.fieldComment
-            record.field_index = index
-            record.field_type = item.fieldType
-            session.add(record)
-            session.commit()
+            if record.field_comment != item.fieldComment or record.field_index != index \
+                    or record.field_type != item.fieldType:
+                record.field_comment = item.fieldComment
+                record.field_index = index
+                record.field_type = item.fieldType
         else:
             field = CoreField(ds_id=ds.id, table_id=table.id, checked=True, field_name=item.fieldName,
                               field_type=item.fieldType, field_comment=item.fieldComment,
                               custom_comment=item.fieldComment, field_index=index)
             session.add(field)
-            session.flush()
-            session.refresh(field)
-            item.id = field.id
-            id_list.append(field.id)
-            session.commit()
-
-    if len(id_list) > 0:
-        session.query(CoreField).filter(and_(CoreField.table_id == table.id, CoreField.id.not_in(id_list))).delete(
-            synchronize_session=False)
+            new_fields.append(field)
+
+    if len(id_list) > 0 or len(new_fields) > 0:
+        keep_ids = set(id_list)
+        stale_ids = [record.id for record in records if record.id not in keep_ids]
+        if stale_ids:
+            session.query(CoreField).filter(CoreField.id.in_(stale_ids)).delete(synchronize_session=False)
+    if commit:
         session.commit()
 
 
@@ -266,11 +315,18 @@ def updateField(session: SessionDep, field: CoreField):
 
 
 def preview(session: SessionDep, current_user: CurrentUser, id: int, data: TableObj):
+    ds, sql = get_preview_sql(session, current_user, id, data)
+    if not sql:
+        return {"fields": [], "data": [], "sql": ''}
+    return DataFormat.to_object_result(exec_sql(ds, sql, True))
+
+
+def get_preview_sql(session: SessionDep, current_user: CurrentUser, id: int, data: TableObj):
     ds = session.query(CoreDatasource).filter(CoreDatasource.id == id).first()
     # check_status(session, ds, True)
 
     if data.fields is None or len(data.fields) == 0:
-        return {"fields": [], "data": [], "sql": ''}
+        return ds, ''
 
     where = ''
     f_list = [f for f in data.fields if f.checked]
@@ -291,7 +347,7 @@ def preview(session: SessionDep, current_user: CurrentUser, id: int, data: Table
 
     fields = [f.field_name for f in f_list]
     if fields is None or len(fields) == 0:
-        return {"fields": [], "data": [], "sql": ''}
+        return ds, ''
 
     conf = DatasourceConf(**json.loads(aes_decrypt(ds.configuration))) if ds.type != "excel" else get_engine_config()
     sql: str = ""
@@ -330,24 +386,34 @@ def preview(session: SessionDep, current_user: CurrentUser, id: int, data: Table
         sql = f"""SELECT "{'", "'.join(fields)}" FROM "{data.table.table_name}" 
             {where} 
             LIMIT 100"""
-    return exec_sql(ds, sql, True)
+    return ds, sql
 
 
 def fieldEnum(session: SessionDep, id: int):
+    ds, sql = get_field_enum_sql(session, id)
+    if not sql:
+        return []
+    return get_field_enum_values(exec_sql(ds, sql, True))
+
+
+def get_field_enum_sql(session: SessionDep, id: int):
     field = session.query(CoreField).filter(CoreField.id == id).first()
     if field is None:
-        return []
+        return None, ''
     table = session.query(CoreTable).filter(CoreTable.id == field.table_id).first()
     if table is None:
-        return []
+        return None, ''
     ds = session.query(CoreDatasource).filter(CoreDatasource.id == table.ds_id).first()
     if ds is None:
-        return []
+        return None, ''
 
     db = DB.get_db(ds.type)
     sql = f"""SELECT DISTINCT {db.prefix}{field.field_name}{db.suffix} FROM {db.prefix}{table.table_name}{db.suffix}"""
-    res = exec_sql(ds, sql, True)
-    return [item.get(res.get('fields')[0]) for item in res.get('data')]
+    return ds, sql
+
+
+def get_field_enum_values(res: dict):
+    return res.get('columns')[0] if res.get('columns') else []
 
 
 def updateNum(session: SessionDep, ds: CoreDatasource):
@@ -395,7 +461,7 @@ def get_table_obj_by_ds(session: SessionDep, current_user: CurrentUser, ds: Core
 
 
 def get_table_schema(session: SessionDep, current_user: CurrentUser, ds: CoreDatasource, question: str,
-                     embedding: bool = True) -> str:
+                     embedding: bool = True, embedding_context: Optional[EmbeddingContext] = None) -> str:
     schema_str = ""
     table_objs = get_table_obj_by_ds(session=session, current_user=current_user, ds=ds)
     if len(table_objs) == 0:
@@ -428,13 +494,13 @@ def get_table_schema(session: SessionDep, current_user: CurrentUser, ds: CoreDat
             schema_table += ",\n".join(field_list)
         schema_table += '\n]\n'
 
-        t_obj = {"id": obj.table.id, "schema_table": schema_table, "embedding": obj.table.embedding}
+        t_obj = {"id": obj.table.id, "schema_table": schema_table}
         tables.append(t_obj)
         all_tables.append(t_obj)
 
     # do table embedding
     if embedding and tables and settings.TABLE_EMBEDDING_ENABLED:
-        tables = calc_table_embedding(tables, question)
+        tables = calc_table_embedding(session, ds.id, tables, question, embedding_context)
     # splice schema
     if tables:
         for s in tables:
@@ -1,3 +1,4 @@
+import hashlib
 import json
 from typing import List, Optional
 
@@ -72,6 +73,27 @@ def get_column_permission_fields(session: SessionDep, current_user: CurrentUser,
     return fields
 
 
+def get_permission_fingerprint(session: SessionDep, current_user: CurrentUser, ds: CoreDatasource) -> str:
+    """Hash of the row/column permissions on the datasource that apply to the user."""
+    if not is_normal_user(current_user):
+        return 'all'
+    contain_rules = session.query(DsRules).all()
+    table_ids = session.query(CoreTable.id).filter(CoreTable.ds_id == ds.id)
+    permissions = session.query(DsPermission).filter(DsPermission.table_id.in_(table_ids)).order_by(
+        DsPermission.id).all()
+    applied = []
+    for permission in permissions:
+        for r in contain_rules:
+            p_list = json.loads(r.permission_list)
+            u_list = json.loads(r.user_list)
+            if p_list is not None and u_list is not None and permission.id in p_list and (
+                    current_user.id in u_list or f'{current_user.id}' in u_list):
+                applied.append([permission.id, permission.type, permission.table_id, permission.expression_tree,
+                                permission.permissions])
+                break
+    return hashlib.sha256(json.dumps(applied, ensure_ascii=False, default=str).encode('utf-8')).hexdigest()
+
+
 def is_normal_user(current_user: CurrentUser):
     return current_user.id != 1
 
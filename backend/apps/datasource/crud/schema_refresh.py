@@ -0,0 +1,274 @@
+import hashlib
+import json
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, List, Optional
+
+from apps.datasource.crud.datasource import getFieldsByDs, sync_fields, lock_ds_schema
+from apps.datasource.models.datasource import CoreDatasource, CoreTable, CoreField, ColumnSchema
+from apps.db.db import get_all_fields
+from apps.db.ds_health import DsHealthCache
+from apps.db.result_cache import QueryResultCache
+from common.core.config import settings
+from common.core.db import engine
+from common.utils.embedding_threads import session_maker, run_save_table_embeddings, run_save_ds_embeddings
+from common.utils.utils import SQLBotLogUtil
+
+_lock = threading.Lock()
+
+# ds_id -> status of the last or running refresh
+_status: dict[Any, dict] = {}
+
+# datasources with a refresh in progress, a datasource is refreshed by one worker at a time
+_running: set[Any] = set()
+
+_executor: Optional[ThreadPoolExecutor] = None
+
+_stop_event = threading.Event()
+
+_scheduler: Optional[threading.Thread] = None
+
+# advisory lock class of the refresh schedule, held by the one worker that schedules the refreshes of all datasources
+schedule_lock_class = 5002
+
+
+def get_columns_fingerprint(columns: List[tuple]) -> str:
+    """columns: (name, type, comment) in table order"""
+    return hashlib.sha256(json.dumps(columns, ensure_ascii=False, default=str).encode('utf-8')).hexdigest()
+
+
+def get_catalog_fingerprint(fields: List[ColumnSchema]) -> str:
+    return get_columns_fingerprint([(item.fieldName, item.fieldType, item.fieldComment) for item in fields])
+
+
+def get_stored_fingerprint(records: List[CoreField]) -> str:
+    records = sorted(records, key=lambda record: (record.field_index if record.field_index is not None else 0,
+                                                  record.id))
+    return get_columns_fingerprint([(record.field_name, record.field_type, record.field_comment)
+                                    for record in records])
+
+
+def _copy_status(status: dict) -> dict:
+    return {**status, "changed": list(status["changed"]), "missing": list(status["missing"])}
+
+
+def _set_status(status: dict, **values):
+    # status is read by the status endpoints while the refresh runs
+    with _lock:
+        status.update(values)
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=max(settings.SCHEMA_REFRESH_WORKERS, 1),
+                                           thread_name_prefix='schema-refresh')
+        return _executor
+
+
+def refresh_ds_schema(session, ds: CoreDatasource, status: dict) -> Optional[List[int]]:
+    """Re-sync the fields of tables whose column list changed in the datasource, return their ids,
+    None when another process is syncing the tables of the datasource."""
+    if not lock_ds_schema(session, ds.id, wait=False):
+        return None
+    tables = session.query(CoreTable).filter(CoreTable.ds_id == ds.id).order_by(CoreTable.id).all()
+    _set_status(status, total=len(tables))
+    if not tables:
+        return []
+
+    field_records = {}
+    for record in session.query(CoreField).filter(CoreField.ds_id == ds.id).order_by(CoreField.id).all():
+        field_records.setdefault(record.table_id, []).append(record)
+
+    all_fields = get_all_fields(ds, [table.table_name for table in tables])
+    changed: List[CoreTable] = []
+    for table in tables:
+        if all_fields is not None:
+            fields = all_fields.get(table.table_name)
+        else:
+            fields = getFieldsByDs(session, ds, table.table_name)
+        if not fields:
+            # table is gone or not readable, removing it is left to the user
+            with _lock:
+                status['checked'] += 1
+                status['missing'].append(table.table_name)
+            continue
+        records = field_records.get(table.id, [])
+        if get_catalog_fingerprint(fields) == get_stored_fingerprint(records):
+            with _lock:
+                status['checked'] += 1
+            continue
+        sync_fields(session, ds, table, fields, records, commit=False)
+        changed.append(table)
+        with _lock:
+            status['checked'] += 1
+            status['changed'].append(table.table_name)
+
+    if changed:
+        session.commit()
+    return [table.id for table in changed]
+
+
+def _run_refresh(ds_id: Any, status: dict):
+    session = session_maker()
+    try:
+        ds = session.query(CoreDatasource).filter(CoreDatasource.id == ds_id).first()
+        if ds is None:
+            _set_status(status, status='failed', error='datasource not found')
+            return
+        if DsHealthCache.is_open(ds.id):
+            _set_status(status, status='skipped', error='datasource is unavailable')
+            return
+        start_time = time.time()
+        changed_ids = refresh_ds_schema(session, ds, status)
+        if changed_ids is None:
+            _set_status(status, status='skipped', error='tables are synced by another process')
+            return
+        if changed_ids:
+            QueryResultCache.invalidate(ds.id)
+            run_save_table_embeddings(changed_ids)
+            run_save_ds_embeddings([ds.id])
+        _set_status(status, status='finished')
+        SQLBotLogUtil.info(f"Schema refresh of datasource {ds.id}: {len(changed_ids)} of {status['total']} "
+                           f"table(s) changed, cost {time.time() - start_time:.2f}s")
+    except Exception as e:
+        session.rollback()
+        _set_status(status, status='failed', error=str(e))
+        SQLBotLogUtil.error(f"Schema refresh of datasource {ds_id} failed: {e}\n{traceback.format_exc()}")
+    finally:
+        session.close()
+        with _lock:
+            status['finished_at'] = int(time.time() * 1000)
+            _running.discard(ds_id)
+
+
+def _hold_schedule_lock(connection) -> bool:
+    """Take the session level schedule lock on connection, kept until the connection is closed."""
+    cursor = connection.cursor()
+    try:
+        cursor.execute("SELECT pg_try_advisory_lock(%s, 0)", (schedule_lock_class,))
+        return bool(cursor.fetchone()[0])
+    finally:
+        cursor.close()
+
+
+def _is_alive(connection) -> bool:
+    try:
+        cursor = connection.cursor()
+        cursor.execute("SELECT 1")
+        cursor.fetchall()
+        cursor.close()
+        return True
+    except Exception:
+        return False
+
+
+def _schedule():
+    # every worker runs this loop, only the one holding the schedule lock refreshes, another one takes over
+    # when its connection is gone
+    connection = None
+    scheduling = False
+    try:
+        while not _stop_event.wait(settings.SCHEMA_REFRESH_INTERVAL):
+            try:
+                if connection is not None and not _is_alive(connection):
+                    # the lock went with the lost connection
+                    try:
+                        connection.close()
+                    except Exception:
+                        pass
+                    connection = None
+                    scheduling = False
+                if connection is None:
+                    connection = engine.raw_connection()
+                    # kept out of the pool, closing it releases the lock
+                    connection.detach()
+                    connection.dbapi_connection.rollback()
+                    connection.dbapi_connection.autocommit = True
+                if not scheduling:
+                    scheduling = _hold_schedule_lock(connection)
+                    if scheduling:
+                        SQLBotLogUtil.info("Schema refresh is scheduled by this worker")
+                if scheduling:
+                    SchemaRefresher.trigger_all()
+            except Exception as e:
+                SQLBotLogUtil.error(f"Schema refresh schedule failed: {e}")
+    finally:
+        if connection is not None:
+            try:
+                connection.close()
+            except Exception:
+                pass
+
+
+class SchemaRefresher:
+    """Background refresh of table columns, only tables whose column fingerprint changed are re-synced and re-embedded."""
+
+    @staticmethod
+    def trigger(ds_id: Any, trigger: str = 'manual') -> dict:
+        with _lock:
+            if ds_id in _running:
+                return _copy_status(_status[ds_id])
+            _running.add(ds_id)
+            status = {"ds_id": ds_id, "status": "running", "trigger": trigger, "total": 0, "checked": 0,
+                      "changed": [], "missing": [], "error": None, "started_at": int(time.time() * 1000),
+                      "finished_at": None}
+            _status[ds_id] = status
+        try:
+            _get_executor().submit(_run_refresh, ds_id, status)
+        except Exception:
+            with _lock:
+                _running.discard(ds_id)
+            raise
+        return _copy_status(status)
+
+    @staticmethod
+    def trigger_all(trigger: str = 'schedule'):
+        session = session_maker()
+        try:
+            ds_ids = [row[0] for row in session.query(CoreDatasource.id).all()]
+        finally:
+            session.close()
+        for ds_id in ds_ids:
+            SchemaRefresher.trigger(ds_id, trigger)
+
+    @staticmethod
+    def get_status(ds_id: Any) -> Optional[dict]:
+        with _lock:
+            status = _status.get(ds_id)
+            return _copy_status(status) if status is not None else None
+
+    @staticmethod
+    def get_all_status(ds_ids: Optional[set] = None) -> List[dict]:
+        with _lock:
+            return [_copy_status(status) for ds_id, status in _status.items() if ds_ids is None or ds_id in ds_ids]
+
+    @staticmethod
+    def invalidate(ds_id: Any):
+        with _lock:
+            if ds_id not in _running:
+                _status.pop(ds_id, None)
+
+    @staticmethod
+    def start():
+        global _scheduler
+        if not settings.SCHEMA_REFRESH_ENABLED or _scheduler is not None:
+            return
+        _stop_event.clear()
+        _scheduler = threading.Thread(target=_schedule, name='schema-refresh-scheduler', daemon=True)
+        _scheduler.start()
+        SQLBotLogUtil.info(f"Schema refresh scheduled every {settings.SCHEMA_REFRESH_INTERVAL}s")
+
+    @staticmethod
+    def stop():
+        global _scheduler, _executor
+        _stop_event.set()
+        _scheduler = None
+        with _lock:
+            executor = _executor
+            _executor = None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
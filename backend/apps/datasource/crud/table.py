@@ -1,11 +1,12 @@
-import json
 import time
 import traceback
 from typing import List
 
-from sqlalchemy import and_, select, update
+from sqlalchemy import and_, select, text
 
 from apps.ai_model.embedding import EmbeddingModelCache
+from apps.datasource.embedding.table_matrix import TableEmbeddingMatrixCache
+from apps.datasource.embedding.utils import ensure_hnsw_index
 from common.core.config import settings
 from common.core.deps import SessionDep
 from common.utils.utils import SQLBotLogUtil
@@ -54,7 +55,51 @@ def run_fill_empty_table_and_ds_embedding(session_maker):
         session_maker.remove()
 
 
-def save_table_embedding(session_maker, ids: List[int]):
+def get_table_schema_text(table: CoreTable, fields: List[CoreField]) -> str:
+    schema_table = ''
+    schema_table += f"# Table: {table.table_name}"
+    table_comment = ''
+    if table.custom_comment:
+        table_comment = table.custom_comment.strip()
+    if table_comment == '':
+        schema_table += '\n[\n'
+    else:
+        schema_table += f", {table_comment}\n[\n"
+
+    if fields:
+        field_list = []
+        for field in fields:
+            field_comment = ''
+            if field.custom_comment:
+                field_comment = field.custom_comment.strip()
+            if field_comment == '':
+                field_list.append(f"({field.field_name}:{field.field_type})")
+            else:
+                field_list.append(f"({field.field_name}:{field.field_type}, {field_comment})")
+        schema_table += ",\n".join(field_list)
+    schema_table += '\n]\n'
+    return schema_table
+
+
+def get_fields_by_table_ids(session, table_ids: List[int]) -> dict[int, List[CoreField]]:
+    fields_map: dict[int, List[CoreField]] = {table_id: [] for table_id in table_ids}
+    if table_ids:
+        fields = session.query(CoreField).filter(CoreField.table_id.in_(table_ids)).order_by(CoreField.id).all()
+        for field in fields:
+            fields_map[field.table_id].append(field)
+    return fields_map
+
+
+def update_embeddings(session, table_name: str, ids: List[int], embeddings: List[List[float]]):
+    """one UPDATE for the whole batch, the vectors are sent in their text form"""
+    session.execute(text(f"""
+        UPDATE {table_name} AS t SET embedding = v.embedding::vector
+        FROM (SELECT unnest(CAST(:ids AS bigint[])) AS id, unnest(CAST(:embeddings AS text[])) AS embedding) AS v
+        WHERE t.id = v.id
+        """), {'ids': ids, 'embeddings': [str(embedding) for embedding in embeddings]})
+
+
+def save_table_embedding(session_maker, ids: List[int], raise_errors: bool = False):
     if not settings.TABLE_EMBEDDING_ENABLED:
         return
 
@@ -65,48 +110,35 @@ def save_table_embedding(session_maker, ids: List[int]):
         start_time = time.time()
         model = EmbeddingModelCache.get_model()
         session = session_maker()
-        for _id in ids:
-            table = session.query(CoreTable).filter(CoreTable.id == _id).first()
-            fields = session.query(CoreField).filter(CoreField.table_id == table.id).all()
-
-            schema_table = ''
-            schema_table += f"# Table: {table.table_name}"
-            table_comment = ''
-            if table.custom_comment:
-                table_comment = table.custom_comment.strip()
-            if table_comment == '':
-                schema_table += '\n[\n'
-            else:
-                schema_table += f", {table_comment}\n[\n"
-
-            if fields:
-                field_list = []
-                for field in fields:
-                    field_comment = ''
-                    if field.custom_comment:
-                        field_comment = field.custom_comment.strip()
-                    if field_comment == '':
-                        field_list.append(f"({field.field_name}:{field.field_type})")
-                    else:
-                        field_list.append(f"({field.field_name}:{field.field_type}, {field_comment})")
-                schema_table += ",\n".join(field_list)
-            schema_table += '\n]\n'
-            # table_schema.append(schema_table)
-            emb = json.dumps(model.embed_query(schema_table))
-
-            stmt = update(CoreTable).where(and_(CoreTable.id == _id)).values(embedding=emb)
-            session.execute(stmt)
+        batch_size = max(settings.EMBEDDING_BATCH_SIZE, 1)
+        for i in range(0, len(ids), batch_size):
+            tables = session.query(CoreTable).filter(CoreTable.id.in_(ids[i:i + batch_size])).all()
+            if not tables:
+                continue
+            fields_map = get_fields_by_table_ids(session, [table.id for table in tables])
+
+            embeddings = model.embed_documents(
+                [get_table_schema_text(table, fields_map.get(table.id)) for table in tables])
+            ensure_hnsw_index('core_table', len(embeddings[0]))
+
+            update_embeddings(session, 'core_table', [table.id for table in tables], embeddings)
+            ds_ids = {table.ds_id for table in tables}
+            TableEmbeddingMatrixCache.bump_version(session, ds_ids)
             session.commit()
+            for ds_id in ds_ids:
+                TableEmbeddingMatrixCache.invalidate(ds_id)
 
         end_time = time.time()
         SQLBotLogUtil.info('table embedding finished in: ' + str(end_time - start_time) + ' seconds')
     except Exception:
         traceback.print_exc()
+        if raise_errors:
+            raise
     finally:
         session_maker.remove()
 
 
-def save_ds_embedding(session_maker, ids: List[int]):
+def save_ds_embedding(session_maker, ids: List[int], raise_errors: bool = False):
     if not settings.TABLE_EMBEDDING_ENABLED:
         return
 
@@ -117,45 +149,30 @@ def save_ds_embedding(session_maker, ids: List[int]):
         start_time = time.time()
         model = EmbeddingModelCache.get_model()
         session = session_maker()
-        for _id in ids:
-            schema_table = ''
-            ds = session.query(CoreDatasource).filter(CoreDatasource.id == _id).first()
-            schema_table += f"{ds.name}, {ds.description}\n"
-            tables = session.query(CoreTable).filter(CoreTable.ds_id == ds.id).all()
+        batch_size = max(settings.EMBEDDING_BATCH_SIZE, 1)
+        for i in range(0, len(ids), batch_size):
+            ds_list = session.query(CoreDatasource).filter(CoreDatasource.id.in_(ids[i:i + batch_size])).all()
+            if not ds_list:
+                continue
+            tables = session.query(CoreTable).filter(CoreTable.ds_id.in_([ds.id for ds in ds_list])).order_by(
+                CoreTable.id).all()
+            fields_map = get_fields_by_table_ids(session, [table.id for table in tables])
+
+            schema_map = {ds.id: f"{ds.name}, {ds.description}\n" for ds in ds_list}
             for table in tables:
-                fields = session.query(CoreField).filter(CoreField.table_id == table.id).all()
-
-                schema_table += f"# Table: {table.table_name}"
-                table_comment = ''
-                if table.custom_comment:
-                    table_comment = table.custom_comment.strip()
-                if table_comment == '':
-                    schema_table += '\n[\n'
-                else:
-                    schema_table += f", {table_comment}\n[\n"
-
-                if fields:
-                    field_list = []
-                    for field in fields:
-                        field_comment = ''
-                        if field.custom_comment:
-                            field_comment = field.custom_comment.strip()
-                        if field_comment == '':
-                            field_list.append(f"({field.field_name}:{field.field_type})")
-                        else:
-                            field_list.append(f"({field.field_name}:{field.field_type}, {field_comment})")
-                    schema_table += ",\n".join(field_list)
-                schema_table += '\n]\n'
-            # table_schema.append(schema_table)
-            emb = json.dumps(model.embed_query(schema_table))
-
-            stmt = update(CoreDatasource).where(and_(CoreDatasource.id == _id)).values(embedding=emb)
-            session.execute(stmt)
+                schema_map[table.ds_id] += get_table_schema_text(table, fields_map.get(table.id))
+
+            embeddings = model.embed_documents([schema_map[ds.id] for ds in ds_list])
+            ensure_hnsw_index('core_datasource', len(embeddings[0]))
+
+            update_embeddings(session, 'core_datasource', [ds.id for ds in ds_list], embeddings)
             session.commit()
 
         end_time = time.time()
         SQLBotLogUtil.info('datasource embedding finished in: ' + str(end_time - start_time) + ' seconds')
     except Exception:
         traceback.print_exc()
+        if raise_errors:
+            raise
     finally:
         session_maker.remove()
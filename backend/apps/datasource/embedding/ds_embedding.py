@@ -5,9 +5,10 @@ import time
 import traceback
 from typing import Optional
 
-from apps.ai_model.embedding import EmbeddingModelCache
-from apps.datasource.embedding.utils import cosine_similarity
-from apps.datasource.models.datasource import CoreDatasource
+from sqlalchemy import text
+
+from apps.ai_model.embedding import EmbeddingModelCache, EmbeddingContext, embed_query
+from apps.datasource.embedding.utils import cosine_similarity, format_vector_sql, set_hnsw_search_options
 from apps.system.crud.assistant import AssistantOutDs
 from common.core.config import settings
 from common.core.deps import CurrentAssistant
@@ -15,9 +16,19 @@ from common.core.deps import SessionDep, CurrentUser
 from common.utils.utils import SQLBotLogUtil
 
 
+ds_embedding_sql = """
+SELECT id, ( 1 - {distance} ) AS similarity
+FROM core_datasource
+WHERE id = ANY(:ids) AND {dimension_filter}
+ORDER BY {distance}
+LIMIT :limit
+"""
+
+
 def get_ds_embedding(session: SessionDep, current_user: CurrentUser, _ds_list, out_ds: AssistantOutDs,
                      question: str,
-                     current_assistant: Optional[CurrentAssistant] = None):
+                     current_assistant: Optional[CurrentAssistant] = None,
+                     embedding_context: Optional[EmbeddingContext] = None):
     _list = []
     if current_assistant and current_assistant.type == 1:
         if out_ds.ds_list:
@@ -30,12 +41,12 @@ def get_ds_embedding(session: SessionDep, current_user: CurrentUser, _ds_list, o
 
         if _list:
             try:
-                text = [s.get('ds_schema') for s in _list]
+                texts = [s.get('ds_schema') for s in _list]
 
                 model = EmbeddingModelCache.get_model()
-                results = model.embed_documents(text)
+                results = model.embed_documents(texts)
 
-                q_embedding = model.embed_query(question)
+                q_embedding = embed_query(question, embedding_context)
                 for index in range(len(results)):
                     item = results[index]
                     _list[index]['cosine_similarity'] = cosine_similarity(q_embedding, item)
@@ -54,37 +65,38 @@ def get_ds_embedding(session: SessionDep, current_user: CurrentUser, _ds_list, o
     else:
         for _ds in _ds_list:
             if _ds.get('id'):
-                ds = session.get(CoreDatasource, _ds.get('id'))
-                # table_schema = get_table_schema(session, current_user, ds, question, embedding=False)
-                # ds_info = f"{ds.name}, {ds.description}\n"
-                # ds_schema = ds_info + table_schema
-                _list.append({"id": ds.id, "cosine_similarity": 0.0, "ds": ds, "embedding": ds.embedding})
+                _list.append({"id": _ds.get('id'), "name": _ds.get('name'), "description": _ds.get('description'),
+                              "cosine_similarity": 0.0})
 
         if _list:
             try:
-                # text = [s.get('ds_schema') for s in _list]
-
-                model = EmbeddingModelCache.get_model()
                 start_time = time.time()
-                # results = model.embed_documents(text)
-                results = [item.get('embedding') for item in _list]
 
-                q_embedding = model.embed_query(question)
-                for index in range(len(results)):
-                    item = results[index]
-                    if item:
-                        _list[index]['cosine_similarity'] = cosine_similarity(q_embedding, json.loads(item))
+                q_embedding = embed_query(question, embedding_context)
+                dimension = len(q_embedding)
+                sql = format_vector_sql(ds_embedding_sql, dimension)
+                set_hnsw_search_options(session)
+                results = session.execute(text(sql), {'embedding_array': str(q_embedding),
+                                                      'ids': [item.get('id') for item in _list],
+                                                      'limit': settings.DS_EMBEDDING_COUNT}).fetchall()
 
-                _list.sort(key=lambda x: x['cosine_similarity'], reverse=True)
-                # print(len(_list))
+                # datasources without embedding fill up the rest in their original order
+                _map = {item.get('id'): item for item in _list}
+                selected = []
+                for row in results:
+                    item = _map.pop(row.id)
+                    item['cosine_similarity'] = row.similarity
+                    selected.append(item)
+                selected.extend([item for item in _list if item.get('id') in _map][
+                                :settings.DS_EMBEDDING_COUNT - len(selected)])
+                _list = selected
                 end_time = time.time()
                 SQLBotLogUtil.info(str(end_time - start_time))
-                _list = _list[:settings.DS_EMBEDDING_COUNT]
                 SQLBotLogUtil.info(json.dumps(
-                    [{"id": ele.get("id"), "name": ele.get("ds").name,
+                    [{"id": ele.get("id"), "name": ele.get("name"),
                       "cosine_similarity": ele.get("cosine_similarity")}
                      for ele in _list]))
-                return [{"id": obj.get('ds').id, "name": obj.get('ds').name, "description": obj.get('ds').description}
+                return [{"id": obj.get('id'), "name": obj.get('name'), "description": obj.get('description')}
                         for obj in _list]
             except Exception:
                 traceback.print_exc()
@@ -3,9 +3,13 @@
 import json
 import time
 import traceback
+from typing import Optional
 
-from apps.ai_model.embedding import EmbeddingModelCache
-from apps.datasource.embedding.utils import cosine_similarity
+from sqlalchemy import text
+
+from apps.ai_model.embedding import EmbeddingModelCache, EmbeddingContext, embed_query
+from apps.datasource.embedding.utils import cosine_similarity, format_vector_sql, set_hnsw_search_options
+from apps.datasource.embedding.table_matrix import TableEmbeddingMatrixCache
 from common.core.config import settings
 from common.utils.utils import SQLBotLogUtil
 
@@ -40,33 +44,49 @@ def get_table_embedding(tables: list[dict], question: str):
     return _list
 
 
-def calc_table_embedding(tables: list[dict], question: str):
+table_embedding_sql = """
+SELECT id, ( 1 - {distance} ) AS similarity
+FROM core_table
+WHERE ds_id = :ds_id AND id = ANY(:ids) AND {dimension_filter}
+ORDER BY {distance}
+LIMIT :limit
+"""
+
+
+def calc_table_embedding(session, ds_id: int, tables: list[dict], question: str,
+                         embedding_context: Optional[EmbeddingContext] = None):
+    """top TABLE_EMBEDDING_COUNT tables by similarity of their stored embedding, searched in the database,
+    tables without embedding fill up the rest in their original order"""
     _list = []
     for table in tables:
-        _list.append(
-            {"id": table.get('id'), "schema_table": table.get('schema_table'), "embedding": table.get('embedding'),
-             "cosine_similarity": 0.0})
+        _list.append({"id": table.get('id'), "schema_table": table.get('schema_table'), "cosine_similarity": 0.0})
 
     if _list:
         try:
-            # text = [s.get('schema_table') for s in _list]
-            #
-            model = EmbeddingModelCache.get_model()
             start_time = time.time()
-            # results = model.embed_documents(text)
-            # end_time = time.time()
-            # SQLBotLogUtil.info(str(end_time - start_time))
-            results = [item.get('embedding') for item in _list]
 
-            q_embedding = model.embed_query(question)
-            for index in range(len(results)):
-                item = results[index]
-                if item:
-                    _list[index]['cosine_similarity'] = cosine_similarity(q_embedding, json.loads(item))
+            q_embedding = embed_query(question, embedding_context)
+            ids = [item.get('id') for item in _list]
+            if settings.TABLE_EMBEDDING_SEARCH == 'memory':
+                results = TableEmbeddingMatrixCache.search(session, ds_id, q_embedding, ids,
+                                                           settings.TABLE_EMBEDDING_COUNT)
+            else:
+                dimension = len(q_embedding)
+                sql = format_vector_sql(table_embedding_sql, dimension)
+                set_hnsw_search_options(session)
+                results = session.execute(text(sql), {'embedding_array': str(q_embedding), 'ds_id': ds_id,
+                                                      'ids': ids,
+                                                      'limit': settings.TABLE_EMBEDDING_COUNT}).fetchall()
 
-            _list.sort(key=lambda x: x['cosine_similarity'], reverse=True)
-            _list = _list[:settings.TABLE_EMBEDDING_COUNT]
-            # print(len(_list))
+            _map = {item.get('id'): item for item in _list}
+            selected = []
+            for table_id, similarity in results:
+                item = _map.pop(table_id)
+                item['cosine_similarity'] = similarity
+                selected.append(item)
+            selected.extend([item for item in _list if item.get('id') in _map][
+                            :settings.TABLE_EMBEDDING_COUNT - len(selected)])
+            _list = selected
             end_time = time.time()
             SQLBotLogUtil.info(str(end_time - start_time))
             SQLBotLogUtil.info(json.dumps([{"id": ele.get('id'), "schema_table": ele.get('schema_table'),
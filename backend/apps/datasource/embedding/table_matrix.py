@@ -0,0 +1,138 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any
+
+import numpy as np
+from sqlalchemy import select, text
+
+from apps.datasource.models.datasource import CoreTable
+from common.core.config import settings
+from common.utils.utils import SQLBotLogUtil
+
+
+class TableEmbeddingMatrix:
+    """Normalized float32 embeddings of the tables of one datasource with one dimension, rows ordered by table id."""
+
+    def __init__(self, ids: np.ndarray, matrix: np.ndarray):
+        self.ids = ids
+        self.matrix = matrix
+        # table_embedding_version of the datasource the matrix was built at
+        self.version = 0
+
+    @staticmethod
+    def build(rows: list[tuple[int, Any]], dimension: int) -> "TableEmbeddingMatrix":
+        rows = sorted([(table_id, embedding) for table_id, embedding in rows
+                       if embedding is not None and len(embedding) == dimension], key=lambda row: row[0])
+        ids = np.array([row[0] for row in rows], dtype=np.int64)
+        matrix = np.array([row[1] for row in rows], dtype=np.float32).reshape(len(rows), dimension)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        # zero vectors keep a similarity of 0, same as cosine_similarity
+        np.divide(matrix, norms, out=matrix, where=norms > 0)
+        return TableEmbeddingMatrix(ids, matrix)
+
+    def search(self, q_embedding: list[float], candidate_ids: list[int], limit: int) -> list[tuple[int, float]]:
+        """(table id, cosine similarity) of the top limit candidates, most similar first"""
+        if limit <= 0 or not len(self.ids) or not candidate_ids:
+            return []
+        query = np.asarray(q_embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm > 0:
+            query = query / norm
+
+        candidates = np.asarray(candidate_ids, dtype=np.int64)
+        positions = np.searchsorted(self.ids, candidates)
+        found = positions < len(self.ids)
+        positions, candidates = positions[found], candidates[found]
+        positions = positions[self.ids[positions] == candidates]
+        if not len(positions):
+            return []
+        # scoring every row and picking the candidate scores is cheaper than copying the candidate rows
+        scores = self.matrix @ query
+        mask = np.zeros(len(self.ids), dtype=bool)
+        mask[positions] = True
+        if mask.all():
+            positions = None
+        else:
+            positions = np.flatnonzero(mask)
+            scores = scores[positions]
+
+        k = min(limit, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        indexes = top if positions is None else positions[top]
+        return [(int(table_id), float(score)) for table_id, score in zip(self.ids[indexes], scores[top])]
+
+
+_lock = threading.Lock()
+
+# (ds_id, dimension) -> matrix, least recently used first
+_matrices: "OrderedDict[tuple[Any, int], TableEmbeddingMatrix]" = OrderedDict()
+
+# ds_id -> invalidation count, a matrix built before an invalidation is not stored
+_versions: dict[Any, int] = {}
+
+# bumped in the transaction that changes table embeddings, so every process sees its matrix is outdated
+bump_version_sql = """
+INSERT INTO table_embedding_version (ds_id, version)
+SELECT ds_id, 1 FROM unnest(CAST(:ds_ids AS bigint[])) AS ds_id
+ON CONFLICT (ds_id) DO UPDATE SET version = table_embedding_version.version + 1
+"""
+
+version_sql = "SELECT version FROM table_embedding_version WHERE ds_id = :ds_id"
+
+
+def get_db_version(session, ds_id: Any) -> int:
+    version = session.execute(text(version_sql), {'ds_id': ds_id}).scalar()
+    return version or 0
+
+
+class TableEmbeddingMatrixCache:
+    """In process table embeddings per datasource, for TABLE_EMBEDDING_SEARCH = 'memory'."""
+
+    @staticmethod
+    def get(session, ds_id: Any, dimension: int) -> TableEmbeddingMatrix:
+        key = (ds_id, dimension)
+        # read before the rows, a matrix built from newer rows is only rebuilt once more
+        db_version = get_db_version(session, ds_id)
+        with _lock:
+            matrix = _matrices.get(key)
+            if matrix is not None and matrix.version == db_version:
+                _matrices.move_to_end(key)
+                return matrix
+            version = _versions.get(ds_id, 0)
+
+        start_time = time.time()
+        rows = session.execute(select(CoreTable.id, CoreTable.embedding).where(
+            CoreTable.ds_id == ds_id, CoreTable.embedding.isnot(None))).all()
+        matrix = TableEmbeddingMatrix.build([(row[0], row[1]) for row in rows], dimension)
+        matrix.version = db_version
+        SQLBotLogUtil.info(f"Build table embedding matrix of datasource {ds_id}: {len(matrix.ids)} table(s), "
+                           f"cost {time.time() - start_time:.3f}s")
+
+        with _lock:
+            if _versions.get(ds_id, 0) == version:
+                _matrices[key] = matrix
+                _matrices.move_to_end(key)
+                while len(_matrices) > max(settings.TABLE_EMBEDDING_MATRIX_CACHE_SIZE, 1):
+                    _matrices.popitem(last=False)
+        return matrix
+
+    @staticmethod
+    def search(session, ds_id: Any, q_embedding: list[float], candidate_ids: list[int],
+               limit: int) -> list[tuple[int, float]]:
+        return TableEmbeddingMatrixCache.get(session, ds_id, len(q_embedding)).search(q_embedding, candidate_ids,
+                                                                                     limit)
+
+    @staticmethod
+    def bump_version(session, ds_ids: list):
+        """Mark the matrices of the datasources outdated in all processes, committed with the session."""
+        if ds_ids:
+            session.execute(text(bump_version_sql), {'ds_ids': list(ds_ids)})
+
+    @staticmethod
+    def invalidate(ds_id: Any):
+        with _lock:
+            _versions[ds_id] = _versions.get(ds_id, 0) + 1
+            for key in [key for key in _matrices if key[0] == ds_id]:
+                del _matrices[key]
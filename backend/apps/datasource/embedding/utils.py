@@ -1,6 +1,15 @@
 # Author: Junjun
 # Date: 2025/9/23
 import math
+import re
+import threading
+from typing import Optional
+
+from sqlalchemy import text
+
+from common.core.config import settings
+from common.core.db import engine
+from common.utils.utils import SQLBotLogUtil
 
 
 def cosine_similarity(vec_a, vec_b):
@@ -16,3 +25,91 @@ def cosine_similarity(vec_a, vec_b):
         return 0.0
 
     return dot_product / (norm_a * norm_b)
+
+
+_lock = threading.Lock()
+
+# (table, dimension) with an HNSW index, checked once per process
+_indexed: set[tuple[str, int]] = set()
+
+# version of the vector extension, read once per process
+_pgvector_version: Optional[tuple[int, ...]] = None
+
+
+def get_hnsw_index_name(table: str, dimension: int) -> str:
+    return f"{table}_embedding_hnsw_{dimension}"
+
+
+def get_hnsw_index_sql(table: str, dimension: int) -> str:
+    # the embedding column has no fixed dimension, index the vectors of one dimension through a cast
+    return (f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {get_hnsw_index_name(table, dimension)} ON {table} "
+            f"USING hnsw ((embedding::vector({dimension})) vector_cosine_ops) "
+            f"WHERE vector_dims(embedding) = {dimension}")
+
+
+def get_distance_sql(dimension: int) -> str:
+    """cosine distance to :embedding_array, written like the index expression so the HNSW index can be used,
+    to be combined with get_dimension_filter_sql"""
+    return f"(embedding::vector({dimension}) <=> CAST(:embedding_array AS vector({dimension})))"
+
+
+def get_dimension_filter_sql(dimension: int) -> str:
+    return f"embedding IS NOT NULL AND vector_dims(embedding) = {dimension}"
+
+
+def format_vector_sql(sql: str, dimension: int) -> str:
+    """fill the {distance} and {dimension_filter} placeholders of a search sql"""
+    return sql.format(distance=get_distance_sql(dimension), dimension_filter=get_dimension_filter_sql(dimension))
+
+
+def _get_pgvector_version() -> tuple[int, ...]:
+    global _pgvector_version
+    if _pgvector_version is None:
+        try:
+            with engine.connect() as conn:
+                version = conn.execute(text("SELECT extversion FROM pg_extension WHERE extname = 'vector'")).scalar()
+            _pgvector_version = tuple(int(part) for part in re.findall(r'\d+', version or ''))
+        except Exception as e:
+            SQLBotLogUtil.warning(f"Can not read pgvector version: {e}")
+            return ()
+    return _pgvector_version
+
+
+def set_hnsw_search_options(session):
+    """Transaction local settings of the search, in one statement. Iterative scan (pgvector 0.8+) keeps reading
+    the index until enough rows pass the other filters of the query, strict order keeps the top k exact."""
+    version = _get_pgvector_version()
+    if version < (0, 5):
+        # no hnsw before pgvector 0.5
+        return
+    sql = "SELECT set_config('hnsw.ef_search', :ef_search, true)"
+    if version >= (0, 8):
+        sql += ", set_config('hnsw.iterative_scan', 'strict_order', true)"
+    session.execute(text(sql), {'ef_search': str(int(settings.EMBEDDING_HNSW_EF_SEARCH))})
+
+
+def ensure_hnsw_index(table: str, dimension: int):
+    """Index the embeddings of a new dimension, called by the embedding jobs before they write embeddings,
+    never by searches. The index is built concurrently, so writes to the table are not blocked meanwhile."""
+    key = (table, dimension)
+    if key in _indexed:
+        return
+    with _lock:
+        if key in _indexed:
+            return
+        name = get_hnsw_index_name(table, dimension)
+        try:
+            # CREATE INDEX CONCURRENTLY can not run inside a transaction
+            with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+                valid = conn.execute(text("SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+                                          "WHERE c.relname = :name"), {'name': name}).scalar()
+                if valid is False:
+                    # left invalid by an interrupted build, IF NOT EXISTS would keep it
+                    conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+                if not valid:
+                    conn.execute(text(get_hnsw_index_sql(table, dimension)))
+        except Exception as e:
+            # e.g. pgvector without hnsw, searches still work without the index, the next job tries again
+            SQLBotLogUtil.warning(f"Can not create hnsw index on {table} for dimension {dimension}: {e}")
+            return
+        _indexed.add(key)
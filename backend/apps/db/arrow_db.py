@@ -0,0 +1,253 @@
+import base64
+import importlib
+import importlib.util
+import json
+import re
+import time
+import urllib.parse
+from decimal import Decimal
+from typing import Any, Optional
+from zoneinfo import ZoneInfo
+
+from sqlalchemy.pool import QueuePool
+
+from apps.datasource.models.datasource import DatasourceConf, CoreDatasource
+from apps.datasource.utils.utils import aes_decrypt
+from apps.db.db_sql import get_pg_search_path_option
+from apps.db.ds_health import DsHealthCache
+from apps.db.ds_pool import DsPoolCache, get_conf_hash, get_ds_pool_key
+from apps.db.engine import get_engine_config
+from apps.system.schemas.system_schema import AssistantOutDsSchema
+from common.core.config import settings
+from common.error import TaskCancelledError, ParseSQLResultError
+from common.utils.cancellation import CancellationToken, on_cancel, raise_if_cancelled
+from common.utils.data_format import DataFormat
+from common.utils.utils import SQLBotLogUtil, equals_ignore_case
+
+# ds type -> module that fetches the result as Arrow record batches
+arrow_drivers = {
+    'pg': 'adbc_driver_postgresql',
+    'excel': 'adbc_driver_postgresql',
+    'mysql': 'connectorx',
+}
+
+_missing_drivers: set[str] = set()
+
+# ADBC pool key -> TimeZone setting of its sessions
+_session_timezones: dict[str, str] = {}
+
+
+def _is_installed(module: str) -> bool:
+    if module in _missing_drivers:
+        return False
+    if importlib.util.find_spec(module) is None:
+        _missing_drivers.add(module)
+        SQLBotLogUtil.warning(f"Arrow driver {module} is not installed, fetch results with the default driver")
+        return False
+    return True
+
+
+def get_arrow_conf(ds: CoreDatasource) -> DatasourceConf:
+    return DatasourceConf(**json.loads(aes_decrypt(ds.configuration))) if not equals_ignore_case(ds.type,
+                                                                                                 "excel") else get_engine_config()
+
+
+def is_arrow_supported(ds: CoreDatasource | AssistantOutDsSchema, conf: DatasourceConf = None) -> bool:
+    if not settings.DS_ARROW_ENABLED or not isinstance(ds, CoreDatasource):
+        return False
+    types = [item.strip() for item in settings.DS_ARROW_TYPES.split(',')]
+    if ds.type not in types or ds.type not in arrow_drivers:
+        return False
+    # extra jdbc params are written for the default driver
+    if conf is not None and conf.extraJdbc:
+        return False
+    return _is_installed('pyarrow') and _is_installed(arrow_drivers[ds.type])
+
+
+def get_arrow_uri(type: str, conf: DatasourceConf) -> str:
+    auth = f"{urllib.parse.quote(conf.username)}:{urllib.parse.quote(conf.password)}"
+    if equals_ignore_case(type, "mysql"):
+        return f"mysql://{auth}@{conf.host}:{conf.port}/{conf.database}"
+    params = {"connect_timeout": conf.timeout} if conf.timeout else {}
+    options = []
+    if settings.DS_ARROW_STATEMENT_TIMEOUT > 0:
+        options.append(f"-c statement_timeout={settings.DS_ARROW_STATEMENT_TIMEOUT * 1000}")
+    if conf.dbSchema is not None and conf.dbSchema != "":
+        options.append(get_pg_search_path_option(conf.dbSchema))
+    if options:
+        params["options"] = " ".join(options)
+    query = f"?{urllib.parse.urlencode(params, quote_via=urllib.parse.quote)}" if params else ""
+    return f"postgresql://{auth}@{conf.host}:{conf.port}/{conf.database}{query}"
+
+
+class ArrowTypeMappingError(Exception):
+    """A result column whose Arrow values differ from the default driver, the query falls back to it."""
+
+
+# postgres types read from ADBC as the same python values psycopg2 returns
+_adbc_same_types = {'bool', 'int2', 'int4', 'int8', 'oid', 'float4', 'float8', 'text', 'varchar', 'bpchar', 'char',
+                    'name', 'date', 'time', 'timestamp'}
+
+
+def _to_decimal(value):
+    return Decimal(value) if value is not None else None
+
+
+def get_adbc_converters(schema) -> list[Optional[str]]:
+    """Per column conversion of the ADBC values to the psycopg2 ones, numeric is read as text and timestamptz
+    in UTC, columns of other types (interval, json, arrays...) raise ArrowTypeMappingError before any row is read."""
+    converters = []
+    for field in schema:
+        typname = (field.metadata or {}).get(b'ADBC:postgresql:typname', b'').decode()
+        if typname in _adbc_same_types:
+            converters.append(None)
+        elif typname in ('numeric', 'timestamptz'):
+            converters.append(typname)
+        else:
+            raise ArrowTypeMappingError(f"column {field.name} of type {typname or field.type}")
+    return converters
+
+
+def _session_timezone(pool_key: str, pool):
+    name = _session_timezones.get(pool_key)
+    if name is None:
+        # the connection of the query may be discarded already, the time zone is the same for the whole pool
+        conn = pool.connect()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SHOW TimeZone")
+                name = cursor.fetchone()[0]
+        finally:
+            conn.close()
+        _session_timezones[pool_key] = name
+    try:
+        return ZoneInfo(name)
+    except Exception:
+        raise ArrowTypeMappingError(f"timestamptz in session time zone {name}")
+
+
+def convert_adbc_columns(columns: list[list], converters: list[Optional[str]], tz=None) -> list[list]:
+    result = []
+    for column, converter in zip(columns, converters):
+        if converter == 'numeric':
+            column = [_to_decimal(value) for value in column]
+        elif converter == 'timestamptz':
+            # psycopg2 returns the time in the session time zone
+            column = [value.astimezone(tz) if value is not None else None for value in column]
+        result.append(column)
+    return result
+
+
+def _create_adbc_pool(uri: str, conf: DatasourceConf):
+    dbapi = importlib.import_module('adbc_driver_postgresql.dbapi')
+    return QueuePool(lambda: dbapi.connect(uri), pool_size=settings.DS_POOL_SIZE,
+                     max_overflow=settings.DS_MAX_OVERFLOW, timeout=conf.timeout or 30,
+                     recycle=settings.DS_POOL_RECYCLE)
+
+
+def _fetch_adbc(ds: CoreDatasource, conf: DatasourceConf, sql: str, max_rows: int,
+                cancel_token: Optional[CancellationToken]):
+    pa = importlib.import_module('pyarrow')
+    pool_key = f"arrow:{get_conf_hash(ds.type, conf)}"
+    pool = DsPoolCache.get(get_ds_pool_key(ds), pool_key,
+                           lambda: _create_adbc_pool(get_arrow_uri(ds.type, conf), conf))
+    conn = pool.connect()
+    # an unfinished or cancelled COPY stream leaves the connection unusable, it is not put back into the pool
+    discard = True
+    try:
+        with conn.cursor() as cursor:
+            # ADBC sends a cancel request for the running statement, like psycopg2 does
+            with on_cancel(cancel_token, cursor.adbc_cancel):
+                cursor.execute(sql)
+                reader = cursor.fetch_record_batch()
+                converters = get_adbc_converters(reader.schema)
+                batches = []
+                count = 0
+                truncated = False
+                for batch in reader:
+                    raise_if_cancelled(cancel_token)
+                    batches.append(batch)
+                    count += batch.num_rows
+                    if 0 < max_rows < count:
+                        truncated = True
+                        break
+                table = pa.Table.from_batches(batches, schema=reader.schema)
+                discard = truncated
+    finally:
+        if discard:
+            conn.invalidate()
+        conn.close()
+    tz = _session_timezone(pool_key, pool) if 'timestamptz' in converters else None
+    if truncated:
+        table = table.slice(0, max_rows)
+    columns = convert_adbc_columns([column.to_pylist() for column in table.columns], converters, tz)
+    return table, columns, truncated
+
+
+def _check_connectorx_schema(schema):
+    pa = importlib.import_module('pyarrow')
+    for field in schema:
+        if not (pa.types.is_integer(field.type) or pa.types.is_floating(field.type)
+                or pa.types.is_boolean(field.type) or pa.types.is_string(field.type)
+                or pa.types.is_large_string(field.type) or pa.types.is_decimal(field.type)
+                or pa.types.is_date(field.type) or pa.types.is_time(field.type)
+                or pa.types.is_timestamp(field.type)):
+            raise ArrowTypeMappingError(f"column {field.name} of type {field.type}")
+
+
+def _fetch_connectorx(ds: CoreDatasource, conf: DatasourceConf, sql: str, max_rows: int,
+                      cancel_token: Optional[CancellationToken]):
+    cx = importlib.import_module('connectorx')
+    if settings.DS_ARROW_STATEMENT_TIMEOUT > 0:
+        # connectorx opens its own connection and can not be interrupted, the server stops the query instead
+        sql = re.sub(r'^\s*select\b',
+                     f'SELECT /*+ MAX_EXECUTION_TIME({settings.DS_ARROW_STATEMENT_TIMEOUT * 1000}) */', sql,
+                     count=1, flags=re.IGNORECASE)
+    table = cx.read_sql(get_arrow_uri(ds.type, conf), sql, return_type='arrow')
+    raise_if_cancelled(cancel_token)
+    _check_connectorx_schema(table.schema)
+    truncated = 0 < max_rows < table.num_rows
+    if truncated:
+        table = table.slice(0, max_rows)
+    return table, [column.to_pylist() for column in table.columns], truncated
+
+
+def build_arrow_result(sql: str, table: Any, columns: list[list], origin_column=False, truncated=False,
+                       fetch_time: float = 0):
+    """Same columnar result as build_exec_result, from the Arrow table and its columns as python values."""
+    fields = list(table.column_names) if origin_column else [item.lower() for item in table.column_names]
+    data_columns = DataFormat.convert_decimal_columns(columns)
+    return {"fields": fields, "columns": data_columns, "truncated": truncated,
+            "fetch_time": round(fetch_time, 3), "bytes_read": table.nbytes,
+            "sql": bytes.decode(base64.b64encode(bytes(sql, 'utf-8')))}
+
+
+def arrow_exec_sql(ds: CoreDatasource | AssistantOutDsSchema, sql: str, origin_column=False, max_rows: int = 0,
+                   cancel_token: Optional[CancellationToken] = None) -> Optional[dict]:
+    """Execute the query with an Arrow native driver, None when the datasource has none or the result has
+    a column type the driver maps differently, the caller then runs the query with the default driver."""
+    if not isinstance(ds, CoreDatasource) or not settings.DS_ARROW_ENABLED:
+        return None
+    conf = get_arrow_conf(ds)
+    if not is_arrow_supported(ds, conf) or DsHealthCache.is_open(ds.id):
+        return None
+
+    start_time = time.time()
+    try:
+        if arrow_drivers[ds.type] == 'connectorx':
+            table, columns, truncated = _fetch_connectorx(ds, conf, sql, max_rows, cancel_token)
+        else:
+            table, columns, truncated = _fetch_adbc(ds, conf, sql, max_rows, cancel_token)
+    except ArrowTypeMappingError as e:
+        raise_if_cancelled(cancel_token)
+        SQLBotLogUtil.info(f"Arrow fetch on datasource {ds.id} skipped, use the default driver: {e}")
+        return None
+    except TaskCancelledError:
+        raise
+    except Exception:
+        raise_if_cancelled(cancel_token)
+        raise
+    try:
+        return build_arrow_result(sql, table, columns, origin_column, truncated, time.time() - start_time)
+    except Exception as ex:
+        raise ParseSQLResultError(str(ex))
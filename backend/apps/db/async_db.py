@@ -0,0 +1,140 @@
+import asyncio
+import importlib.util
+import json
+import time
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+
+from apps.datasource.models.datasource import DatasourceConf, CoreDatasource
+from apps.datasource.utils.utils import aes_decrypt
+from apps.db.bulkhead import DsBulkhead
+from apps.db.db import exec_sql, get_uri_from_config, build_exec_result, drains_unread_rows, detach_streaming_cursor
+from apps.db.db_sql import get_pg_search_path
+from apps.db.ds_pool import DsPoolCache, get_conf_hash, get_ds_pool_key
+from apps.db.engine import get_engine_config
+from apps.system.schemas.system_schema import AssistantOutDsSchema
+from common.core.config import settings
+from common.error import ParseSQLResultError
+from common.utils.utils import SQLBotLogUtil, equals_ignore_case
+
+# ds type -> (sync driver in uri, async driver in uri, module of async driver)
+async_drivers = {
+    'pg': ('postgresql+psycopg2://', 'postgresql+asyncpg://', 'asyncpg'),
+    'excel': ('postgresql+psycopg2://', 'postgresql+asyncpg://', 'asyncpg'),
+    'mysql': ('mysql+pymysql://', 'mysql+aiomysql://', 'aiomysql'),
+}
+
+_missing_drivers: set[str] = set()
+
+
+class AsyncEngineEntry:
+    """Async engine bound to the event loop it was created in, disposable from sync code."""
+
+    def __init__(self, engine: AsyncEngine, loop: asyncio.AbstractEventLoop):
+        self.engine = engine
+        self.loop = loop
+
+    def dispose(self):
+        if self.loop.is_closed():
+            # connections can not be closed any more, just drop them
+            self.engine.sync_engine.dispose(close=False)
+            return
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if running_loop is self.loop:
+            self.loop.create_task(self.engine.dispose())
+        else:
+            asyncio.run_coroutine_threadsafe(self.engine.dispose(), self.loop)
+
+
+def is_async_supported(ds: CoreDatasource | AssistantOutDsSchema, conf: DatasourceConf = None) -> bool:
+    if not settings.DS_ASYNC_ENABLED or not isinstance(ds, CoreDatasource):
+        return False
+    types = [item.strip() for item in settings.DS_ASYNC_TYPES.split(',')]
+    if ds.type not in types or ds.type not in async_drivers:
+        return False
+    # extra jdbc params are written for the sync driver
+    if conf is not None and conf.extraJdbc:
+        return False
+    module = async_drivers[ds.type][2]
+    if module in _missing_drivers:
+        return False
+    if importlib.util.find_spec(module) is None:
+        _missing_drivers.add(module)
+        SQLBotLogUtil.warning(f"Async driver {module} is not installed, use sync execution for {ds.type}")
+        return False
+    return True
+
+
+def get_async_conf(ds: CoreDatasource) -> DatasourceConf:
+    return DatasourceConf(**json.loads(aes_decrypt(ds.configuration))) if not equals_ignore_case(ds.type,
+                                                                                                 "excel") else get_engine_config()
+
+
+def create_ds_async_engine(type: str, conf: DatasourceConf) -> AsyncEngine:
+    sync_prefix, async_prefix, _ = async_drivers[type]
+    uri = async_prefix + get_uri_from_config(type, conf)[len(sync_prefix):]
+    pool_args = {"pool_timeout": conf.timeout,
+                 "pool_size": settings.DS_POOL_SIZE,
+                 "max_overflow": settings.DS_MAX_OVERFLOW,
+                 "pool_recycle": settings.DS_POOL_RECYCLE,
+                 "pool_pre_ping": settings.DS_POOL_PRE_PING}
+    if equals_ignore_case(type, "pg", "excel"):
+        connect_args = {"timeout": conf.timeout}
+        if conf.dbSchema is not None and conf.dbSchema != "":
+            connect_args["server_settings"] = {"search_path": get_pg_search_path(conf.dbSchema)}
+    else:
+        connect_args = {"connect_timeout": conf.timeout}
+    return create_async_engine(uri, connect_args=connect_args, **pool_args)
+
+
+def get_async_engine(ds: CoreDatasource, conf: DatasourceConf) -> AsyncEngine:
+    loop = asyncio.get_running_loop()
+    conf_hash = f"async:{get_conf_hash(ds.type, conf)}"
+    entry = DsPoolCache.get(get_ds_pool_key(ds), conf_hash,
+                            lambda: AsyncEngineEntry(create_ds_async_engine(ds.type, conf), loop))
+    return entry.engine
+
+
+async def async_exec_sql(ds: CoreDatasource | AssistantOutDsSchema, sql: str, origin_column=False,
+                         max_rows: int = 0):
+    """Same contract as exec_sql, run on the event loop for datasource types with an async driver.
+    Used by the datasource API endpoints, chat tasks run on the task executor threads and keep exec_sql."""
+    conf = get_async_conf(ds) if isinstance(ds, CoreDatasource) else None
+    if not is_async_supported(ds, conf):
+        return await asyncio.to_thread(exec_sql, ds, sql, origin_column, max_rows)
+
+    while sql.endswith(';'):
+        sql = sql[:-1]
+
+    async with DsBulkhead.async_slot(ds):
+        start_time = time.time()
+        async with get_async_engine(ds, conf).connect() as conn:
+            truncated = False
+            if max_rows > 0:
+                result = await conn.stream(text(sql))
+                res = []
+                while len(res) < max_rows:
+                    batch = await result.fetchmany(min(settings.DS_FETCH_BATCH_SIZE, max_rows - len(res)))
+                    if not batch:
+                        break
+                    res.extend(batch)
+                else:
+                    truncated = len(await result.fetchmany(1)) > 0
+                columns = list(result.keys())
+                if truncated and drains_unread_rows(ds):
+                    # closing the cursor would read the rest of the result, drop the connection instead
+                    detach_streaming_cursor(result._real_result.cursor)
+                    await conn.invalidate()
+                await result.close()
+            else:
+                result = await conn.execute(text(sql))
+                columns = list(result.keys())
+                res = result.fetchall()
+    try:
+        return build_exec_result(sql, columns, res, origin_column, truncated, time.time() - start_time)
+    except Exception as ex:
+        raise ParseSQLResultError(str(ex))
@@ -0,0 +1,196 @@
+import asyncio
+import threading
+import time
+from contextlib import contextmanager, asynccontextmanager
+from typing import Any, Optional
+
+from apps.datasource.models.datasource import CoreDatasource
+from apps.system.schemas.system_schema import AssistantOutDsSchema
+from common.core.config import settings
+from common.error import DatasourceBusyError
+from common.utils.cancellation import CancellationToken, on_cancel, raise_if_cancelled
+from common.utils.utils import SQLBotLogUtil
+
+_cond = threading.Condition()
+
+# ds_id -> queries running / waiting, oid -> queries running
+_running_ds: dict[Any, int] = {}
+_waiting_ds: dict[Any, int] = {}
+_running_oid: dict[Any, int] = {}
+
+# ds_id -> counters
+_metrics: dict[Any, dict] = {}
+
+# (event loop, event) of async queries waiting for a slot, woken up by release
+_async_waiters: set[tuple[asyncio.AbstractEventLoop, asyncio.Event]] = set()
+
+
+def _get_metrics(ds_id: Any) -> dict:
+    metrics = _metrics.get(ds_id)
+    if metrics is None:
+        metrics = {"admitted": 0, "rejected": 0, "timeouts": 0, "max_waiting": 0,
+                   "total_wait_ms": 0.0, "max_wait_ms": 0.0}
+        _metrics[ds_id] = metrics
+    return metrics
+
+
+def _notify_all():
+    with _cond:
+        _cond.notify_all()
+        for loop, event in _async_waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # event loop already closed
+                pass
+
+
+def _can_run(ds_id: Any, oid: Any) -> bool:
+    if 0 < settings.DS_QUERY_CONCURRENCY <= _running_ds.get(ds_id, 0):
+        return False
+    if oid is not None and 0 < settings.WORKSPACE_QUERY_CONCURRENCY <= _running_oid.get(oid, 0):
+        return False
+    return True
+
+
+def _inc(counter: dict, key: Any, value: int):
+    count = counter.get(key, 0) + value
+    if count > 0:
+        counter[key] = count
+    else:
+        counter.pop(key, None)
+
+
+def _enqueue(ds_id: Any, metrics: dict):
+    waiting = _waiting_ds.get(ds_id, 0)
+    if waiting >= settings.DS_QUERY_QUEUE_SIZE:
+        metrics["rejected"] += 1
+        SQLBotLogUtil.warning(f"Datasource {ds_id} is busy, {waiting} queries are waiting")
+        raise DatasourceBusyError(f"Datasource is busy, {waiting} queries are waiting, try again later")
+    _inc(_waiting_ds, ds_id, 1)
+    metrics["max_waiting"] = max(metrics["max_waiting"], waiting + 1)
+
+
+def _admit(ds_id: Any, oid: Any, metrics: dict, start: float):
+    _inc(_running_ds, ds_id, 1)
+    if oid is not None:
+        _inc(_running_oid, oid, 1)
+    wait_ms = (time.monotonic() - start) * 1000
+    metrics["admitted"] += 1
+    metrics["total_wait_ms"] += wait_ms
+    metrics["max_wait_ms"] = max(metrics["max_wait_ms"], wait_ms)
+
+
+def get_ds_key(ds: CoreDatasource | AssistantOutDsSchema) -> tuple[Any, Any]:
+    if isinstance(ds, CoreDatasource):
+        return ds.id, ds.oid
+    # assistant datasources have their own ids and no workspace, only the datasource limit applies
+    return f"assistant:{ds.id}", None
+
+
+class DsBulkhead:
+    """Admission control around datasource queries, limits concurrent queries per datasource and per
+    workspace, excess queries wait in a bounded queue."""
+
+    @staticmethod
+    def acquire(ds_id: Any, oid: Any = None, timeout: Optional[float] = None,
+                cancel_token: Optional[CancellationToken] = None):
+        if timeout is None:
+            timeout = settings.DS_QUERY_QUEUE_TIMEOUT
+        start = time.monotonic()
+        with _cond:
+            metrics = _get_metrics(ds_id)
+            if not _can_run(ds_id, oid):
+                _enqueue(ds_id, metrics)
+                try:
+                    # a cancelled task leaves the queue without waiting for the timeout
+                    with on_cancel(cancel_token, _notify_all):
+                        admitted = _cond.wait_for(
+                            lambda: (cancel_token is not None and cancel_token.cancelled) or _can_run(ds_id, oid),
+                            timeout if timeout > 0 else None)
+                finally:
+                    _inc(_waiting_ds, ds_id, -1)
+                raise_if_cancelled(cancel_token)
+                if not admitted:
+                    metrics["timeouts"] += 1
+                    raise DatasourceBusyError(f"Datasource is busy, waited {timeout}s for a free slot")
+            _admit(ds_id, oid, metrics, start)
+
+    @staticmethod
+    async def acquire_async(ds_id: Any, oid: Any = None, timeout: Optional[float] = None):
+        """Same as acquire, waits on the event loop instead of a thread."""
+        if timeout is None:
+            timeout = settings.DS_QUERY_QUEUE_TIMEOUT
+        start = time.monotonic()
+        with _cond:
+            metrics = _get_metrics(ds_id)
+            if _can_run(ds_id, oid):
+                _admit(ds_id, oid, metrics, start)
+                return
+            _enqueue(ds_id, metrics)
+            waiter = (asyncio.get_running_loop(), asyncio.Event())
+            _async_waiters.add(waiter)
+        try:
+            while True:
+                # cleared before the check, a release in between sets it again
+                waiter[1].clear()
+                with _cond:
+                    if _can_run(ds_id, oid):
+                        _admit(ds_id, oid, metrics, start)
+                        return
+                    remaining = start + timeout - time.monotonic() if timeout > 0 else None
+                    if remaining is not None and remaining <= 0:
+                        metrics["timeouts"] += 1
+                        raise DatasourceBusyError(f"Datasource is busy, waited {timeout}s for a free slot")
+                try:
+                    await asyncio.wait_for(waiter[1].wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            with _cond:
+                _async_waiters.discard(waiter)
+                _inc(_waiting_ds, ds_id, -1)
+
+    @staticmethod
+    def release(ds_id: Any, oid: Any = None):
+        with _cond:
+            _inc(_running_ds, ds_id, -1)
+            if oid is not None:
+                _inc(_running_oid, oid, -1)
+        _notify_all()
+
+    @staticmethod
+    @contextmanager
+    def slot(ds, cancel_token: Optional[CancellationToken] = None):
+        ds_id, oid = get_ds_key(ds)
+        DsBulkhead.acquire(ds_id, oid, cancel_token=cancel_token)
+        try:
+            yield
+        finally:
+            DsBulkhead.release(ds_id, oid)
+
+    @staticmethod
+    @asynccontextmanager
+    async def async_slot(ds):
+        ds_id, oid = get_ds_key(ds)
+        await DsBulkhead.acquire_async(ds_id, oid)
+        try:
+            yield
+        finally:
+            DsBulkhead.release(ds_id, oid)
+
+    @staticmethod
+    def stats() -> dict:
+        with _cond:
+            datasources = []
+            for ds_id, metrics in _metrics.items():
+                admitted = metrics["admitted"]
+                datasources.append({"ds_id": ds_id, "running": _running_ds.get(ds_id, 0),
+                                    "waiting": _waiting_ds.get(ds_id, 0), **metrics,
+                                    "avg_wait_ms": round(metrics["total_wait_ms"] / admitted, 3) if admitted else 0})
+            return {"ds_concurrency": settings.DS_QUERY_CONCURRENCY,
+                    "workspace_concurrency": settings.WORKSPACE_QUERY_CONCURRENCY,
+                    "queue_size": settings.DS_QUERY_QUEUE_SIZE,
+                    "queue_timeout": settings.DS_QUERY_QUEUE_TIMEOUT,
+                    "workspaces": [{"oid": oid, "running": count} for oid, count in _running_oid.items()],
+                    "datasources": datasources}
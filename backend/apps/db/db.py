@@ -1,48 +1,35 @@
 import base64
 import json
-import os
-import platform
+import time
 import urllib.parse
-from decimal import Decimal
-from typing import Optional
+from typing import Any, Callable, Optional
 
-import oracledb
-import psycopg2
-import pymssql
-
-from apps.db.db_sql import get_table_sql, get_field_sql, get_version_sql
+from apps.db.db_sql import get_table_sql, get_field_sql, get_version_sql, get_all_fields_sql, \
+    get_pg_search_path_option
 from common.error import ParseSQLResultError
 
-if platform.system() != "Darwin":
-    import dmPython
-import pymysql
-import redshift_connector
 from sqlalchemy import create_engine, text, Engine
 from sqlalchemy.orm import sessionmaker
 
 from apps.datasource.models.datasource import DatasourceConf, CoreDatasource, TableSchema, ColumnSchema
 from apps.datasource.utils.utils import aes_decrypt
+from apps.db.arrow_db import arrow_exec_sql
 from apps.db.constant import DB, ConnectType
+from apps.db.bulkhead import DsBulkhead
+from apps.db.driver import get_adapter, get_extra_config, fetch_rows
+from apps.db.driver_registry import get_driver
+from apps.db.ds_health import DsHealthCache
+from apps.db.ds_pool import DsPoolCache, get_conf_hash, get_ds_pool_key
 from apps.db.engine import get_engine_config
 from apps.system.crud.assistant import get_out_ds_conf
 from apps.system.schemas.system_schema import AssistantOutDsSchema
 from common.core.deps import Trans
+from common.utils.cancellation import CancellationToken, on_cancel, raise_if_cancelled
+from common.utils.data_format import DataFormat
 from common.utils.utils import SQLBotLogUtil, equals_ignore_case
 from fastapi import HTTPException
-from apps.db.es_engine import get_es_connect, get_es_index, get_es_fields, get_es_data_by_http
 from common.core.config import settings
 
-try:
-    if os.path.exists(settings.ORACLE_CLIENT_PATH):
-        oracledb.init_oracle_client(
-            lib_dir=settings.ORACLE_CLIENT_PATH
-        )
-        SQLBotLogUtil.info("init oracle client success, use thick mode")
-    else:
-        SQLBotLogUtil.info("init oracle client failed, because not found oracle client, use thin mode")
-except Exception as e:
-    SQLBotLogUtil.error("init oracle client failed, check your client is installed, use thin mode")
-
 
 def get_uri(ds: CoreDatasource) -> str:
     conf = DatasourceConf(**json.loads(aes_decrypt(ds.configuration))) if not equals_ignore_case(ds.type,
@@ -88,23 +75,10 @@ def get_uri_from_config(type: str, conf: DatasourceConf) -> str:
     return db_url
 
 
-def get_extra_config(conf: DatasourceConf):
-    config_dict = {}
-    if conf.extraJdbc:
-        config_arr = conf.extraJdbc.split("&")
-        for config in config_arr:
-            kv = config.split("=")
-            if len(kv) == 2 and kv[0] and kv[1]:
-                config_dict[kv[0]] = kv[1]
-            else:
-                raise Exception(f'param: {config} is error')
-    return config_dict
-
-
 def get_origin_connect(type: str, conf: DatasourceConf):
     extra_config_dict = get_extra_config(conf)
     if equals_ignore_case(type, "sqlServer"):
-        return pymssql.connect(
+        return get_driver(DB.sqlServer).connect(
             server=conf.host,
             port=str(conf.port),
             user=conf.username,
@@ -116,6 +90,13 @@ def get_origin_connect(type: str, conf: DatasourceConf):
         )
 
 
+def get_ds_conf_hash(ds: CoreDatasource) -> str:
+    """Hash of the datasource config, the same the connection pools are keyed by."""
+    conf = DatasourceConf(**json.loads(aes_decrypt(ds.configuration))) if not equals_ignore_case(ds.type,
+                                                                                                 "excel") else get_engine_config()
+    return get_conf_hash(ds.type, conf)
+
+
 # use sqlalchemy
 def get_engine(ds: CoreDatasource, timeout: int = 0) -> Engine:
     conf = DatasourceConf(**json.loads(aes_decrypt(ds.configuration))) if not equals_ignore_case(ds.type,
@@ -124,31 +105,43 @@ def get_engine(ds: CoreDatasource, timeout: int = 0) -> Engine:
         conf.timeout = timeout
     if timeout > 0:
         conf.timeout = timeout
-    if equals_ignore_case(ds.type, "pg"):
+    return DsPoolCache.get(get_ds_pool_key(ds), get_conf_hash(ds.type, conf), lambda: create_ds_engine(ds.type, conf))
+
+
+def create_ds_engine(type: str, conf: DatasourceConf) -> Engine:
+    # import and initialize the driver (e.g. oracle thick mode) before the dialect loads it
+    get_driver(DB.get_db(type))
+    pool_args = {"pool_timeout": conf.timeout,
+                 "pool_size": settings.DS_POOL_SIZE,
+                 "max_overflow": settings.DS_MAX_OVERFLOW,
+                 "pool_recycle": settings.DS_POOL_RECYCLE,
+                 "pool_pre_ping": settings.DS_POOL_PRE_PING}
+    if equals_ignore_case(type, "pg"):
         if conf.dbSchema is not None and conf.dbSchema != "":
-            engine = create_engine(get_uri(ds),
-                                   connect_args={"options": f"-c search_path={urllib.parse.quote(conf.dbSchema)}",
+            engine = create_engine(get_uri_from_config(type, conf),
+                                   connect_args={"options": get_pg_search_path_option(conf.dbSchema),
                                                  "connect_timeout": conf.timeout},
-                                   pool_timeout=conf.timeout)
+                                   **pool_args)
         else:
-            engine = create_engine(get_uri(ds),
+            engine = create_engine(get_uri_from_config(type, conf),
                                    connect_args={"connect_timeout": conf.timeout},
-                                   pool_timeout=conf.timeout)
-    elif equals_ignore_case(ds.type, 'sqlServer'):
-        engine = create_engine('mssql+pymssql://', creator=lambda: get_origin_connect(ds.type, conf),
-                               pool_timeout=conf.timeout)
-    elif equals_ignore_case(ds.type, 'oracle'):
-        engine = create_engine(get_uri(ds),
-                               pool_timeout=conf.timeout)
-    else:  # mysql, ck
-        engine = create_engine(get_uri(ds), connect_args={"connect_timeout": conf.timeout}, pool_timeout=conf.timeout)
+                                   **pool_args)
+    elif equals_ignore_case(type, 'sqlServer'):
+        engine = create_engine('mssql+pymssql://', creator=lambda: get_origin_connect(type, conf),
+                               **pool_args)
+    elif equals_ignore_case(type, 'oracle'):
+        engine = create_engine(get_uri_from_config(type, conf),
+                               **pool_args)
+    else:  # mysql, ck, excel
+        engine = create_engine(get_uri_from_config(type, conf), connect_args={"connect_timeout": conf.timeout},
+                               **pool_args)
     return engine
 
 
 def get_session(ds: CoreDatasource | AssistantOutDsSchema):
     # engine = get_engine(ds) if isinstance(ds, CoreDatasource) else get_ds_engine(ds)
     if isinstance(ds, AssistantOutDsSchema):
-        out_conf = get_out_ds_conf(ds, 30)
+        out_conf = get_out_ds_conf(ds)
         ds.configuration = out_conf
 
     engine = get_engine(ds)
@@ -157,119 +150,64 @@ def get_session(ds: CoreDatasource | AssistantOutDsSchema):
     return session
 
 
-def check_connection(trans: Optional[Trans], ds: CoreDatasource | AssistantOutDsSchema, is_raise: bool = False):
+def check_connection(trans: Optional[Trans], ds: CoreDatasource | AssistantOutDsSchema, is_raise: bool = False,
+                     use_cache: bool = False):
+    """use_cache: trust a recent successful connection, and fail fast while the datasource keeps failing"""
     if isinstance(ds, AssistantOutDsSchema):
-        out_conf = get_out_ds_conf(ds, 10)
+        out_conf = get_out_ds_conf(ds)
         ds.configuration = out_conf
 
+    ds_id = ds.id if isinstance(ds, CoreDatasource) else None
+    if use_cache and ds_id is not None:
+        if DsHealthCache.is_healthy(ds_id):
+            return True
+        if not DsHealthCache.allow_request(ds_id):
+            SQLBotLogUtil.warning(f"Datasource {ds_id} keeps failing, skip connection check")
+            return False
+
     db = DB.get_db(ds.type)
-    if db.connect_type == ConnectType.sqlalchemy:
-        conn = get_engine(ds, 10)
-        try:
+    try:
+        if db.connect_type == ConnectType.sqlalchemy:
+            # the timeout is part of the pool config, a different one would open a second pool
+            conn = get_engine(ds)
             with conn.connect() as connection:
-                SQLBotLogUtil.info("success")
-                return True
-        except Exception as e:
-            SQLBotLogUtil.error(f"Datasource {ds.id} connection failed: {e}")
-            if is_raise:
-                raise HTTPException(status_code=500, detail=trans('i18n_ds_invalid') + f': {e.args}')
-            return False
-    else:
-        conf = DatasourceConf(**json.loads(aes_decrypt(ds.configuration)))
-        extra_config_dict = get_extra_config(conf)
-        if equals_ignore_case(ds.type, 'dm'):
-            with dmPython.connect(user=conf.username, password=conf.password, server=conf.host,
-                                  port=conf.port, **extra_config_dict) as conn, conn.cursor() as cursor:
-                try:
-                    cursor.execute('select 1', timeout=10).fetchall()
-                    SQLBotLogUtil.info("success")
-                    return True
-                except Exception as e:
-                    SQLBotLogUtil.error(f"Datasource {ds.id} connection failed: {e}")
-                    if is_raise:
-                        raise HTTPException(status_code=500, detail=trans('i18n_ds_invalid') + f': {e.args}')
-                    return False
-        elif equals_ignore_case(ds.type, 'doris', 'starrocks'):
-            with pymysql.connect(user=conf.username, passwd=conf.password, host=conf.host,
-                                 port=conf.port, db=conf.database, connect_timeout=10,
-                                 read_timeout=10, **extra_config_dict) as conn, conn.cursor() as cursor:
-                try:
-                    cursor.execute('select 1')
-                    SQLBotLogUtil.info("success")
-                    return True
-                except Exception as e:
-                    SQLBotLogUtil.error(f"Datasource {ds.id} connection failed: {e}")
-                    if is_raise:
-                        raise HTTPException(status_code=500, detail=trans('i18n_ds_invalid') + f': {e.args}')
-                    return False
-        elif equals_ignore_case(ds.type, 'redshift'):
-            with redshift_connector.connect(host=conf.host, port=conf.port, database=conf.database,
-                                            user=conf.username,
-                                            password=conf.password,
-                                            timeout=10, **extra_config_dict) as conn, conn.cursor() as cursor:
-                try:
-                    cursor.execute('select 1')
-                    SQLBotLogUtil.info("success")
-                    return True
-                except Exception as e:
-                    SQLBotLogUtil.error(f"Datasource {ds.id} connection failed: {e}")
-                    if is_raise:
-                        raise HTTPException(status_code=500, detail=trans('i18n_ds_invalid') + f': {e.args}')
-                    return False
-        elif equals_ignore_case(ds.type, 'kingbase'):
-            with psycopg2.connect(host=conf.host, port=conf.port, database=conf.database,
-                                  user=conf.username,
-                                  password=conf.password,
-                                  connect_timeout=10, **extra_config_dict) as conn, conn.cursor() as cursor:
-                try:
-                    cursor.execute('select 1')
-                    SQLBotLogUtil.info("success")
-                    return True
-                except Exception as e:
-                    SQLBotLogUtil.error(f"Datasource {ds.id} connection failed: {e}")
-                    if is_raise:
-                        raise HTTPException(status_code=500, detail=trans('i18n_ds_invalid') + f': {e.args}')
-                    return False
-        elif equals_ignore_case(ds.type, 'es'):
-            es_conn = get_es_connect(conf)
-            if es_conn.ping():
-                SQLBotLogUtil.info("success")
-                return True
-            else:
+                pass
+        else:
+            conf = DatasourceConf(**json.loads(aes_decrypt(ds.configuration)))
+            if not get_adapter(db).check_connection(ds, conf):
                 SQLBotLogUtil.info("failed")
+                if ds_id is not None:
+                    DsHealthCache.mark_failure(ds_id)
                 return False
-    # else:
-    #     conn = get_ds_engine(ds)
-    #     try:
-    #         with conn.connect() as connection:
-    #             SQLBotLogUtil.info("success")
-    #             return True
-    #     except Exception as e:
-    #         SQLBotLogUtil.error(f"Datasource {ds.id} connection failed: {e}")
-    #         if is_raise:
-    #             raise HTTPException(status_code=500, detail=trans('i18n_ds_invalid') + f': {e.args}')
-    #         return False
-
-    return False
+        SQLBotLogUtil.info("success")
+        if ds_id is not None:
+            DsHealthCache.mark_ok(ds_id)
+        return True
+    except Exception as e:
+        SQLBotLogUtil.error(f"Datasource {ds.id} connection failed: {e}")
+        if ds_id is not None:
+            DsHealthCache.mark_failure(ds_id)
+        if is_raise:
+            raise HTTPException(status_code=500, detail=trans('i18n_ds_invalid') + f': {e.args}')
+        return False
 
 
 def get_version(ds: CoreDatasource | AssistantOutDsSchema):
+    ds_id = ds.id if isinstance(ds, CoreDatasource) else None
+    if ds_id is not None:
+        version = DsHealthCache.get_version(ds_id)
+        if version is not None:
+            return version
+        if DsHealthCache.is_open(ds_id):
+            return ''
+
     version = ''
     if isinstance(ds, CoreDatasource):
         conf = DatasourceConf(
             **json.loads(aes_decrypt(ds.configuration))) if not equals_ignore_case(ds.type,
                                                                                    "excel") else get_engine_config()
     else:
-        conf = DatasourceConf(**json.loads(aes_decrypt(get_out_ds_conf(ds, 10))))
-    # if isinstance(ds, AssistantOutDsSchema):
-    #     conf = DatasourceConf()
-    #     conf.host = ds.host
-    #     conf.port = ds.port
-    #     conf.username = ds.user
-    #     conf.password = ds.password
-    #     conf.database = ds.dataBase
-    #     conf.dbSchema = ds.db_schema
-    #     conf.timeout = 10
+        conf = DatasourceConf(**json.loads(aes_decrypt(get_out_ds_conf(ds))))
     db = DB.get_db(ds.type)
     sql = get_version_sql(ds, conf)
     try:
@@ -279,26 +217,18 @@ def get_version(ds: CoreDatasource | AssistantOutDsSchema):
                     res = result.fetchall()
                     version = res[0][0]
         else:
-            extra_config_dict = get_extra_config(conf)
-            if equals_ignore_case(ds.type, 'dm'):
-                with dmPython.connect(user=conf.username, password=conf.password, server=conf.host,
-                                      port=conf.port) as conn, conn.cursor() as cursor:
-                    cursor.execute(sql, timeout=10, **extra_config_dict)
-                    res = cursor.fetchall()
-                    version = res[0][0]
-            elif equals_ignore_case(ds.type, 'doris', 'starrocks'):
-                with pymysql.connect(user=conf.username, passwd=conf.password, host=conf.host,
-                                     port=conf.port, db=conf.database, connect_timeout=10,
-                                     read_timeout=10, **extra_config_dict) as conn, conn.cursor() as cursor:
-                    cursor.execute(sql)
-                    res = cursor.fetchall()
-                    version = res[0][0]
-            elif equals_ignore_case(ds.type, 'redshift', 'es'):
-                version = ''
+            version = get_adapter(db).get_version(ds, conf, sql)
+        version = version.decode() if isinstance(version, bytes) else version
+        if ds_id is not None:
+            DsHealthCache.set_version(ds_id, version)
+            DsHealthCache.mark_ok(ds_id)
     except Exception as e:
-        print(e)
+        # some servers or users can not run the version sql although queries work, so it is not a health failure
+        SQLBotLogUtil.warning(f"Get version of datasource {ds.id} failed: {e}")
         version = ''
-    return version.decode() if isinstance(version, bytes) else version
+        if ds_id is not None:
+            DsHealthCache.set_version(ds_id, version, settings.DS_VERSION_FAILURE_CACHE_TTL)
+    return version
 
 
 def get_schema(ds: CoreDatasource):
@@ -318,31 +248,7 @@ def get_schema(ds: CoreDatasource):
                 res_list = [item[0] for item in res]
                 return res_list
     else:
-        extra_config_dict = get_extra_config(conf)
-        if equals_ignore_case(ds.type, 'dm'):
-            with dmPython.connect(user=conf.username, password=conf.password, server=conf.host,
-                                  port=conf.port, **extra_config_dict) as conn, conn.cursor() as cursor:
-                cursor.execute("""select OBJECT_NAME from dba_objects where object_type='SCH'""", timeout=conf.timeout)
-                res = cursor.fetchall()
-                res_list = [item[0] for item in res]
-                return res_list
-        elif equals_ignore_case(ds.type, 'redshift'):
-            with redshift_connector.connect(host=conf.host, port=conf.port, database=conf.database, user=conf.username,
-                                            password=conf.password,
-                                            timeout=conf.timeout, **extra_config_dict) as conn, conn.cursor() as cursor:
-                cursor.execute("""SELECT nspname FROM pg_namespace""")
-                res = cursor.fetchall()
-                res_list = [item[0] for item in res]
-                return res_list
-        elif equals_ignore_case(ds.type, 'kingbase'):
-            with psycopg2.connect(host=conf.host, port=conf.port, database=conf.database, user=conf.username,
-                                  password=conf.password,
-                                  options=f"-c statement_timeout={conf.timeout * 1000}",
-                                  **extra_config_dict) as conn, conn.cursor() as cursor:
-                cursor.execute("""SELECT nspname FROM pg_namespace""")
-                res = cursor.fetchall()
-                res_list = [item[0] for item in res]
-                return res_list
+        return get_adapter(db).get_schema(ds, conf)
 
 
 def get_tables(ds: CoreDatasource):
@@ -357,43 +263,9 @@ def get_tables(ds: CoreDatasource):
                 res_list = [TableSchema(*item) for item in res]
                 return res_list
     else:
-        extra_config_dict = get_extra_config(conf)
-        if equals_ignore_case(ds.type, 'dm'):
-            with dmPython.connect(user=conf.username, password=conf.password, server=conf.host,
-                                  port=conf.port, **extra_config_dict) as conn, conn.cursor() as cursor:
-                cursor.execute(sql, {"param": sql_param}, timeout=conf.timeout)
-                res = cursor.fetchall()
-                res_list = [TableSchema(*item) for item in res]
-                return res_list
-        elif equals_ignore_case(ds.type, 'doris', 'starrocks'):
-            with pymysql.connect(user=conf.username, passwd=conf.password, host=conf.host,
-                                 port=conf.port, db=conf.database, connect_timeout=conf.timeout,
-                                 read_timeout=conf.timeout, **extra_config_dict) as conn, conn.cursor() as cursor:
-                cursor.execute(sql, (sql_param,))
-                res = cursor.fetchall()
-                res_list = [TableSchema(*item) for item in res]
-                return res_list
-        elif equals_ignore_case(ds.type, 'redshift'):
-            with redshift_connector.connect(host=conf.host, port=conf.port, database=conf.database, user=conf.username,
-                                            password=conf.password,
-                                            timeout=conf.timeout, **extra_config_dict) as conn, conn.cursor() as cursor:
-                cursor.execute(sql, (sql_param,))
-                res = cursor.fetchall()
-                res_list = [TableSchema(*item) for item in res]
-                return res_list
-        elif equals_ignore_case(ds.type, 'kingbase'):
-            with psycopg2.connect(host=conf.host, port=conf.port, database=conf.database, user=conf.username,
-                                  password=conf.password,
-                                  options=f"-c statement_timeout={conf.timeout * 1000}",
-                                  **extra_config_dict) as conn, conn.cursor() as cursor:
-                cursor.execute(sql.format(sql_param))
-                res = cursor.fetchall()
-                res_list = [TableSchema(*item) for item in res]
-                return res_list
-        elif equals_ignore_case(ds.type, 'es'):
-            res = get_es_index(conf)
-            res_list = [TableSchema(*item) for item in res]
-            return res_list
+        res = get_adapter(db).get_tables(ds, conf, sql, sql_param)
+        res_list = [TableSchema(*item) for item in res]
+        return res_list
 
 
 def get_fields(ds: CoreDatasource, table_name: str = None):
@@ -408,156 +280,149 @@ def get_fields(ds: CoreDatasource, table_name: str = None):
                 res_list = [ColumnSchema(*item) for item in res]
                 return res_list
     else:
-        extra_config_dict = get_extra_config(conf)
-        if equals_ignore_case(ds.type, 'dm'):
-            with dmPython.connect(user=conf.username, password=conf.password, server=conf.host,
-                                  port=conf.port, **extra_config_dict) as conn, conn.cursor() as cursor:
-                cursor.execute(sql, {"param1": p1, "param2": p2}, timeout=conf.timeout)
-                res = cursor.fetchall()
-                res_list = [ColumnSchema(*item) for item in res]
-                return res_list
-        elif equals_ignore_case(ds.type, 'doris', 'starrocks'):
-            with pymysql.connect(user=conf.username, passwd=conf.password, host=conf.host,
-                                 port=conf.port, db=conf.database, connect_timeout=conf.timeout,
-                                 read_timeout=conf.timeout, **extra_config_dict) as conn, conn.cursor() as cursor:
-                cursor.execute(sql, (p1, p2))
-                res = cursor.fetchall()
-                res_list = [ColumnSchema(*item) for item in res]
-                return res_list
-        elif equals_ignore_case(ds.type, 'redshift'):
-            with redshift_connector.connect(host=conf.host, port=conf.port, database=conf.database, user=conf.username,
-                                            password=conf.password,
-                                            timeout=conf.timeout, **extra_config_dict) as conn, conn.cursor() as cursor:
-                cursor.execute(sql, (p1, p2))
-                res = cursor.fetchall()
-                res_list = [ColumnSchema(*item) for item in res]
-                return res_list
-        elif equals_ignore_case(ds.type, 'kingbase'):
-            with psycopg2.connect(host=conf.host, port=conf.port, database=conf.database, user=conf.username,
-                                  password=conf.password,
-                                  options=f"-c statement_timeout={conf.timeout * 1000}",
-                                  **extra_config_dict) as conn, conn.cursor() as cursor:
-                cursor.execute(sql.format(p1, p2))
-                res = cursor.fetchall()
-                res_list = [ColumnSchema(*item) for item in res]
-                return res_list
-        elif equals_ignore_case(ds.type, 'es'):
-            res = get_es_fields(conf, table_name)
-            res_list = [ColumnSchema(*item) for item in res]
-            return res_list
+        res = get_adapter(db).get_fields(ds, conf, sql, p1, p2, table_name)
+        res_list = [ColumnSchema(*item) for item in res]
+        return res_list
 
 
-def exec_sql(ds: CoreDatasource | AssistantOutDsSchema, sql: str, origin_column=False):
+def get_all_fields(ds: CoreDatasource, table_names: list[str]) -> Optional[dict[str, list[ColumnSchema]]]:
+    """Fields of the given tables in one catalog query, grouped by table name. None if not supported by the ds type."""
+    if not table_names:
+        return {}
+    conf = DatasourceConf(**json.loads(aes_decrypt(ds.configuration))) if not equals_ignore_case(ds.type,
+                                                                                                 "excel") else get_engine_config()
+    db = DB.get_db(ds.type)
+    sql, p1 = get_all_fields_sql(ds, conf, table_names)
+    if db == DB.es:
+        # no catalog query, mappings of all indices are read in one request
+        res = get_adapter(db).get_all_fields(ds, conf)
+    elif not sql:
+        return None
+    elif db.connect_type == ConnectType.sqlalchemy:
+        with get_session(ds) as session:
+            with session.execute(text(sql), {"param1": p1}) as result:
+                res = result.fetchall()
+    else:
+        res = get_adapter(db).get_fields(ds, conf, sql, p1, None)
+    fields: dict[str, list[ColumnSchema]] = {}
+    for item in res:
+        fields.setdefault(item[0], []).append(ColumnSchema(*item[1:4]))
+    return fields
+
+
+def get_statement_canceller(ds: CoreDatasource | AssistantOutDsSchema, connection) -> Optional[Callable[[], Any]]:
+    """Interrupt the statement running on the DB-API connection from another thread."""
+    if equals_ignore_case(ds.type, "pg", "excel", "oracle"):
+        # psycopg2 sends a cancel request like pg_cancel_backend, oracledb breaks the running call
+        return connection.cancel
+    if equals_ignore_case(ds.type, "sqlServer"):
+        return connection._conn.cancel
+    if equals_ignore_case(ds.type, "mysql"):
+        thread_id = connection.thread_id()
+
+        def kill_query():
+            # the running connection is busy, kill its query from another one
+            with get_engine(ds).connect() as conn:
+                conn.exec_driver_sql(f'KILL QUERY {int(thread_id)}')
+            SQLBotLogUtil.info(f"Kill query of connection {thread_id} on datasource {ds.id}")
+
+        return kill_query
+    # ck over http, stop between fetched batches only
+    return None
+
+
+def drains_unread_rows(ds: CoreDatasource | AssistantOutDsSchema) -> bool:
+    # pymysql and aiomysql read every unread row of a streaming cursor while closing it
+    return equals_ignore_case(ds.type, "mysql")
+
+
+def detach_streaming_cursor(dbapi_cursor):
+    """Close a streaming cursor without reading its unread rows, its connection must be invalidated."""
+    # the async adaption of sqlalchemy wraps the aiomysql cursor
+    cursor = getattr(dbapi_cursor, '_cursor', dbapi_cursor)
+    if cursor is None:
+        return
+    setattr(cursor, '_connection' if hasattr(cursor, '_connection') else 'connection', None)
+
+
+def exec_sql(ds: CoreDatasource | AssistantOutDsSchema, sql: str, origin_column=False, max_rows: int = 0,
+             cancel_token: Optional[CancellationToken] = None, arrow: bool = False):
+    """Execute a query, max_rows > 0 stops reading after that many rows and marks the result truncated.
+    The running statement is cancelled on the datasource once cancel_token is cancelled.
+    arrow fetches the result with an Arrow native driver when DS_ARROW_ENABLED and one is installed."""
+    # queries beyond the concurrency limits of the datasource and its workspace wait for a free slot
+    with DsBulkhead.slot(ds, cancel_token):
+        return _exec_sql(ds, sql, origin_column, max_rows, cancel_token, arrow)
+
+
+def _exec_sql(ds: CoreDatasource | AssistantOutDsSchema, sql: str, origin_column=False, max_rows: int = 0,
+              cancel_token: Optional[CancellationToken] = None, arrow: bool = False):
     while sql.endswith(';'):
         sql = sql[:-1]
 
+    if arrow:
+        result = arrow_exec_sql(ds, sql, origin_column, max_rows, cancel_token)
+        if result is not None:
+            return result
+
     db = DB.get_db(ds.type)
+    start_time = time.time()
     if db.connect_type == ConnectType.sqlalchemy:
+        statement = text(sql)
+        if max_rows > 0:
+            # server side cursor where the dialect supports it, rows are buffered in batches
+            statement = statement.execution_options(stream_results=True,
+                                                    max_row_buffer=settings.DS_FETCH_BATCH_SIZE)
         with get_session(ds) as session:
-            with session.execute(text(sql)) as result:
-                try:
-                    columns = result.keys()._keys if origin_column else [item.lower() for item in result.keys()._keys]
-                    res = result.fetchall()
-                    result_list = [
-                        {str(columns[i]): float(value) if isinstance(value, Decimal) else value for i, value in
-                         enumerate(tuple_item)}
-                        for tuple_item in res
-                    ]
-                    return {"fields": columns, "data": result_list,
-                            "sql": bytes.decode(base64.b64encode(bytes(sql, 'utf-8')))}
-                except Exception as ex:
-                    raise ParseSQLResultError(str(ex))
-    else:
-        conf = DatasourceConf(**json.loads(aes_decrypt(ds.configuration)))
-        extra_config_dict = get_extra_config(conf)
-        if equals_ignore_case(ds.type, 'dm'):
-            with dmPython.connect(user=conf.username, password=conf.password, server=conf.host,
-                                  port=conf.port, **extra_config_dict) as conn, conn.cursor() as cursor:
-                try:
-                    cursor.execute(sql, timeout=conf.timeout)
-                    res = cursor.fetchall()
-                    columns = [field[0] for field in cursor.description] if origin_column else [field[0].lower() for
-                                                                                                field in
-                                                                                                cursor.description]
-                    result_list = [
-                        {str(columns[i]): float(value) if isinstance(value, Decimal) else value for i, value in
-                         enumerate(tuple_item)}
-                        for tuple_item in res
-                    ]
-                    return {"fields": columns, "data": result_list,
-                            "sql": bytes.decode(base64.b64encode(bytes(sql, 'utf-8')))}
-                except Exception as ex:
-                    raise ParseSQLResultError(str(ex))
-        elif equals_ignore_case(ds.type, 'doris', 'starrocks'):
-            with pymysql.connect(user=conf.username, passwd=conf.password, host=conf.host,
-                                 port=conf.port, db=conf.database, connect_timeout=conf.timeout,
-                                 read_timeout=conf.timeout, **extra_config_dict) as conn, conn.cursor() as cursor:
-                try:
-                    cursor.execute(sql)
-                    res = cursor.fetchall()
-                    columns = [field[0] for field in cursor.description] if origin_column else [field[0].lower() for
-                                                                                                field in
-                                                                                                cursor.description]
-                    result_list = [
-                        {str(columns[i]): float(value) if isinstance(value, Decimal) else value for i, value in
-                         enumerate(tuple_item)}
-                        for tuple_item in res
-                    ]
-                    return {"fields": columns, "data": result_list,
-                            "sql": bytes.decode(base64.b64encode(bytes(sql, 'utf-8')))}
-                except Exception as ex:
-                    raise ParseSQLResultError(str(ex))
-        elif equals_ignore_case(ds.type, 'redshift'):
-            with redshift_connector.connect(host=conf.host, port=conf.port, database=conf.database, user=conf.username,
-                                            password=conf.password,
-                                            timeout=conf.timeout, **extra_config_dict) as conn, conn.cursor() as cursor:
-                try:
-                    cursor.execute(sql)
-                    res = cursor.fetchall()
-                    columns = [field[0] for field in cursor.description] if origin_column else [field[0].lower() for
-                                                                                                field in
-                                                                                                cursor.description]
-                    result_list = [
-                        {str(columns[i]): float(value) if isinstance(value, Decimal) else value for i, value in
-                         enumerate(tuple_item)}
-                        for tuple_item in res
-                    ]
-                    return {"fields": columns, "data": result_list,
-                            "sql": bytes.decode(base64.b64encode(bytes(sql, 'utf-8')))}
-                except Exception as ex:
-                    raise ParseSQLResultError(str(ex))
-        elif equals_ignore_case(ds.type, 'kingbase'):
-            with psycopg2.connect(host=conf.host, port=conf.port, database=conf.database, user=conf.username,
-                                  password=conf.password,
-                                  options=f"-c statement_timeout={conf.timeout * 1000}",
-                                  **extra_config_dict) as conn, conn.cursor() as cursor:
-                try:
-                    cursor.execute(sql)
-                    res = cursor.fetchall()
-                    columns = [field[0] for field in cursor.description] if origin_column else [field[0].lower() for
-                                                                                                field in
-                                                                                                cursor.description]
-                    result_list = [
-                        {str(columns[i]): float(value) if isinstance(value, Decimal) else value for i, value in
-                         enumerate(tuple_item)}
-                        for tuple_item in res
-                    ]
-                    return {"fields": columns, "data": result_list,
-                            "sql": bytes.decode(base64.b64encode(bytes(sql, 'utf-8')))}
-                except Exception as ex:
-                    raise ParseSQLResultError(str(ex))
-        elif equals_ignore_case(ds.type, 'es'):
+            canceller = None
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled()
+                canceller = get_statement_canceller(ds, session.connection().connection.dbapi_connection)
+            with on_cancel(cancel_token, canceller):
+                with session.execute(statement) as result:
+                    discard = False
+                    try:
+                        columns = result.keys()._keys
+                        res, truncated = fetch_rows(result, max_rows, cancel_token)
+                        discard = truncated and drains_unread_rows(ds)
+                    except Exception as ex:
+                        # unread rows of a cancelled streaming cursor are not drained either
+                        discard = cancel_token is not None and cancel_token.cancelled and drains_unread_rows(ds)
+                        raise_if_cancelled(cancel_token)
+                        raise ParseSQLResultError(str(ex))
+                    finally:
+                        if discard:
+                            detach_streaming_cursor(result.cursor)
+                            session.connection().invalidate()
             try:
-                res, columns = get_es_data_by_http(conf, sql)
-                columns = [field.get('name') for field in columns] if origin_column else [field.get('name').lower() for
-                                                                                          field in
-                                                                                          columns]
-                result_list = [
-                    {str(columns[i]): float(value) if isinstance(value, Decimal) else value for i, value in
-                     enumerate(tuple(tuple_item))}
-                    for tuple_item in res
-                ]
-                return {"fields": columns, "data": result_list,
-                        "sql": bytes.decode(base64.b64encode(bytes(sql, 'utf-8')))}
+                return build_exec_result(sql, columns, res, origin_column, truncated, time.time() - start_time)
             except Exception as ex:
-                raise Exception(str(ex))
+                raise ParseSQLResultError(str(ex))
+    else:
+        conf = DatasourceConf(**json.loads(aes_decrypt(ds.configuration)))
+        try:
+            columns, res, truncated = get_adapter(db).exec_query(ds, conf, sql, max_rows, cancel_token)
+            return build_exec_result(sql, columns, res, origin_column, truncated, time.time() - start_time)
+        except Exception as ex:
+            raise_if_cancelled(cancel_token)
+            raise ParseSQLResultError(str(ex))
+
+
+def _estimate_size(value) -> int:
+    if value is None:
+        return 0
+    if isinstance(value, (str, bytes, bytearray)):
+        return len(value)
+    return 8
+
+
+def build_exec_result(sql: str, columns: list, res: list, origin_column=False, truncated=False,
+                      fetch_time: float = 0):
+    """Columnar result: field names and one value array per column."""
+    columns = list(columns) if origin_column else [item.lower() for item in columns]
+    data_columns = DataFormat.convert_decimal_columns(DataFormat.rows_to_columns(res, len(columns)))
+    # approximate size of the rows read from driver
+    bytes_read = sum(_estimate_size(value) for column in data_columns for value in column)
+    return {"fields": columns, "columns": data_columns, "truncated": truncated,
+            "fetch_time": round(fetch_time, 3), "bytes_read": bytes_read,
+            "sql": bytes.decode(base64.b64encode(bytes(sql, 'utf-8')))}
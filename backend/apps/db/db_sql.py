@@ -1,9 +1,42 @@
 # Author: Junjun
 # Date: 2025/8/20
+from typing import List
+
 from apps.datasource.models.datasource import CoreDatasource, DatasourceConf
 from common.utils.utils import equals_ignore_case
 
 
+def get_pg_search_path(schema: str) -> str:
+    """search_path value naming the schema as written, quoted so mixed case and special characters are kept."""
+    return '"' + schema.replace('"', '""') + '"'
+
+
+def get_pg_search_path_option(schema: str) -> str:
+    """libpq options setting the search_path, spaces and backslashes of the value are escaped."""
+    return "-c search_path=" + get_pg_search_path(schema).replace('\\', '\\\\').replace(' ', '\\ ')
+
+
+def get_names_filter(ds_type: str, column: str, names: List[str]) -> str:
+    """column IN (...) of string literals, in lists of 1000 for oracle. Literals are escaped for the string syntax of
+    the database and for the placeholders of its driver, as the catalog sql is formatted or bound afterwards."""
+    if not names:
+        return "1 = 0"
+    literals = []
+    for name in dict.fromkeys(names):
+        name = name.replace("'", "''")
+        if equals_ignore_case(ds_type, "mysql", "doris", "starrocks", "ck"):
+            name = name.replace('\\', '\\\\')
+        if equals_ignore_case(ds_type, "doris", "starrocks", "redshift"):
+            # %s placeholders of the driver
+            name = name.replace('%', '%%')
+        if equals_ignore_case(ds_type, "kingbase"):
+            # str.format placeholders
+            name = name.replace('{', '{{').replace('}', '}}')
+        literals.append(f"N'{name}'" if equals_ignore_case(ds_type, "sqlServer") else f"'{name}'")
+    chunks = [literals[index:index + 1000] for index in range(0, len(literals), 1000)]
+    return "(" + " OR ".join(f"{column} IN ({', '.join(chunk)})" for chunk in chunks) + ")"
+
+
 def get_version_sql(ds: CoreDatasource, conf: DatasourceConf):
     if equals_ignore_case(ds.type, "mysql", "doris", "starrocks"):
         return """
@@ -313,3 +346,171 @@ def get_field_sql(ds: CoreDatasource, conf: DatasourceConf, table_name: str = No
         return sql1 + sql2, conf.dbSchema, table_name
     elif equals_ignore_case(ds.type, "es"):
         return "", None, None
+
+
+def get_all_fields_sql(ds: CoreDatasource, conf: DatasourceConf, table_names: List[str]):
+    """Columns of the given tables of the schema, ordered by table and column position."""
+
+    def names_filter(column: str) -> str:
+        return get_names_filter(ds.type, column, table_names)
+
+    if equals_ignore_case(ds.type, "mysql"):
+        return """
+                SELECT 
+                    TABLE_NAME,
+                    COLUMN_NAME,
+                    DATA_TYPE,
+                    COLUMN_COMMENT
+                FROM 
+                    INFORMATION_SCHEMA.COLUMNS
+                WHERE 
+                    TABLE_SCHEMA = :param1
+                    AND {names_filter}
+                ORDER BY TABLE_NAME, ORDINAL_POSITION
+                """.format(names_filter=names_filter('TABLE_NAME')), conf.database
+    elif equals_ignore_case(ds.type, "sqlServer"):
+        return """
+                SELECT 
+                    C.TABLE_NAME AS [TABLE_NAME],
+                    COLUMN_NAME AS [COLUMN_NAME],
+                    DATA_TYPE AS [DATA_TYPE],
+                    ISNULL(EP.value, '') AS [COLUMN_COMMENT]
+                FROM 
+                    INFORMATION_SCHEMA.COLUMNS C
+                LEFT JOIN 
+                    sys.extended_properties EP 
+                    ON EP.major_id = OBJECT_ID(C.TABLE_SCHEMA + '.' + C.TABLE_NAME)
+                    AND EP.minor_id = C.ORDINAL_POSITION
+                    AND EP.name = 'MS_Description'
+                WHERE 
+                    C.TABLE_SCHEMA = :param1
+                    AND {names_filter}
+                ORDER BY C.TABLE_NAME, C.ORDINAL_POSITION
+                """.format(names_filter=names_filter('C.TABLE_NAME')), conf.dbSchema
+    elif equals_ignore_case(ds.type, "pg", "excel"):
+        return """
+               SELECT c.relname                                       AS TABLE_NAME,
+                      a.attname                                       AS COLUMN_NAME,
+                      pg_catalog.format_type(a.atttypid, a.atttypmod) AS DATA_TYPE,
+                      col_description(c.oid, a.attnum)                AS COLUMN_COMMENT
+               FROM pg_catalog.pg_attribute a
+                        JOIN
+                    pg_catalog.pg_class c ON a.attrelid = c.oid
+                        JOIN
+                    pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+               WHERE n.nspname = :param1
+                 AND c.relkind IN ('r', 'v', 'p', 'm')
+                 AND {names_filter}
+                 AND a.attnum > 0
+                 AND NOT a.attisdropped
+               ORDER BY c.relname, a.attnum \
+               """.format(names_filter=names_filter('c.relname')), conf.dbSchema
+    elif equals_ignore_case(ds.type, "redshift"):
+        return """
+               SELECT c.relname                                       AS TABLE_NAME,
+                      a.attname                                       AS COLUMN_NAME,
+                      pg_catalog.format_type(a.atttypid, a.atttypmod) AS DATA_TYPE,
+                      col_description(c.oid, a.attnum)                AS COLUMN_COMMENT
+               FROM pg_catalog.pg_attribute a
+                        JOIN
+                    pg_catalog.pg_class c ON a.attrelid = c.oid
+                        JOIN
+                    pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+               WHERE n.nspname = %s
+                 AND c.relkind IN ('r', 'p', 'f')
+                 AND {names_filter}
+                 AND a.attnum > 0
+                 AND NOT a.attisdropped
+               ORDER BY c.relname, a.attnum \
+               """.format(names_filter=names_filter('c.relname')), conf.dbSchema
+    elif equals_ignore_case(ds.type, "oracle"):
+        return """
+                SELECT 
+                    col.TABLE_NAME AS "TABLE_NAME",
+                    col.COLUMN_NAME AS "COLUMN_NAME",
+                    (CASE 
+                        WHEN col.DATA_TYPE IN ('VARCHAR2', 'CHAR', 'NVARCHAR2', 'NCHAR') 
+                            THEN col.DATA_TYPE || '(' || col.DATA_LENGTH || ')' 
+                        WHEN col.DATA_TYPE = 'NUMBER' AND col.DATA_PRECISION IS NOT NULL 
+                            THEN col.DATA_TYPE || '(' || col.DATA_PRECISION || 
+                                 CASE WHEN col.DATA_SCALE > 0 THEN ',' || col.DATA_SCALE END || ')' 
+                        ELSE col.DATA_TYPE 
+                    END) AS "DATA_TYPE",
+                    NVL(com.COMMENTS, '') AS "COLUMN_COMMENT"
+                FROM 
+                    ALL_TAB_COLUMNS col
+                LEFT JOIN 
+                    ALL_COL_COMMENTS com 
+                    ON col.OWNER = com.OWNER 
+                    AND col.TABLE_NAME = com.TABLE_NAME 
+                    AND col.COLUMN_NAME = com.COLUMN_NAME
+                WHERE 
+                    col.OWNER = :param1
+                    AND {names_filter}
+                ORDER BY col.TABLE_NAME, col.COLUMN_ID
+                """.format(names_filter=names_filter('col.TABLE_NAME')), conf.dbSchema
+    elif equals_ignore_case(ds.type, "ck"):
+        return """
+                SELECT 
+                    table AS TABLE_NAME,
+                    name AS COLUMN_NAME,
+                    type AS DATA_TYPE,
+                    comment AS COLUMN_COMMENT
+                FROM system.columns
+                WHERE database = :param1
+                    AND {names_filter}
+                ORDER BY table, position
+                """.format(names_filter=names_filter('table')), conf.database
+    elif equals_ignore_case(ds.type, "dm"):
+        return """
+                SELECT 
+                    c.TABLE_NAME     AS "TABLE_NAME",
+                    c.COLUMN_NAME    AS "COLUMN_NAME",
+                    c.DATA_TYPE      AS "DATA_TYPE",
+                    COALESCE(com.COMMENTS, '') AS "COMMENTS"
+                FROM 
+                    ALL_TAB_COLS c
+                LEFT JOIN 
+                    ALL_COL_COMMENTS com 
+                    ON c.OWNER = com.OWNER 
+                   AND c.TABLE_NAME = com.TABLE_NAME 
+                   AND c.COLUMN_NAME = com.COLUMN_NAME
+                WHERE 
+                    c.OWNER = :param1
+                    AND {names_filter}
+                ORDER BY c.TABLE_NAME, c.COLUMN_ID
+                """.format(names_filter=names_filter('c.TABLE_NAME')), conf.dbSchema
+    elif equals_ignore_case(ds.type, "doris", "starrocks"):
+        return """
+                SELECT 
+                    TABLE_NAME,
+                    COLUMN_NAME,
+                    DATA_TYPE,
+                    COLUMN_COMMENT
+                FROM 
+                    INFORMATION_SCHEMA.COLUMNS
+                WHERE 
+                    TABLE_SCHEMA = %s
+                    AND {names_filter}
+                ORDER BY TABLE_NAME, ORDINAL_POSITION
+                """.format(names_filter=names_filter('TABLE_NAME')), conf.database
+    elif equals_ignore_case(ds.type, "kingbase"):
+        return """
+                       SELECT c.relname                                       AS TABLE_NAME,
+                              a.attname                                       AS COLUMN_NAME,
+                              pg_catalog.format_type(a.atttypid, a.atttypmod) AS DATA_TYPE,
+                              col_description(c.oid, a.attnum)                AS COLUMN_COMMENT
+                       FROM pg_catalog.pg_attribute a
+                                JOIN
+                            pg_catalog.pg_class c ON a.attrelid = c.oid
+                                JOIN
+                            pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+                       WHERE n.nspname = '{{0}}'
+                         AND c.relkind IN ('r', 'v', 'p', 'm')
+                         AND {names_filter}
+                         AND a.attnum > 0
+                         AND NOT a.attisdropped
+                       ORDER BY c.relname, a.attnum \
+                       """.format(names_filter=names_filter('c.relname')), conf.dbSchema
+    elif equals_ignore_case(ds.type, "es"):
+        return "", None
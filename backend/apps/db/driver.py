@@ -0,0 +1,362 @@
+import uuid
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Any, Callable, Optional
+
+from sqlalchemy import event
+from sqlalchemy.exc import DisconnectionError
+from sqlalchemy.pool import QueuePool
+
+from apps.datasource.models.datasource import DatasourceConf, CoreDatasource
+from apps.db.constant import DB
+from apps.db.driver_registry import get_driver
+from apps.db.ds_pool import DsPoolCache, get_conf_hash, get_ds_pool_key
+from apps.db.es_engine import get_es_client, get_es_index, get_es_fields, get_es_all_fields, get_es_data_by_http
+from common.core.config import settings
+from common.utils.cancellation import CancellationToken, on_cancel, raise_if_cancelled
+from common.utils.utils import SQLBotLogUtil
+
+
+def get_extra_config(conf: DatasourceConf):
+    config_dict = {}
+    if conf.extraJdbc:
+        config_arr = conf.extraJdbc.split("&")
+        for config in config_arr:
+            kv = config.split("=")
+            if len(kv) == 2 and kv[0] and kv[1]:
+                config_dict[kv[0]] = kv[1]
+            else:
+                raise Exception(f'param: {config} is error')
+    return config_dict
+
+
+def fetch_rows(cursor, max_rows: int = 0, cancel_token: Optional[CancellationToken] = None) -> tuple[list, bool]:
+    """Fetch at most max_rows rows in batches, return rows and whether the result is truncated."""
+    if max_rows <= 0:
+        return cursor.fetchall(), False
+    rows = []
+    while len(rows) < max_rows:
+        raise_if_cancelled(cancel_token)
+        batch = cursor.fetchmany(min(settings.DS_FETCH_BATCH_SIZE, max_rows - len(rows)))
+        if not batch:
+            return rows, False
+        rows.extend(batch)
+    # probe one more row to know if there is anything left
+    return rows, len(cursor.fetchmany(1)) > 0
+
+
+class DatasourceAdapter(ABC):
+    """Access to a datasource that is not connected through sqlalchemy."""
+
+    @abstractmethod
+    def check_connection(self, ds: CoreDatasource, conf: DatasourceConf) -> bool:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_version(self, ds: CoreDatasource, conf: DatasourceConf, sql: str):
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_schema(self, ds: CoreDatasource, conf: DatasourceConf) -> list[str]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_tables(self, ds: CoreDatasource, conf: DatasourceConf, sql: str, param: Any) -> list:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_fields(self, ds: CoreDatasource, conf: DatasourceConf, sql: str, p1: Any, p2: Any,
+                   table_name: str = None) -> list:
+        raise NotImplementedError
+
+    @abstractmethod
+    def exec_query(self, ds: CoreDatasource, conf: DatasourceConf, sql: str, max_rows: int = 0,
+                   cancel_token: Optional[CancellationToken] = None) -> tuple[list[str], list, bool]:
+        raise NotImplementedError
+
+
+class DriverAdapter(DatasourceAdapter):
+    """Access to a datasource through its raw DB-API driver, connections are pooled per datasource."""
+
+    schema_sql: str = ''
+    # driver reads all unread rows while closing the cursor, drop the connection instead
+    discard_on_truncate: bool = False
+
+    @abstractmethod
+    def connect(self, conf: DatasourceConf, extra_config: dict):
+        raise NotImplementedError
+
+    def bind(self, sql: str, params: dict) -> tuple[str, Any]:
+        # %s placeholders by default, params are taken in order
+        return sql, tuple(list(params.values())[:sql.count('%s')])
+
+    def execute(self, cursor, sql: str, params: Optional[dict], timeout: int):
+        if params is None:
+            cursor.execute(sql)
+        else:
+            sql, args = self.bind(sql, params)
+            cursor.execute(sql, args) if args is not None else cursor.execute(sql)
+
+    def stream_cursor(self, connection):
+        return connection.cursor()
+
+    def get_canceller(self, ds: CoreDatasource, conf: DatasourceConf, connection) -> Optional[Callable[[], Any]]:
+        """Interrupt the statement running on the pooled connection from another thread, None if the driver
+        can not. connection.info lives as long as its DB-API connection, across checkouts."""
+        return getattr(connection.dbapi_connection, 'cancel', None)
+
+    def ping(self, connection):
+        cursor = connection.cursor()
+        try:
+            cursor.execute('select 1')
+            cursor.fetchall()
+        finally:
+            cursor.close()
+
+    def create_pool(self, conf: DatasourceConf) -> QueuePool:
+        extra_config = get_extra_config(conf)
+        pool = QueuePool(lambda: self.connect(conf, extra_config),
+                         pool_size=settings.DS_POOL_SIZE,
+                         max_overflow=settings.DS_MAX_OVERFLOW,
+                         timeout=conf.timeout,
+                         recycle=settings.DS_POOL_RECYCLE)
+        if settings.DS_POOL_PRE_PING:
+            event.listen(pool, 'connect', self._on_connect)
+            event.listen(pool, 'checkout', self._on_checkout)
+        return pool
+
+    @staticmethod
+    def _on_connect(dbapi_connection, connection_record):
+        connection_record.info['fresh'] = True
+
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        # new connection does not need to be checked
+        if connection_record.info.pop('fresh', False):
+            return
+        try:
+            self.ping(dbapi_connection)
+        except Exception as e:
+            # pool will drop this connection and retry with a new one
+            raise DisconnectionError(str(e))
+
+    def get_pool(self, ds: CoreDatasource, conf: DatasourceConf) -> QueuePool:
+        return DsPoolCache.get(get_ds_pool_key(ds), get_conf_hash(ds.type, conf),
+                               lambda: self.create_pool(conf))
+
+    @contextmanager
+    def cursor(self, ds: CoreDatasource, conf: DatasourceConf):
+        conn = self.get_pool(ds, conf).connect()
+        try:
+            cursor = conn.cursor()
+            try:
+                yield cursor
+            finally:
+                cursor.close()
+        finally:
+            conn.close()
+
+    def fetchall(self, ds: CoreDatasource, conf: DatasourceConf, sql: str,
+                 params: Optional[dict] = None) -> tuple[list[str], list]:
+        with self.cursor(ds, conf) as cursor:
+            self.execute(cursor, sql, params, conf.timeout)
+            res = cursor.fetchall()
+            columns = [field[0] for field in cursor.description] if cursor.description else []
+            return columns, res
+
+    def check_connection(self, ds: CoreDatasource, conf: DatasourceConf) -> bool:
+        self.fetchall(ds, conf, 'select 1')
+        return True
+
+    def get_version(self, ds: CoreDatasource, conf: DatasourceConf, sql: str):
+        if not sql:
+            return ''
+        _, res = self.fetchall(ds, conf, sql)
+        return res[0][0]
+
+    def get_schema(self, ds: CoreDatasource, conf: DatasourceConf) -> list[str]:
+        # doris and starrocks have no schema level, their tables are read from the configured database
+        if not self.schema_sql:
+            return []
+        _, res = self.fetchall(ds, conf, self.schema_sql)
+        return [item[0] for item in res]
+
+    def get_tables(self, ds: CoreDatasource, conf: DatasourceConf, sql: str, param: Any) -> list:
+        _, res = self.fetchall(ds, conf, sql, {"param": param})
+        return res
+
+    def get_fields(self, ds: CoreDatasource, conf: DatasourceConf, sql: str, p1: Any, p2: Any,
+                   table_name: str = None) -> list:
+        _, res = self.fetchall(ds, conf, sql, {"param1": p1, "param2": p2})
+        return res
+
+    def exec_query(self, ds: CoreDatasource, conf: DatasourceConf, sql: str, max_rows: int = 0,
+                   cancel_token: Optional[CancellationToken] = None) -> tuple[list[str], list, bool]:
+        conn = self.get_pool(ds, conf).connect()
+        try:
+            canceller = self.get_canceller(ds, conf, conn) if cancel_token is not None else None
+            cursor = self.stream_cursor(conn) if max_rows > 0 else conn.cursor()
+            discard = False
+            try:
+                with on_cancel(cancel_token, canceller):
+                    self.execute(cursor, sql, None, conf.timeout)
+                    res, truncated = fetch_rows(cursor, max_rows, cancel_token)
+                # server side cursor only has description after fetching
+                columns = [field[0] for field in cursor.description] if cursor.description else []
+                discard = truncated and self.discard_on_truncate
+            except Exception:
+                # unread rows of a cancelled streaming cursor are not drained
+                discard = cancel_token is not None and cancel_token.cancelled and self.discard_on_truncate
+                raise
+            finally:
+                if discard:
+                    conn.invalidate()
+                else:
+                    cursor.close()
+            return columns, res, truncated
+        finally:
+            conn.close()
+
+
+class DmAdapter(DriverAdapter):
+    schema_sql = """select OBJECT_NAME from dba_objects where object_type='SCH'"""
+
+    def connect(self, conf: DatasourceConf, extra_config: dict):
+        return get_driver(DB.dm).connect(user=conf.username, password=conf.password, server=conf.host,
+                                        port=conf.port, **extra_config)
+
+    def execute(self, cursor, sql: str, params: Optional[dict], timeout: int):
+        if params is None:
+            cursor.execute(sql, timeout=timeout)
+        else:
+            cursor.execute(sql, params, timeout=timeout)
+
+
+class MysqlProtocolAdapter(DriverAdapter):
+    discard_on_truncate = True
+
+    def get_canceller(self, ds: CoreDatasource, conf: DatasourceConf, connection) -> Optional[Callable[[], Any]]:
+        thread_id = connection.dbapi_connection.thread_id()
+
+        def kill_query():
+            # the running connection is busy, kill its query from a new one
+            conn = self.connect(conf, get_extra_config(conf))
+            try:
+                with conn.cursor() as cursor:
+                    cursor.execute(f'KILL QUERY {int(thread_id)}')
+            finally:
+                conn.close()
+            SQLBotLogUtil.info(f"Kill query of connection {thread_id} on datasource {ds.id}")
+
+        return kill_query
+
+    def stream_cursor(self, connection):
+        return connection.cursor(get_driver(DB.mysql).cursors.SSCursor)
+
+    def connect(self, conf: DatasourceConf, extra_config: dict):
+        return get_driver(DB.mysql).connect(user=conf.username, passwd=conf.password, host=conf.host,
+                                            port=conf.port, db=conf.database, connect_timeout=conf.timeout,
+                                            read_timeout=conf.timeout, **extra_config)
+
+
+class RedshiftAdapter(DriverAdapter):
+    schema_sql = """SELECT nspname FROM pg_namespace"""
+
+    def connect(self, conf: DatasourceConf, extra_config: dict):
+        return get_driver(DB.redshift).connect(host=conf.host, port=conf.port, database=conf.database,
+                                               user=conf.username, password=conf.password,
+                                               timeout=conf.timeout, **extra_config)
+
+    def get_canceller(self, ds: CoreDatasource, conf: DatasourceConf, connection) -> Optional[Callable[[], Any]]:
+        # redshift_connector has no cancel request, use pg_cancel_backend from a new connection,
+        # the backend pid is read once per pooled connection
+        pid = connection.info.get('backend_pid')
+        if pid is None:
+            cursor = connection.dbapi_connection.cursor()
+            try:
+                cursor.execute('select pg_backend_pid()')
+                pid = cursor.fetchone()[0]
+            finally:
+                cursor.close()
+            connection.info['backend_pid'] = pid
+
+        def cancel_backend():
+            conn = self.connect(conf, get_extra_config(conf))
+            try:
+                cursor = conn.cursor()
+                cursor.execute('select pg_cancel_backend(%s)', (pid,))
+                cursor.close()
+            finally:
+                conn.close()
+            SQLBotLogUtil.info(f"Cancel backend {pid} on datasource {ds.id}")
+
+        return cancel_backend
+
+
+class KingbaseAdapter(DriverAdapter):
+    schema_sql = """SELECT nspname FROM pg_namespace"""
+
+    def connect(self, conf: DatasourceConf, extra_config: dict):
+        return get_driver(DB.kingbase).connect(host=conf.host, port=conf.port, database=conf.database,
+                                               user=conf.username, password=conf.password,
+                                               connect_timeout=conf.timeout,
+                                               options=f"-c statement_timeout={conf.timeout * 1000}",
+                                               **extra_config)
+
+    def stream_cursor(self, connection):
+        return connection.cursor(name=f'sqlbot_{uuid.uuid4().hex}')
+
+    def bind(self, sql: str, params: dict) -> tuple[str, Any]:
+        # catalog sql of kingbase use {0} {1} placeholders
+        return sql.format(*params.values()), None
+
+
+class EsAdapter(DatasourceAdapter):
+    """Elasticsearch has no DB-API driver, use the http api instead."""
+
+    def check_connection(self, ds: CoreDatasource, conf: DatasourceConf) -> bool:
+        return bool(get_es_client(conf, get_ds_pool_key(ds)).client.ping())
+
+    def get_version(self, ds: CoreDatasource, conf: DatasourceConf, sql: str):
+        return ''
+
+    def get_schema(self, ds: CoreDatasource, conf: DatasourceConf) -> list[str]:
+        return []
+
+    def get_tables(self, ds: CoreDatasource, conf: DatasourceConf, sql: str, param: Any) -> list:
+        return get_es_index(conf, get_ds_pool_key(ds))
+
+    def get_fields(self, ds: CoreDatasource, conf: DatasourceConf, sql: str, p1: Any, p2: Any,
+                   table_name: str = None) -> list:
+        return get_es_fields(conf, table_name, get_ds_pool_key(ds))
+
+    def get_all_fields(self, ds: CoreDatasource, conf: DatasourceConf) -> list:
+        all_fields = get_es_all_fields(conf, get_ds_pool_key(ds))
+        return [(index_name, *field) for index_name, fields in all_fields.items()
+                for field in fields]
+
+    def exec_query(self, ds: CoreDatasource, conf: DatasourceConf, sql: str, max_rows: int = 0,
+                   cancel_token: Optional[CancellationToken] = None) -> tuple[list[str], list, bool]:
+        res, columns, truncated = get_es_data_by_http(conf, sql, max_rows, get_ds_pool_key(ds), cancel_token)
+        return [field.get('name') for field in columns], [tuple(item) for item in res], truncated
+
+
+_adapters: dict[DB, DatasourceAdapter] = {}
+
+
+def register_adapter(db: DB, adapter: DatasourceAdapter):
+    _adapters[db] = adapter
+
+
+def get_adapter(db: DB) -> DatasourceAdapter:
+    adapter = _adapters.get(db)
+    if adapter is None:
+        raise ValueError(f"No driver adapter for db type: {db.type}")
+    return adapter
+
+
+register_adapter(DB.dm, DmAdapter())
+register_adapter(DB.doris, MysqlProtocolAdapter())
+register_adapter(DB.starrocks, MysqlProtocolAdapter())
+register_adapter(DB.redshift, RedshiftAdapter())
+register_adapter(DB.kingbase, KingbaseAdapter())
+register_adapter(DB.es, EsAdapter())
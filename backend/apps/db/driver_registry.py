@@ -0,0 +1,75 @@
+import importlib
+import os
+import threading
+import time
+from types import ModuleType
+from typing import Callable
+
+from apps.db.constant import DB
+from common.core.config import settings
+from common.utils.utils import SQLBotLogUtil
+
+# DB type -> module of its driver, imported on first use so a worker only pays for the drivers it needs
+driver_modules = {
+    DB.excel: 'psycopg2',
+    DB.pg: 'psycopg2',
+    DB.kingbase: 'psycopg2',
+    DB.redshift: 'redshift_connector',
+    DB.mysql: 'pymysql',
+    DB.doris: 'pymysql',
+    DB.starrocks: 'pymysql',
+    DB.sqlServer: 'pymssql',
+    DB.oracle: 'oracledb',
+    DB.dm: 'dmPython',
+    DB.ck: 'clickhouse_sqlalchemy',
+    DB.es: 'elasticsearch',
+}
+
+_lock = threading.RLock()
+
+_loaded: dict[str, ModuleType] = {}
+
+
+def init_oracle_client(module: ModuleType):
+    try:
+        if os.path.exists(settings.ORACLE_CLIENT_PATH):
+            module.init_oracle_client(
+                lib_dir=settings.ORACLE_CLIENT_PATH
+            )
+            SQLBotLogUtil.info("init oracle client success, use thick mode")
+        else:
+            SQLBotLogUtil.info("init oracle client failed, because not found oracle client, use thin mode")
+    except Exception as e:
+        SQLBotLogUtil.error("init oracle client failed, check your client is installed, use thin mode")
+
+
+# module -> one time initialization after import
+driver_initializers: dict[str, Callable[[ModuleType], None]] = {
+    'oracledb': init_oracle_client,
+}
+
+
+def load_driver(module_name: str) -> ModuleType:
+    module = _loaded.get(module_name)
+    if module is not None:
+        return module
+    with _lock:
+        module = _loaded.get(module_name)
+        if module is None:
+            start_time = time.perf_counter()
+            module = importlib.import_module(module_name)
+            initializer = driver_initializers.get(module_name)
+            if initializer is not None:
+                initializer(module)
+            _loaded[module_name] = module
+            SQLBotLogUtil.info(f"Load driver {module_name}, cost {(time.perf_counter() - start_time) * 1000:.1f}ms")
+        return module
+
+
+def get_driver(db: DB) -> ModuleType:
+    return load_driver(driver_modules[db])
+
+
+def loaded_drivers() -> list[str]:
+    with _lock:
+        return list(_loaded.keys())
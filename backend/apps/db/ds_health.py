@@ -0,0 +1,109 @@
+import threading
+import time
+from typing import Any, Optional
+
+from common.core.config import settings
+from common.utils.utils import SQLBotLogUtil
+
+_lock = threading.Lock()
+
+# ds_id -> health entry
+_ds_health: dict[Any, "DsHealthEntry"] = {}
+
+
+class DsHealthEntry:
+    def __init__(self):
+        self.version: Optional[str] = None
+        self.version_time: float = 0.0
+        self.version_ttl: int = 0
+        self.last_ok: float = 0.0
+        self.failures: int = 0
+        self.open_until: float = 0.0
+
+
+def _get_entry(ds_id: Any) -> DsHealthEntry:
+    entry = _ds_health.get(ds_id)
+    if entry is None:
+        entry = DsHealthEntry()
+        _ds_health[ds_id] = entry
+    return entry
+
+
+class DsHealthCache:
+    """Server version and connection health per datasource, with a circuit breaker for failing ones."""
+
+    @staticmethod
+    def get_version(ds_id: Any) -> Optional[str]:
+        with _lock:
+            entry = _ds_health.get(ds_id)
+            if entry is None or entry.version is None:
+                return None
+            if time.monotonic() - entry.version_time > entry.version_ttl:
+                return None
+            return entry.version
+
+    @staticmethod
+    def set_version(ds_id: Any, version: str, ttl: Optional[int] = None):
+        with _lock:
+            entry = _get_entry(ds_id)
+            entry.version = version
+            entry.version_time = time.monotonic()
+            entry.version_ttl = settings.DS_VERSION_CACHE_TTL if ttl is None else ttl
+
+    @staticmethod
+    def is_healthy(ds_id: Any) -> bool:
+        """Connected successfully a short time ago, no need to probe again."""
+        with _lock:
+            entry = _ds_health.get(ds_id)
+            return entry is not None and entry.last_ok > 0 \
+                and time.monotonic() - entry.last_ok <= settings.DS_HEALTH_CHECK_TTL
+
+    @staticmethod
+    def is_open(ds_id: Any) -> bool:
+        with _lock:
+            entry = _ds_health.get(ds_id)
+            return entry is not None and entry.failures >= settings.DS_CIRCUIT_FAILURE_THRESHOLD \
+                and time.monotonic() < entry.open_until
+
+    @staticmethod
+    def allow_request(ds_id: Any) -> bool:
+        """False while the circuit is open, after that one caller is let through to probe the datasource."""
+        with _lock:
+            entry = _ds_health.get(ds_id)
+            if entry is None or entry.failures < settings.DS_CIRCUIT_FAILURE_THRESHOLD:
+                return True
+            now = time.monotonic()
+            if now < entry.open_until:
+                return False
+            # half open, keep others failing fast until this probe finishes
+            entry.open_until = now + settings.DS_CIRCUIT_OPEN_SECONDS
+            return True
+
+    @staticmethod
+    def mark_ok(ds_id: Any):
+        with _lock:
+            entry = _get_entry(ds_id)
+            entry.last_ok = time.monotonic()
+            entry.failures = 0
+            entry.open_until = 0.0
+
+    @staticmethod
+    def mark_failure(ds_id: Any):
+        with _lock:
+            entry = _get_entry(ds_id)
+            entry.last_ok = 0.0
+            entry.failures += 1
+            if entry.failures >= settings.DS_CIRCUIT_FAILURE_THRESHOLD:
+                entry.open_until = time.monotonic() + settings.DS_CIRCUIT_OPEN_SECONDS
+                SQLBotLogUtil.warning(f"Datasource {ds_id} failed {entry.failures} times, "
+                                      f"fail fast for {settings.DS_CIRCUIT_OPEN_SECONDS}s")
+
+    @staticmethod
+    def invalidate(ds_id: Any):
+        with _lock:
+            _ds_health.pop(ds_id, None)
+
+    @staticmethod
+    def clear():
+        with _lock:
+            _ds_health.clear()
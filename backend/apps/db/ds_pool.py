@@ -0,0 +1,100 @@
+import hashlib
+import threading
+import time
+from typing import Any, Callable, Optional
+
+from apps.datasource.models.datasource import DatasourceConf, CoreDatasource
+from common.core.config import settings
+from common.utils.utils import SQLBotLogUtil
+
+_lock = threading.Lock()
+
+# pool key of the datasource -> {config hash -> pool entry}, unsaved datasources are kept under None
+_ds_pools: dict[Any, dict[str, "DsPoolEntry"]] = {}
+
+_last_evict_time: float = 0.0
+
+
+class DsPoolEntry:
+    def __init__(self, pool: Any, conf_hash: str):
+        # sqlalchemy Engine, Pool or AsyncEngineEntry, all can be released by dispose()
+        self.pool = pool
+        self.conf_hash = conf_hash
+        self.last_used = time.monotonic()
+
+
+def get_conf_hash(ds_type: str, conf: DatasourceConf) -> str:
+    return hashlib.sha256(f"{ds_type}:{conf.model_dump_json(warnings=False)}".encode('utf-8')).hexdigest()
+
+
+def get_ds_pool_key(ds) -> Any:
+    """Pool key of a datasource, ids of assistant datasources come from another system and may equal ours."""
+    if ds.id is None:
+        return None
+    return ds.id if isinstance(ds, CoreDatasource) else f"assistant:{ds.id}"
+
+
+def _dispose(entries: list[DsPoolEntry]):
+    for entry in entries:
+        try:
+            entry.pool.dispose()
+        except Exception as e:
+            SQLBotLogUtil.warning(f"Dispose datasource pool failed: {e}")
+
+
+class DsPoolCache:
+    """Process-wide registry of connection pools, keyed by datasource pool key and config hash."""
+
+    @staticmethod
+    def get(ds_id: Optional[int], conf_hash: str, factory: Callable[[], Any]) -> Any:
+        DsPoolCache.evict_idle()
+        with _lock:
+            entries = _ds_pools.get(ds_id)
+            entry = entries.get(conf_hash) if entries else None
+            if entry is None:
+                entry = DsPoolEntry(factory(), conf_hash)
+                _ds_pools.setdefault(ds_id, {})[conf_hash] = entry
+                SQLBotLogUtil.info(f"Create connection pool for datasource {ds_id}" if ds_id is not None
+                                   else "Create connection pool for unsaved datasource")
+            entry.last_used = time.monotonic()
+            return entry.pool
+
+    @staticmethod
+    def invalidate(ds_id: Optional[int]):
+        if ds_id is None:
+            return
+        with _lock:
+            entries = _ds_pools.pop(ds_id, None)
+        if entries:
+            _dispose(list(entries.values()))
+            SQLBotLogUtil.info(f"Dispose connection pool for datasource {ds_id}")
+
+    @staticmethod
+    def evict_idle(force: bool = False):
+        global _last_evict_time
+        now = time.monotonic()
+        if not force and now - _last_evict_time < settings.DS_POOL_EVICT_INTERVAL:
+            return
+        expired: list[DsPoolEntry] = []
+        with _lock:
+            _last_evict_time = now
+            for ds_id in list(_ds_pools.keys()):
+                entries = _ds_pools[ds_id]
+                # pools of unsaved datasources (e.g. connection test of the add form) are only reused while editing
+                idle_timeout = settings.DS_POOL_IDLE_TIMEOUT if ds_id is not None \
+                    else settings.DS_POOL_UNSAVED_IDLE_TIMEOUT
+                for key in list(entries.keys()):
+                    if now - entries[key].last_used > idle_timeout:
+                        expired.append(entries.pop(key))
+                if not entries:
+                    del _ds_pools[ds_id]
+        if expired:
+            _dispose(expired)
+            SQLBotLogUtil.info(f"Evict {len(expired)} idle datasource connection pool(s)")
+
+    @staticmethod
+    def clear():
+        with _lock:
+            entries = [entry for _entries in _ds_pools.values() for entry in _entries.values()]
+            _ds_pools.clear()
+        _dispose(entries)
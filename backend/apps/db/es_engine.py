@@ -5,10 +5,16 @@ import json
 from base64 import b64encode
 
 import requests
-from elasticsearch import Elasticsearch
+from requests.adapters import HTTPAdapter
 
 from apps.datasource.models.datasource import DatasourceConf
+from apps.db.constant import DB
+from apps.db.driver_registry import get_driver
+from apps.db.ds_pool import DsPoolCache, get_conf_hash
+from common.core.config import settings
 from common.error import SingleMessageError
+from common.utils.utils import SQLBotLogUtil
+from common.utils.cancellation import CancellationToken
 
 
 def get_es_auth(conf: DatasourceConf):
@@ -25,7 +31,7 @@ def get_es_auth(conf: DatasourceConf):
 
 
 def get_es_connect(conf: DatasourceConf):
-    es_client = Elasticsearch(
+    es_client = get_driver(DB.es).Elasticsearch(
         [conf.host],  # ES address
         basic_auth=(conf.username, conf.password),
         verify_certs=False,
@@ -35,18 +41,70 @@ def get_es_connect(conf: DatasourceConf):
     return es_client
 
 
+class EsClient:
+    """Elasticsearch client and pooled http session for the _sql api, kept per datasource."""
+
+    def __init__(self, conf: DatasourceConf):
+        url = conf.host
+        while url.endswith('/'):
+            url = url[:-1]
+        self.url = url
+        self.client = get_es_connect(conf)
+        self.session = requests.Session()
+        self.session.headers.update(get_es_auth(conf))
+        self.session.verify = False
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=settings.DS_POOL_SIZE + settings.DS_MAX_OVERFLOW)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def sql(self, body: dict) -> dict:
+        response = self.session.post(f'{self.url}/_sql?format=json', data=json.dumps(body))
+        res = response.json()
+        if res.get('error'):
+            raise SingleMessageError(json.dumps(res))
+        return res
+
+    def close_cursor(self, cursor: str):
+        self.session.post(f'{self.url}/_sql/close', data=json.dumps({"cursor": cursor}))
+
+    def dispose(self):
+        self.session.close()
+        self.client.close()
+
+
+def get_es_client(conf: DatasourceConf, ds_id: int | str = None) -> EsClient:
+    return DsPoolCache.get(ds_id, get_conf_hash('es', conf), lambda: EsClient(conf))
+
+
+def get_properties_fields(properties: dict):
+    res = []
+    if properties is not None:
+        for field, config in properties.items():
+            field_type = config.get("type")
+            desc = ''
+            if config.get("_meta"):
+                desc = config.get("_meta").get('description')
+
+            if field_type:
+                res.append((field, field_type, desc))
+            else:
+                # object、nested...
+                res.append((field, ','.join(list(config.keys())), desc))
+    return res
+
+
 # get tables
-def get_es_index(conf: DatasourceConf):
-    es_client = get_es_connect(conf)
+def get_es_index(conf: DatasourceConf, ds_id: int | str = None):
+    es_client = get_es_client(conf, ds_id).client
     indices = es_client.cat.indices(format="json")
     res = []
     if indices is not None:
+        # mappings of all indices in one request
+        mapping = es_client.indices.get_mapping()
         for idx in indices:
             index_name = idx.get('index')
             desc = ''
-            # get mapping
-            mapping = es_client.indices.get_mapping(index=index_name)
-            mappings = mapping.get(index_name).get("mappings")
+            mappings = (mapping.get(index_name) or {}).get("mappings") or {}
             if mappings.get('_meta'):
                 desc = mappings.get('_meta').get('description')
             res.append((index_name, desc))
@@ -54,25 +112,18 @@ def get_es_index(conf: DatasourceConf):
 
 
 # get fields
-def get_es_fields(conf: DatasourceConf, table_name: str):
-    es_client = get_es_connect(conf)
+def get_es_fields(conf: DatasourceConf, table_name: str, ds_id: int | str = None):
+    es_client = get_es_client(conf, ds_id).client
     index_name = table_name
     mapping = es_client.indices.get_mapping(index=index_name)
-    properties = mapping.get(index_name).get("mappings").get("properties")
-    res = []
-    if properties is not None:
-        for field, config in properties.items():
-            field_type = config.get("type")
-            desc = ''
-            if config.get("_meta"):
-                desc = config.get("_meta").get('description')
+    return get_properties_fields(mapping.get(index_name).get("mappings").get("properties"))
 
-            if field_type:
-                res.append((field, field_type, desc))
-            else:
-                # object、nested...
-                res.append((field, ','.join(list(config.keys())), desc))
-    return res
+
+# get fields of all indices, index name -> fields
+def get_es_all_fields(conf: DatasourceConf, ds_id: int | str = None):
+    mapping = get_es_client(conf, ds_id).client.indices.get_mapping()
+    return {index_name: get_properties_fields((item.get("mappings") or {}).get("properties"))
+            for index_name, item in mapping.items()}
 
 
 # def get_es_data(conf: DatasourceConf, sql: str, table_name: str):
@@ -103,19 +154,33 @@ def get_es_fields(conf: DatasourceConf, table_name: str):
 #     return res, fields
 
 
-def get_es_data_by_http(conf: DatasourceConf, sql: str):
-    url = conf.host
-    while url.endswith('/'):
-        url = url[:-1]
-
-    host = f'{url}/_sql?format=json'
-
-    response = requests.post(host, data=json.dumps({"query": sql}), headers=get_es_auth(conf), verify=False)
+def get_es_data_by_http(conf: DatasourceConf, sql: str, max_rows: int = 0, ds_id: int | str = None,
+                        cancel_token: CancellationToken = None):
+    es = get_es_client(conf, ds_id)
 
-    # print(response.json())
-    res = response.json()
-    if res.get('error'):
-        raise SingleMessageError(json.dumps(res))
+    # without a row budget the pages of the cursor are still capped, a whole index is never read
+    limit = max_rows if max_rows > 0 else max(settings.DS_ES_MAX_ROWS, 1)
+    # one row more than the budget tells whether the result is truncated
+    fetch_size = min(settings.DS_FETCH_BATCH_SIZE, limit + 1)
+    res = es.sql({"query": sql, "fetch_size": fetch_size})
     fields = res.get('columns')
-    result = res.get('rows')
-    return result, fields
+    result = res.get('rows') or []
+    cursor = res.get('cursor')
+    # pull the following pages through the cursor until the row budget is reached
+    while cursor and len(result) <= limit:
+        if cancel_token is not None and cancel_token.cancelled:
+            es.close_cursor(cursor)
+            cancel_token.raise_if_cancelled()
+        res = es.sql({"cursor": cursor})
+        result.extend(res.get('rows') or [])
+        cursor = res.get('cursor')
+    if cursor:
+        # more pages left, release the cursor
+        es.close_cursor(cursor)
+
+    truncated = len(result) > limit
+    if truncated:
+        result = result[:limit]
+        if max_rows <= 0:
+            SQLBotLogUtil.warning(f"Elasticsearch result of datasource {ds_id} capped at {limit} rows")
+    return result, fields, truncated
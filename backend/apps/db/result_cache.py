@@ -0,0 +1,228 @@
+import base64
+import datetime
+import hashlib
+import math
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from decimal import Decimal
+from typing import Any, Callable, Optional
+
+import orjson
+import sqlparse
+
+from common.core.config import settings
+from common.utils.utils import SQLBotLogUtil
+
+_lock = threading.Lock()
+
+# cache key -> (expire time, ds_id, result)
+_entries: "OrderedDict[str, tuple[float, Any, dict]]" = OrderedDict()
+
+_stats = {"hits": 0, "redis_hits": 0, "misses": 0, "evictions": 0}
+
+_redis_client = None
+
+_redis_prefix = 'sqlbot-query-cache'
+
+
+def normalize_sql(sql: str) -> str:
+    # comments and whitespace outside of literals do not change the query
+    sql = sqlparse.format(sql, strip_comments=True, strip_whitespace=True).strip()
+    while sql.endswith(';'):
+        sql = sql[:-1].rstrip()
+    return sql
+
+
+def get_cache_key(ds_id: Any, conf_hash: str, sql: str, permission_fingerprint: str, max_rows: int = 0,
+                  origin_column: bool = False) -> str:
+    # a changed datasource config misses in every process, invalidate only reaches this one and redis
+    digest = hashlib.sha256(
+        f"{conf_hash}:{permission_fingerprint}:{max_rows}:{origin_column}:{normalize_sql(sql)}".encode(
+            'utf-8')).hexdigest()
+    return f"{ds_id}:{digest}"
+
+
+_json_types = {type(None), bool, int, float, str}
+
+# value type -> (tag, encode), the values of columns with other types than json ones are stored with their tag
+_value_encoders = {
+    datetime.datetime: ('datetime', lambda value: value.isoformat()),
+    datetime.date: ('date', lambda value: value.isoformat()),
+    datetime.time: ('time', lambda value: value.isoformat()),
+    datetime.timedelta: ('timedelta', lambda value: [value.days, value.seconds, value.microseconds]),
+    Decimal: ('decimal', str),
+    float: ('float', lambda value: repr(float(value))),
+    bytes: ('bytes', lambda value: base64.b64encode(value).decode('utf-8')),
+    uuid.UUID: ('uuid', str),
+}
+
+_value_decoders = {
+    'datetime': datetime.datetime.fromisoformat,
+    'date': datetime.date.fromisoformat,
+    'time': datetime.time.fromisoformat,
+    'timedelta': lambda value: datetime.timedelta(days=value[0], seconds=value[1], microseconds=value[2]),
+    'decimal': Decimal,
+    'float': float,
+    'bytes': base64.b64decode,
+    'uuid': uuid.UUID,
+}
+
+
+def _is_json_column(column: list) -> bool:
+    types = set(map(type, column))
+    if not types <= _json_types:
+        return False
+    # NaN and infinity are written as null by orjson
+    return float not in types or all(math.isfinite(value) for value in column if isinstance(value, float))
+
+
+def _encode_value(value):
+    if value is None:
+        return None
+    for value_type, (tag, encode) in _value_encoders.items():
+        if isinstance(value, value_type):
+            return [tag, encode(value)]
+    if isinstance(value, (bool, int, str, dict, list, tuple)):
+        return ['', value]
+    return ['str', str(value)]
+
+
+def _decode_value(value):
+    if value is None:
+        return None
+    decoder = _value_decoders.get(value[0])
+    return decoder(value[1]) if decoder is not None else value[1]
+
+
+def dumps_result(result: dict) -> bytes:
+    """JSON of the columnar result, columns with values json has no type for keep them as tagged values."""
+    columns = result.get('columns') or []
+    tagged = [not _is_json_column(column) for column in columns]
+    return orjson.dumps({**result, "columns": [[_encode_value(value) for value in column] if is_tagged else column
+                                               for column, is_tagged in zip(columns, tagged)],
+                         "tagged": tagged})
+
+
+def loads_result(value: bytes) -> dict:
+    result = orjson.loads(value)
+    tagged = result.pop('tagged', [])
+    result['columns'] = [[_decode_value(item) for item in column] if is_tagged else column
+                         for column, is_tagged in zip(result.get('columns') or [], tagged)]
+    return result
+
+
+def _get_redis():
+    global _redis_client
+    if settings.CACHE_TYPE.lower() != "redis":
+        return None
+    if _redis_client is None:
+        import redis
+        _redis_client = redis.Redis.from_url(settings.CACHE_REDIS_URL or "redis://localhost:6379/0")
+    return _redis_client
+
+
+class QueryResultCache:
+    """Results of generated SQL, keyed by datasource and its config, normalized SQL and user permissions."""
+
+    @staticmethod
+    def get_or_execute(ds_id: Any, conf_hash: str, sql: str, permission_fingerprint: str, func: Callable[[], dict],
+                       max_rows: int = 0, origin_column: bool = False) -> dict:
+        """conf_hash: hash of the datasource config, e.g. get_ds_conf_hash"""
+        if not settings.QUERY_RESULT_CACHE_ENABLED or ds_id is None:
+            return func()
+        key = get_cache_key(ds_id, conf_hash, sql, permission_fingerprint, max_rows, origin_column)
+        result = QueryResultCache.get(key, ds_id)
+        if result is not None:
+            return result
+        result = func()
+        QueryResultCache.put(key, ds_id, result)
+        return result
+
+    @staticmethod
+    def get(key: str, ds_id: Any) -> Optional[dict]:
+        now = time.monotonic()
+        with _lock:
+            entry = _entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    _entries.move_to_end(key)
+                    _stats["hits"] += 1
+                    # callers replace values in the result dict, keep the cached one untouched
+                    return dict(entry[2])
+                del _entries[key]
+
+        result = QueryResultCache._redis_get(key)
+        with _lock:
+            if result is not None:
+                _stats["redis_hits"] += 1
+                QueryResultCache._put_local(key, ds_id, result)
+                return dict(result)
+            _stats["misses"] += 1
+        return None
+
+    @staticmethod
+    def put(key: str, ds_id: Any, result: dict):
+        if result.get('bytes_read', 0) > settings.QUERY_RESULT_CACHE_MAX_BYTES:
+            return
+        result = dict(result)
+        with _lock:
+            QueryResultCache._put_local(key, ds_id, result)
+        QueryResultCache._redis_put(key, result)
+
+    @staticmethod
+    def _put_local(key: str, ds_id: Any, result: dict):
+        _entries[key] = (time.monotonic() + settings.QUERY_RESULT_CACHE_TTL, ds_id, result)
+        _entries.move_to_end(key)
+        while len(_entries) > settings.QUERY_RESULT_CACHE_MAX_SIZE:
+            _entries.popitem(last=False)
+            _stats["evictions"] += 1
+
+    @staticmethod
+    def _redis_get(key: str) -> Optional[dict]:
+        try:
+            client = _get_redis()
+            if client is None:
+                return None
+            value = client.get(f"{_redis_prefix}:{key}")
+            return loads_result(value) if value else None
+        except Exception as e:
+            SQLBotLogUtil.warning(f"Read query result cache from redis failed: {e}")
+            return None
+
+    @staticmethod
+    def _redis_put(key: str, result: dict):
+        try:
+            client = _get_redis()
+            if client is not None:
+                client.setex(f"{_redis_prefix}:{key}", settings.QUERY_RESULT_CACHE_TTL, dumps_result(result))
+        except Exception as e:
+            SQLBotLogUtil.warning(f"Write query result cache to redis failed: {e}")
+
+    @staticmethod
+    def invalidate(ds_id: Any):
+        if ds_id is None:
+            return
+        with _lock:
+            for key in [key for key, entry in _entries.items() if entry[1] == ds_id]:
+                del _entries[key]
+        try:
+            client = _get_redis()
+            if client is not None:
+                keys = list(client.scan_iter(match=f"{_redis_prefix}:{ds_id}:*"))
+                if keys:
+                    client.delete(*keys)
+        except Exception as e:
+            SQLBotLogUtil.warning(f"Invalidate query result cache in redis failed: {e}")
+
+    @staticmethod
+    def clear():
+        with _lock:
+            _entries.clear()
+
+    @staticmethod
+    def stats() -> dict:
+        with _lock:
+            return {**_stats, "size": len(_entries), "enabled": settings.QUERY_RESULT_CACHE_ENABLED,
+                    "redis": settings.CACHE_TYPE.lower() == "redis"}
@@ -0,0 +1,176 @@
+import re
+from typing import Optional
+
+import sqlglot
+from sqlglot import exp
+from sqlglot.errors import SqlglotError
+from sqlglot.tokens import Token, TokenType
+
+from apps.db.constant import DB
+from common.utils.utils import SQLBotLogUtil
+
+# DB type -> sqlglot dialect used to parse the sql, only the row limit of its text is changed
+sqlglot_dialects = {
+    DB.mysql: 'mysql',
+    DB.doris: 'doris',
+    DB.starrocks: 'starrocks',
+    DB.pg: 'postgres',
+    DB.excel: 'postgres',
+    DB.kingbase: 'postgres',
+    DB.redshift: 'redshift',
+    DB.ck: 'clickhouse',
+    DB.sqlServer: 'tsql',
+    DB.oracle: 'oracle',
+    DB.dm: 'oracle',
+}
+
+# FETCH FIRST needs Oracle 12c, older versions and DM are wrapped with ROWNUM which works on every version
+rownum_dbs = {DB.oracle, DB.dm}
+
+
+def get_literal_limit(node: Optional[exp.Expression]) -> Optional[int]:
+    """Row count of a LIMIT / TOP / FETCH FIRST node, None if missing or not a number literal."""
+    if node is None:
+        return None
+    count = node.args.get('count') if isinstance(node, exp.Fetch) else node.args.get('expression')
+    if isinstance(count, exp.Literal) and not count.is_string:
+        try:
+            return int(count.this)
+        except ValueError:
+            return None
+    return None
+
+
+def _parse_query(sql: str, dialect: str) -> Optional[exp.Query]:
+    expressions = sqlglot.parse(sql, read=dialect)
+    if len(expressions) != 1 or not isinstance(expressions[0], exp.Query):
+        return None
+    return expressions[0]
+
+
+def _top_level_tokens(sql: str, dialect: str) -> list[tuple[Token, int]]:
+    """Tokens of the sql with their parenthesis depth."""
+    tokens = []
+    depth = 0
+    for token in sqlglot.Dialect.get_or_raise(dialect).tokenize(sql):
+        if token.token_type == TokenType.R_PAREN:
+            depth -= 1
+        tokens.append((token, depth))
+        if token.token_type == TokenType.L_PAREN:
+            depth += 1
+    return tokens
+
+
+def _limit_count_token(tokens: list[tuple[Token, int]], current: int) -> Optional[Token]:
+    """Number token of the outermost LIMIT / TOP / FETCH, e.g. 10 of LIMIT 10, TOP (10), LIMIT 5, 10
+    or FETCH FIRST 10 ROWS ONLY."""
+    keywords = [index for index, (token, depth) in enumerate(tokens)
+                if depth == 0 and token.token_type in (TokenType.LIMIT, TokenType.TOP, TokenType.FETCH)]
+    if not keywords:
+        return None
+    numbers = []
+    for token, _ in tokens[keywords[-1] + 1:]:
+        if token.token_type == TokenType.NUMBER:
+            numbers.append(token)
+        elif token.text.upper() not in ('(', ')', ',', 'FIRST', 'NEXT'):
+            break
+    if numbers and numbers[-1].text == str(current):
+        return numbers[-1]
+    return None
+
+
+def _major_version(version: Optional[str]) -> int:
+    match = re.match(r'\s*(\d+)', version or '')
+    return int(match.group(1)) if match else 0
+
+
+def _first_select(expression: exp.Query) -> Optional[exp.Select]:
+    while isinstance(expression, (exp.SetOperation, exp.Subquery)):
+        expression = expression.this
+    return expression if isinstance(expression, exp.Select) else None
+
+
+def _has_rownum_limit(expression: exp.Query) -> bool:
+    """ROWNUM in the WHERE of the outermost query, e.g. the ROWNUM <= N the Oracle template asks for."""
+    where = expression.args.get('where') if isinstance(expression, exp.Select) else None
+    if where is None:
+        return False
+    return any(column.name.upper() == 'ROWNUM' and column.find_ancestor(exp.Select) is expression
+               for column in where.find_all(exp.Column))
+
+
+def _has_duplicate_names(expression: exp.Query) -> bool:
+    """Output columns with the same name, e.g. a.id, b.id of a join, can not be selected from a subquery.
+    Names behind * are unknown, they are only taken as unique for a single table."""
+    names = [name.upper() for name in expression.named_selects]
+    if '*' in names:
+        select = _first_select(expression)
+        return select is None or len(names) > 1 or bool(select.args.get('joins'))
+    return len(set(names)) != len(names)
+
+
+def _insert_top(sql: str, tokens: list[tuple[Token, int]], limit: int) -> Optional[str]:
+    for index, (token, depth) in enumerate(tokens):
+        if depth == 0 and token.token_type == TokenType.SELECT:
+            if index + 1 < len(tokens) and tokens[index + 1][0].token_type in (TokenType.DISTINCT, TokenType.ALL):
+                token = tokens[index + 1][0]
+            return f'{sql[:token.end + 1]} TOP {limit}{sql[token.end + 1:]}'
+    return None
+
+
+def apply_row_limit(sql: str, db: DB, limit: int, version: Optional[str] = None) -> str:
+    """Make the database return at most limit rows, a smaller limit already in the sql is kept.
+    Only the row limit is added or changed, the rest of the sql text is kept as written.
+    sql is returned untouched when it needs no change or can not be parsed.
+    version is the server version of the datasource, Oracle 12c and later get FETCH FIRST."""
+    dialect = sqlglot_dialects.get(db)
+    if limit <= 0 or dialect is None:
+        return sql
+    sql = sql.strip()
+    while sql.endswith(';'):
+        sql = sql[:-1].rstrip()
+
+    try:
+        expression = _parse_query(sql, dialect)
+        if expression is None:
+            return sql
+
+        node = expression.args.get('limit')
+        current = get_literal_limit(node)
+        if current is not None and current <= limit:
+            return sql
+
+        tokens = _top_level_tokens(sql, dialect)
+        if node is not None:
+            count = _limit_count_token(tokens, current) if current is not None else None
+            if count is None:
+                return sql
+            limited = f'{sql[:count.start]}{limit}{sql[count.end + 1:]}'
+        elif any(expression.args.get(arg) for arg in ('offset', 'locks', 'settings', 'format')):
+            # clauses the appended LIMIT would have to precede
+            return sql
+        elif db in rownum_dbs and _has_rownum_limit(expression):
+            return sql
+        elif db == DB.oracle and _major_version(version) >= 12:
+            limited = f'{sql}\nFETCH FIRST {limit} ROWS ONLY'
+        elif db in rownum_dbs:
+            if _has_duplicate_names(expression):
+                return sql
+            return f'SELECT * FROM ({sql}) sqlbot_limit_t WHERE ROWNUM <= {limit}'
+        elif db == DB.sqlServer:
+            # TOP of a union only limits its first query
+            limited = _insert_top(sql, tokens, limit) if isinstance(expression, exp.Select) else None
+            if limited is None:
+                return sql
+        else:
+            # on a new line, the sql may end with a line comment
+            limited = f'{sql}\nLIMIT {limit}'
+
+        # e.g. LIMIT after a ClickHouse union only limits its last query
+        limited_expression = _parse_query(limited, dialect)
+        if limited_expression is None or get_literal_limit(limited_expression.args.get('limit')) != limit:
+            return sql
+        return limited
+    except SqlglotError as e:
+        SQLBotLogUtil.warning(f"Can not parse sql to apply row limit: {e}")
+        return sql
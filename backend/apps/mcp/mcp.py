@@ -128,7 +128,7 @@ async def mcp_question(session: SessionDep, chat: McpQuestion):
                 status_code=500,
             )
     if chat.stream:
-        return StreamingResponse(llm_service.await_result(), media_type="text/event-stream")
+        return StreamingResponse(llm_service.await_result_async(), media_type="text/event-stream")
     else:
         res = llm_service.await_result()
         raw_data = {}
@@ -184,7 +184,7 @@ async def mcp_assistant(session: SessionDep, chat: McpAssistant):
                 status_code=500,
             )
     if chat.stream:
-        return StreamingResponse(llm_service.await_result(), media_type="text/event-stream")
+        return StreamingResponse(llm_service.await_result_async(), media_type="text/event-stream")
     else:
         res = llm_service.await_result()
         raw_data = {}
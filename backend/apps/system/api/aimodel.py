@@ -1,7 +1,9 @@
+import asyncio
 import json
 from typing import List, Union
 
 from fastapi.responses import StreamingResponse
+from apps.ai_model.embedding import EmbeddingQueryCache
 from apps.ai_model.model_factory import LLMConfig, LLMFactory
 from apps.system.schemas.ai_model_schema import AiModelConfigItem, AiModelCreator, AiModelEditor, AiModelGridItem
 from fastapi import APIRouter, Query
@@ -10,6 +12,7 @@ from sqlmodel import func, select, update
 from apps.system.models.system_model import AiModelDetail
 from common.core.deps import SessionDep, Trans
 from common.utils.crypto import sqlbot_decrypt
+from common.utils.embedding_threads import EmbeddingJobQueue
 from common.utils.time import get_timestamp
 from common.utils.utils import SQLBotLogUtil, prepare_model_arg
 
@@ -50,6 +53,14 @@ async def check_default(session: SessionDep, trans: Trans):
     if not db_model:
         raise Exception(trans('i18n_llm.miss_default'))
     
+@router.get("/embeddingCache/stats")
+async def embedding_cache_stats():
+    return EmbeddingQueryCache.stats()
+
+@router.get("/embeddingJobs/stats")
+async def embedding_job_stats():
+    return await asyncio.to_thread(EmbeddingJobQueue.stats)
+
 @router.put("/default/{id}")
 async def set_default(session: SessionDep, id: int):
     db_model = session.get(AiModelDetail, id)
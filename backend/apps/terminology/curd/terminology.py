@@ -8,7 +8,8 @@ import dicttoxml
 from sqlalchemy import and_, or_, select, func, delete, update, union, text, BigInteger
 from sqlalchemy.orm import aliased
 
-from apps.ai_model.embedding import EmbeddingModelCache
+from apps.ai_model.embedding import EmbeddingModelCache, EmbeddingContext, embed_query
+from apps.datasource.embedding.utils import ensure_hnsw_index, format_vector_sql, set_hnsw_search_options
 from apps.datasource.models.datasource import CoreDatasource
 from apps.template.generate_chart.generator import get_base_terminology_template
 from apps.terminology.models.terminology_model import Terminology, TerminologyInfo
@@ -653,7 +654,7 @@ def run_fill_empty_embeddings(session_maker):
         session_maker.remove()
 
 
-def save_embeddings(session_maker, ids: List[int]):
+def save_embeddings(session_maker, ids: List[int], raise_errors: bool = False):
     if not settings.EMBEDDING_ENABLED:
         return
 
@@ -668,6 +669,8 @@ def save_embeddings(session_maker, ids: List[int]):
         model = EmbeddingModelCache.get_model()
 
         results = model.embed_documents(_words_list)
+        if results:
+            ensure_hnsw_index('terminology', len(results[0]))
 
         for index in range(len(results)):
             item = results[index]
@@ -677,42 +680,50 @@ def save_embeddings(session_maker, ids: List[int]):
 
     except Exception:
         traceback.print_exc()
+        if raise_errors:
+            raise
     finally:
         session_maker.remove()
 
 
+# nearest terms first so the hnsw index can be used, the similarity threshold is applied to them afterwards
 embedding_sql = f"""
 SELECT id, pid, word, similarity
 FROM
-(SELECT id, pid, word, oid, specific_ds, datasource_ids, enabled,
-( 1 - (embedding <=> :embedding_array) ) AS similarity
+(SELECT id, pid, word,
+( 1 - {{distance}} ) AS similarity
 FROM terminology AS child
-) TEMP
-WHERE similarity > {settings.EMBEDDING_TERMINOLOGY_SIMILARITY} AND oid = :oid AND enabled = true
+WHERE {{dimension_filter}} AND oid = :oid AND enabled = true
 AND (specific_ds = false OR specific_ds IS NULL)
-ORDER BY similarity DESC
+ORDER BY {{distance}}
 LIMIT {settings.EMBEDDING_TERMINOLOGY_TOP_COUNT}
+) TEMP
+WHERE similarity > {settings.EMBEDDING_TERMINOLOGY_SIMILARITY}
+ORDER BY similarity DESC
 """
 
 embedding_sql_with_datasource = f"""
 SELECT id, pid, word, similarity
 FROM
-(SELECT id, pid, word, oid, specific_ds, datasource_ids, enabled,
-( 1 - (embedding <=> :embedding_array) ) AS similarity
+(SELECT id, pid, word,
+( 1 - {{distance}} ) AS similarity
 FROM terminology AS child
-) TEMP
-WHERE similarity > {settings.EMBEDDING_TERMINOLOGY_SIMILARITY} AND oid = :oid AND enabled = true
+WHERE {{dimension_filter}} AND oid = :oid AND enabled = true
 AND (
     (specific_ds = false OR specific_ds IS NULL)
      OR
     (specific_ds = true AND datasource_ids IS NOT NULL AND datasource_ids @> jsonb_build_array(:datasource))
 )
-ORDER BY similarity DESC
+ORDER BY {{distance}}
 LIMIT {settings.EMBEDDING_TERMINOLOGY_TOP_COUNT}
+) TEMP
+WHERE similarity > {settings.EMBEDDING_TERMINOLOGY_SIMILARITY}
+ORDER BY similarity DESC
 """
 
 
-def select_terminology_by_word(session: SessionDep, word: str, oid: int, datasource: int = None):
+def select_terminology_by_word(session: SessionDep, word: str, oid: int, datasource: int = None,
+                               embedding_context: Optional[EmbeddingContext] = None):
     if word.strip() == "":
         return []
 
@@ -756,16 +767,16 @@ def select_terminology_by_word(session: SessionDep, word: str, oid: int, datasou
     if settings.EMBEDDING_ENABLED:
         with session.begin_nested():
             try:
-                model = EmbeddingModelCache.get_model()
-
-                embedding = model.embed_query(word)
+                embedding = embed_query(word, embedding_context)
+                dimension = len(embedding)
+                set_hnsw_search_options(session)
 
                 if datasource is not None:
-                    results = session.execute(text(embedding_sql_with_datasource),
+                    results = session.execute(text(format_vector_sql(embedding_sql_with_datasource, dimension)),
                                               {'embedding_array': str(embedding), 'oid': oid,
                                                'datasource': datasource}).fetchall()
                 else:
-                    results = session.execute(text(embedding_sql),
+                    results = session.execute(text(format_vector_sql(embedding_sql, dimension)),
                                               {'embedding_array': str(embedding), 'oid': oid}).fetchall()
 
                 for row in results:
@@ -846,10 +857,11 @@ def to_xml_string(_dict: list[dict] | dict, root: str = 'terminologies') -> str:
 
 
 def get_terminology_template(session: SessionDep, question: str, oid: Optional[int] = 1,
-                             datasource: Optional[int] = None) -> str:
+                             datasource: Optional[int] = None,
+                             embedding_context: Optional[EmbeddingContext] = None) -> str:
     if not oid:
         oid = 1
-    _results = select_terminology_by_word(session, question, oid, datasource)
+    _results = select_terminology_by_word(session, question, oid, datasource, embedding_context)
     if _results and len(_results) > 0:
         terminology = to_xml_string(_results)
         template = get_base_terminology_template().format(terminologies=terminology)
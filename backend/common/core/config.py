@@ -90,6 +90,16 @@ class Settings(BaseSettings):
 
     LOCAL_MODEL_PATH: str = '/opt/sqlbot/models'
     DEFAULT_EMBEDDING_MODEL: str = 'shibing624/text2vec-base-chinese'
+    # 'torch' or 'onnx', onnx needs the optional "onnx" dependencies. Vectors of the two backends differ slightly,
+    # re-embed the stored data after switching, see scripts/export_onnx_embedding_model.py
+    EMBEDDING_BACKEND: str = 'torch'
+    # relative to LOCAL_MODEL_PATH, exported next to the shipped model, not into it
+    EMBEDDING_ONNX_FILE: str = 'embedding/shibing624_text2vec-base-chinese_onnx/onnx/model_qint8_avx2.onnx'
+    # shared embedding server, e.g. unix:///tmp/sqlbot-embedding.sock, empty loads the model in every worker
+    EMBEDDING_SERVER_URL: str = ''
+    EMBEDDING_SERVER_TIMEOUT: int = 60
+    EMBEDDING_SERVER_MAX_BATCH_SIZE: int = 64  # texts of concurrent requests embedded in one forward pass
+    EMBEDDING_SERVER_MAX_WAIT: int = 5  # milliseconds a batch waits for more concurrent requests
     EMBEDDING_ENABLED: bool = True
     EMBEDDING_DEFAULT_SIMILARITY: float = 0.4
     EMBEDDING_TERMINOLOGY_SIMILARITY: float = EMBEDDING_DEFAULT_SIMILARITY
@@ -97,8 +107,20 @@ class Settings(BaseSettings):
     EMBEDDING_DEFAULT_TOP_COUNT: int = 5
     EMBEDDING_TERMINOLOGY_TOP_COUNT: int = EMBEDDING_DEFAULT_TOP_COUNT
     EMBEDDING_DATA_TRAINING_TOP_COUNT: int = EMBEDDING_DEFAULT_TOP_COUNT
+    EMBEDDING_HNSW_EF_SEARCH: int = 100  # candidates read from the hnsw index per search
+    EMBEDDING_CACHE_ENABLED: bool = True  # query embeddings shared across requests, in redis too with CACHE_TYPE=redis
+    EMBEDDING_CACHE_TTL: int = 24 * 3600
+    EMBEDDING_CACHE_MAX_SIZE: int = 10000
+    EMBEDDING_BATCH_SIZE: int = 64  # tables or datasources embedded and written back together
+    EMBEDDING_JOB_WORKERS: int = 2
+    EMBEDDING_JOB_DEBOUNCE: int = 5  # seconds an embedding job waits for more edits of the same entity
+    EMBEDDING_JOB_MAX_DELAY: int = 60  # seconds after the first edit a job runs even if edits keep coming
+    EMBEDDING_JOB_POLL_INTERVAL: int = 1
+    EMBEDDING_JOB_STALE_TIMEOUT: int = 600  # seconds before a running job of a stopped process is run again
+    EMBEDDING_JOB_MAX_ATTEMPTS: int = 3
 
     GENERATE_SQL_QUERY_LIMIT_ENABLED: bool = True
+    SQL_LIMIT_PUSHDOWN_ENABLED: bool = True  # rewrite generated sql so the database applies the row limit
 
     PARSE_REASONING_BLOCK_ENABLED: bool = True
     DEFAULT_REASONING_CONTENT_START: str = '<think>'
@@ -109,17 +131,63 @@ class Settings(BaseSettings):
     PG_POOL_RECYCLE: int = 3600
     PG_POOL_PRE_PING: bool = True
 
+    DS_POOL_SIZE: int = 5
+    DS_MAX_OVERFLOW: int = 10
+    DS_POOL_RECYCLE: int = 3600
+    DS_POOL_PRE_PING: bool = True
+    DS_POOL_IDLE_TIMEOUT: int = 1800  # dispose datasource pools unused for this many seconds
+    DS_POOL_UNSAVED_IDLE_TIMEOUT: int = 60  # same for pools of datasources not saved yet, e.g. connection tests
+    DS_POOL_EVICT_INTERVAL: int = 60
+    DS_FETCH_BATCH_SIZE: int = 500
+    DS_ES_MAX_ROWS: int = 100000  # rows paged from elasticsearch at most when a query has no row limit
+    DS_VERSION_CACHE_TTL: int = 3600
+    DS_VERSION_FAILURE_CACHE_TTL: int = 60  # a failed version query is not retried for this many seconds
+    DS_HEALTH_CHECK_TTL: int = 60  # skip connection check if datasource was reachable within this many seconds
+    DS_CIRCUIT_FAILURE_THRESHOLD: int = 3
+    DS_CIRCUIT_OPEN_SECONDS: int = 30
+    # preview and sql endpoints of datasources run queries on the event loop, chat tasks keep the sync drivers,
+    # needs the optional "async" dependencies (asyncpg, aiomysql)
+    DS_ASYNC_ENABLED: bool = False
+    DS_ASYNC_TYPES: str = 'pg,mysql,excel'
+    DS_ARROW_ENABLED: bool = False  # fetch chat query results as Arrow, needs the optional "arrow" dependencies
+    # pg and excel read through a pooled ADBC connection per datasource, add mysql to read through connectorx,
+    # which opens a new connection per query, can not be cancelled and reads the whole result before truncating it
+    DS_ARROW_TYPES: str = 'pg,excel'
+    DS_ARROW_STATEMENT_TIMEOUT: int = 300  # seconds an Arrow fetched query may run on the datasource, 0 for no limit
+    DS_QUERY_CONCURRENCY: int = 10  # concurrent queries per datasource, 0 for no limit
+    WORKSPACE_QUERY_CONCURRENCY: int = 30  # concurrent queries per workspace, 0 for no limit
+    DS_QUERY_QUEUE_SIZE: int = 50  # queries waiting for one datasource, more are rejected at once
+    DS_QUERY_QUEUE_TIMEOUT: int = 60  # seconds a query waits for a free slot
+
+    QUERY_RESULT_CACHE_ENABLED: bool = False
+    QUERY_RESULT_CACHE_TTL: int = 300
+    QUERY_RESULT_CACHE_MAX_SIZE: int = 200
+    QUERY_RESULT_CACHE_MAX_BYTES: int = 8 * 1024 * 1024  # results larger than this are not cached
+
+    SCHEMA_REFRESH_ENABLED: bool = False
+    SCHEMA_REFRESH_INTERVAL: int = 3600  # seconds between two background schema refreshes
+    SCHEMA_REFRESH_WORKERS: int = 2  # datasources refreshed at the same time, each one by a single worker
+
     TABLE_EMBEDDING_ENABLED: bool = True
     TABLE_EMBEDDING_COUNT: int = 10
+    TABLE_EMBEDDING_SEARCH: str = 'db'  # 'db': pgvector search, 'memory': in process matrix per datasource
+    TABLE_EMBEDDING_MATRIX_CACHE_SIZE: int = 50  # datasources whose table embedding matrix is kept in memory
     DS_EMBEDDING_COUNT: int = 10
 
     ORACLE_CLIENT_PATH: str = '/opt/sqlbot/db_client/oracle_instant_client'
 
     @field_validator('SQL_DEBUG',
                      'EMBEDDING_ENABLED',
+                     'EMBEDDING_CACHE_ENABLED',
                      'GENERATE_SQL_QUERY_LIMIT_ENABLED',
+                     'SQL_LIMIT_PUSHDOWN_ENABLED',
                      'PARSE_REASONING_BLOCK_ENABLED',
                      'PG_POOL_PRE_PING',
+                     'DS_POOL_PRE_PING',
+                     'DS_ASYNC_ENABLED',
+                     'DS_ARROW_ENABLED',
+                     'QUERY_RESULT_CACHE_ENABLED',
+                     'SCHEMA_REFRESH_ENABLED',
                      'TABLE_EMBEDDING_ENABLED',
                      mode='before')
     @classmethod
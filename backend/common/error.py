@@ -17,3 +17,11 @@ class SQLBotDBError(Exception):
 
 class ParseSQLResultError(Exception):
     pass
+
+
+class DatasourceBusyError(Exception):
+    pass
+
+
+class TaskCancelledError(Exception):
+    pass
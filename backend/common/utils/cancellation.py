@@ -0,0 +1,205 @@
+import json
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Optional
+
+from common.error import TaskCancelledError
+from common.utils.utils import SQLBotLogUtil
+
+
+class CancellationToken:
+    """Shared by all steps of one task, steps check it between units of work or register a callback
+    that interrupts a blocking call (e.g. the running statement of a datasource)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cancelled = False
+        self._callbacks: dict[int, Callable[[], Any]] = {}
+        self._next_handle = 0
+        self.reason: Optional[str] = None
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled
+
+    def cancel(self, reason: str = 'cancelled'):
+        with self._lock:
+            if self._cancelled:
+                return
+            self._cancelled = True
+            self.reason = reason
+            callbacks = list(self._callbacks.values())
+            self._callbacks.clear()
+        for callback in callbacks:
+            _run_callback(callback)
+
+    def register(self, callback: Callable[[], Any]) -> Optional[int]:
+        with self._lock:
+            if not self._cancelled:
+                self._next_handle += 1
+                self._callbacks[self._next_handle] = callback
+                return self._next_handle
+        # already cancelled, interrupt right away
+        _run_callback(callback)
+        return None
+
+    def unregister(self, handle: Optional[int]):
+        if handle is None:
+            return
+        with self._lock:
+            self._callbacks.pop(handle, None)
+
+    @contextmanager
+    def on_cancel(self, callback: Optional[Callable[[], Any]]):
+        handle = self.register(callback) if callback is not None else None
+        try:
+            yield self
+        finally:
+            self.unregister(handle)
+
+    def raise_if_cancelled(self):
+        if self._cancelled:
+            raise TaskCancelledError(self.reason)
+
+
+def _run_callback(callback: Callable[[], Any]):
+    try:
+        callback()
+    except Exception as e:
+        SQLBotLogUtil.warning(f"Cancel callback failed: {e}")
+
+
+def raise_if_cancelled(cancel_token: Optional[CancellationToken]):
+    if cancel_token is not None:
+        cancel_token.raise_if_cancelled()
+
+
+@contextmanager
+def on_cancel(cancel_token: Optional[CancellationToken], callback: Optional[Callable[[], Any]]):
+    """Same as CancellationToken.on_cancel, nothing to do without a token."""
+    if cancel_token is None:
+        yield None
+        return
+    with cancel_token.on_cancel(callback):
+        yield cancel_token
+
+
+_lock = threading.Lock()
+
+# task key (e.g. chat record id) -> token of the running task
+_running: dict[Any, CancellationToken] = {}
+
+# cancels of tasks running in another process (uvicorn worker) are sent through postgres NOTIFY
+_channel = 'sqlbot_task_cancel'
+
+_stop_event = threading.Event()
+
+_listener: Optional[threading.Thread] = None
+
+
+def _cancel_local(key: Any, reason: str) -> bool:
+    with _lock:
+        token = _running.get(key)
+    if token is None:
+        return False
+    token.cancel(reason)
+    return True
+
+
+def _notify(key: Any, reason: str):
+    from sqlalchemy import text
+    from common.core.db import engine
+    with engine.begin() as conn:
+        conn.execute(text("SELECT pg_notify(:channel, :payload)"),
+                     {'channel': _channel, 'payload': json.dumps({'key': key, 'reason': reason})})
+
+
+def _on_notify(payload: str):
+    message = json.loads(payload)
+    _cancel_local(message['key'], message['reason'])
+
+
+def _listen():
+    from common.core.db import engine
+    failed = False
+    while not _stop_event.is_set():
+        connection = None
+        try:
+            connection = engine.raw_connection()
+            # kept out of the pool, the connection only waits for notifications
+            connection.detach()
+            dbapi_connection = connection.dbapi_connection
+            dbapi_connection.rollback()
+            dbapi_connection.autocommit = True
+            dbapi_connection.execute(f"LISTEN {_channel}")
+            if failed:
+                SQLBotLogUtil.info("Listen for task cancels again")
+                failed = False
+            while not _stop_event.is_set():
+                # notifies with a timeout needs psycopg 3.2
+                for notify in dbapi_connection.notifies(timeout=5):
+                    _on_notify(notify.payload)
+        except Exception as e:
+            # retried quietly until it works again, tasks of other workers can not be cancelled meanwhile
+            if not failed:
+                SQLBotLogUtil.error(f"Listen for task cancels failed, cancels of tasks running in other "
+                                    f"workers are lost until it recovers: {e}")
+                failed = True
+            _stop_event.wait(5)
+        finally:
+            if connection is not None:
+                try:
+                    connection.close()
+                except Exception:
+                    pass
+
+
+class CancellationRegistry:
+    """Tokens of running tasks, to cancel a task from another request."""
+
+    @staticmethod
+    def register(key: Any, token: CancellationToken):
+        with _lock:
+            _running[key] = token
+
+    @staticmethod
+    def unregister(key: Any, token: CancellationToken):
+        with _lock:
+            if _running.get(key) is token:
+                del _running[key]
+
+    @staticmethod
+    def cancel(key: Any, reason: str = 'cancelled') -> bool:
+        """True when the task runs in this process, or the cancel was sent to the other processes."""
+        if _cancel_local(key, reason):
+            return True
+        if _listener is None:
+            return False
+        try:
+            _notify(key, reason)
+        except Exception as e:
+            SQLBotLogUtil.warning(f"Send cancel of task {key} failed: {e}")
+            return False
+        return True
+
+    @staticmethod
+    def is_running(key: Any) -> bool:
+        with _lock:
+            return key in _running
+
+    @staticmethod
+    def start():
+        global _listener
+        with _lock:
+            if _listener is not None:
+                return
+            _stop_event.clear()
+            _listener = threading.Thread(target=_listen, name='task-cancel-listener', daemon=True)
+            _listener.start()
+
+    @staticmethod
+    def stop():
+        global _listener
+        _stop_event.set()
+        with _lock:
+            _listener = None
@@ -1,19 +1,40 @@
+from decimal import Decimal
+
+import numpy as np
 import pandas as pd
 
-class DataFormat:
-    @staticmethod
-    def safe_convert_to_string(df):
-        df_copy = df.copy()
+from common.utils.utils import prepare_for_orjson
+
+_NONE_TYPE = type(None)
+
 
-        def format_value(x):
-            if pd.isna(x):
-                return ""
+def _format_float_without_scientific(value):
+    """格式化浮点数，避免科学记数法"""
+    if value == 0:
+        return "0"
+    formatted = f"{value:.15f}"
+    if '.' in formatted:
+        formatted = formatted.rstrip('0').rstrip('.')
+    return formatted
 
-            return "\u200b" + str(x)
 
-        for col in df_copy.columns:
-            df_copy[col] = df_copy[col].apply(format_value)
+def _has_subclass_of(types: set, classes: tuple) -> bool:
+    return any(issubclass(t, classes) for t in types)
+
+
+class DataFormat:
+    @staticmethod
+    def safe_convert_to_string(df):
+        """空值转为空字符串，其他值转字符串并加零宽空格前缀，空值判断按列一次完成"""
+        columns = {}
+        for i in range(df.shape[1]):
+            series = df.iloc[:, i]
+            na_mask = series.isna().to_numpy()
+            columns[i] = ["" if is_na else "\u200b" + str(value)
+                          for value, is_na in zip(series.to_numpy(dtype=object), na_mask)]
 
+        df_copy = pd.DataFrame(columns, index=df.index, dtype=object)
+        df_copy.columns = df.columns
         return df_copy
 
     @staticmethod
@@ -62,6 +83,147 @@ class DataFormat:
 
         return [process_item(obj) for obj in obj_array]
 
+    @staticmethod
+    def convert_large_numbers_in_column(column: list, int_threshold=1e15, float_threshold=1e10, types: set = None):
+        """与 convert_large_numbers_in_object_array 规则一致，处理单列，只有需要转换的值才逐个处理"""
+        if types is None:
+            types = set(map(type, column))
+        types = types - {_NONE_TYPE}
+        if not _has_subclass_of(types, (int, float, dict, list)):
+            return column
+
+        if types <= {int, bool} and int_threshold <= 2 ** 53:
+            # 小于 2**53 的整数转为 float 不丢精度，比较结果与整数一致
+            try:
+                values = np.abs(np.array(column, dtype=np.float64))
+            except OverflowError:
+                values = None
+            if values is not None:
+                return DataFormat._replace_values(column, np.flatnonzero(values >= int_threshold), str)
+        elif types <= {float}:
+            with np.errstate(invalid='ignore'):
+                values = np.abs(np.array(column, dtype=np.float64))
+                mask = (values >= float_threshold) | (values < 1e-6)
+            return DataFormat._replace_values(column, np.flatnonzero(mask), _format_float_without_scientific)
+
+        def process_value(value):
+            if isinstance(value, int) and abs(value) >= int_threshold:
+                return str(value)
+            if isinstance(value, float) and (abs(value) >= float_threshold or abs(value) < 1e-6):
+                return _format_float_without_scientific(value)
+            if isinstance(value, (dict, list)):
+                # 嵌套对象
+                processed = DataFormat.convert_large_numbers_in_object_array(
+                    [value] if isinstance(value, dict) else value, int_threshold, float_threshold)
+                return processed[0] if isinstance(value, dict) else processed
+            return value
+
+        return [process_value(value) for value in column]
+
+    @staticmethod
+    def _replace_values(column: list, indexes, func):
+        if not len(indexes):
+            return column
+        result = list(column)
+        for i in indexes.tolist():
+            result[i] = func(column[i])
+        return result
+
+    @staticmethod
+    def convert_large_numbers_in_columns(columns: list, int_threshold=1e15, float_threshold=1e10):
+        return [DataFormat.convert_large_numbers_in_column(column, int_threshold, float_threshold)
+                for column in columns or []]
+
+    @staticmethod
+    def convert_decimal_column(column: list, types: set = None):
+        """Decimal 转为 float"""
+        if types is None:
+            types = set(map(type, column))
+        if not _has_subclass_of(types, (Decimal,)):
+            return column
+        if all(issubclass(t, Decimal) for t in types):
+            # 整列都是 Decimal，由 numpy 转换
+            return np.array(column, dtype=object).astype(np.float64).tolist()
+        return [float(value) if isinstance(value, Decimal) else value for value in column]
+
+    @staticmethod
+    def convert_decimal_columns(columns: list):
+        return [DataFormat.convert_decimal_column(column) for column in columns or []]
+
+    @staticmethod
+    def prepare_column_for_orjson(column: list, types: set = None):
+        if types is None:
+            types = set(map(type, column))
+        if not _has_subclass_of(types, (bytes, dict, list, tuple)):
+            return column
+        return [prepare_for_orjson(value) for value in column]
+
+    @staticmethod
+    def process_result_columns(columns: list, int_threshold=1e15, float_threshold=1e10):
+        """查询结果后处理：Decimal 转换、大数字转换及 orjson 序列化准备，按列处理"""
+        result = []
+        for column in columns or []:
+            types = set(map(type, column))
+            converted = DataFormat.convert_decimal_column(column, types)
+            if converted is not column:
+                types = set(map(type, converted))
+            column = converted
+            converted = DataFormat.convert_large_numbers_in_column(column, int_threshold, float_threshold, types)
+            if converted is not column:
+                types = set(map(type, converted))
+            result.append(DataFormat.prepare_column_for_orjson(converted, types))
+        return result
+
+    @staticmethod
+    def rows_to_columns(rows: list, width: int):
+        """行数据转为列式存储：每列一个数组"""
+        if not rows:
+            return [[] for _ in range(width)]
+        return [list(column) for column in zip(*rows)]
+
+    @staticmethod
+    def columns_to_object_array(fields: list, columns: list):
+        """列式数据转为对象数组，同名列以最后一列为准"""
+        return [dict(zip(fields, row)) for row in zip(*columns)] if columns else []
+
+    @staticmethod
+    def get_object_array(data_obj: dict):
+        """兼容旧的对象数组结构（data）与列式结构（columns）"""
+        if data_obj.get('columns') is None:
+            return data_obj.get('data')
+        return DataFormat.columns_to_object_array(data_obj.get('fields') or [], data_obj.get('columns'))
+
+    @staticmethod
+    def get_columns(data_obj: dict):
+        """兼容旧的对象数组结构（data），返回字段与列式数据"""
+        fields = data_obj.get('fields') or []
+        if data_obj.get('columns') is not None:
+            return fields, data_obj.get('columns')
+        data = data_obj.get('data') or []
+        return fields, [[row.get(field) for row in data] for field in fields]
+
+    @staticmethod
+    def to_object_result(data_obj: dict):
+        """返回对象数组结构的结果，用于接口输出"""
+        if data_obj.get('columns') is None:
+            return data_obj
+        result = {k: v for k, v in data_obj.items() if k != 'columns'}
+        result['data'] = DataFormat.get_object_array(data_obj)
+        return result
+
+    @staticmethod
+    def columns_to_dataframe(column_list: list, fields: list, columns: list):
+        """按 column_list 选取列直接构建 DataFrame，不经过行数据，同名列以最后一列为准"""
+        _fields_list = [field.name for field in column_list]
+
+        index = {field: idx for idx, field in enumerate(fields)}
+        row_count = len(columns[0]) if columns else 0
+        data = {i: columns[index[field.value]] if field.value in index else [None] * row_count
+                for i, field in enumerate(column_list)}
+        df = pd.DataFrame(data, index=pd.RangeIndex(row_count))
+        df.columns = _fields_list
+        return df
+
     @staticmethod
     def convert_object_array_for_pandas(column_list: list, data_list: list):
         _fields_list = []
@@ -1,9 +1,17 @@
+import threading
+import time
+import traceback
 from concurrent.futures import ThreadPoolExecutor
-from typing import List
+from typing import Callable, List
 
+from sqlalchemy import text
 from sqlalchemy.orm import sessionmaker, scoped_session
 
-executor = ThreadPoolExecutor(max_workers=200)
+from common.core.config import settings
+from common.utils.utils import SQLBotLogUtil
+
+# one thread per fill job run at startup, edits go through the embedding job queue
+executor = ThreadPoolExecutor(max_workers=3, thread_name_prefix='embedding-fill')
 
 from common.core.db import engine
 
@@ -12,10 +20,205 @@ session_maker = scoped_session(sessionmaker(bind=engine))
 
 # session = session_maker()
 
+_lock = threading.Lock()
+
+_stop_event = threading.Event()
+
+_workers: List[threading.Thread] = []
+
+# an edit pushes the run time of a pending job back by the debounce window, up to max delay after the first edit,
+# a running job keeps its status and runs once more when it finishes, so one entity never runs twice at once
+enqueue_sql = """
+INSERT INTO embedding_job (entity_type, entity_id, status, version, attempts, run_at, pending_since, update_time)
+SELECT :entity_type, entity_id, 'pending', 1, 0, clock_timestamp() + make_interval(secs => :debounce),
+       clock_timestamp(), clock_timestamp()
+FROM unnest(CAST(:ids AS bigint[])) AS entity_id
+ON CONFLICT (entity_type, entity_id) DO UPDATE SET
+    pending_since = CASE WHEN embedding_job.status = 'pending' THEN embedding_job.pending_since
+                         ELSE EXCLUDED.pending_since END,
+    run_at = CASE WHEN embedding_job.status = 'pending'
+                  THEN LEAST(EXCLUDED.run_at, embedding_job.pending_since + make_interval(secs => :max_delay))
+                  ELSE EXCLUDED.run_at END,
+    status = CASE WHEN embedding_job.status = 'running' THEN 'running' ELSE 'pending' END,
+    version = embedding_job.version + 1,
+    attempts = 0,
+    error = NULL,
+    update_time = CASE WHEN embedding_job.status = 'running' THEN embedding_job.update_time
+                       ELSE EXCLUDED.update_time END
+"""
+
+# running jobs are kept fresh by a heartbeat, those not updated for the stale timeout were left by a stopped
+# process and are claimed again
+claim_sql = """
+UPDATE embedding_job SET status = 'running', attempts = attempts + 1, update_time = clock_timestamp()
+WHERE id IN (
+    SELECT id FROM embedding_job
+    WHERE (status = 'pending' AND run_at <= clock_timestamp())
+       OR (status = 'running' AND update_time < clock_timestamp() - make_interval(secs => :stale_timeout))
+    ORDER BY run_at
+    LIMIT :limit
+    FOR UPDATE SKIP LOCKED
+)
+RETURNING id, entity_type, entity_id, version
+"""
+
+heartbeat_sql = """
+UPDATE embedding_job SET update_time = clock_timestamp()
+WHERE id = ANY(CAST(:ids AS bigint[])) AND status = 'running'
+"""
+
+# a job enqueued again while running has a new version and goes back to pending instead
+complete_sql = """
+WITH done AS (
+    DELETE FROM embedding_job AS j
+    USING (SELECT unnest(CAST(:ids AS bigint[])) AS id, unnest(CAST(:versions AS bigint[])) AS version) AS v
+    WHERE j.id = v.id AND j.version = v.version AND j.status = 'running'
+    RETURNING j.id
+)
+UPDATE embedding_job SET status = 'pending', update_time = clock_timestamp()
+WHERE id = ANY(CAST(:ids AS bigint[])) AND status = 'running' AND id NOT IN (SELECT id FROM done)
+"""
+
+fail_sql = """
+UPDATE embedding_job AS j SET
+    status = CASE WHEN j.version = v.version AND j.attempts >= :max_attempts THEN 'failed' ELSE 'pending' END,
+    error = :error,
+    run_at = CASE WHEN j.version = v.version THEN clock_timestamp() + make_interval(secs => :debounce)
+                  ELSE j.run_at END,
+    update_time = clock_timestamp()
+FROM (SELECT unnest(CAST(:ids AS bigint[])) AS id, unnest(CAST(:versions AS bigint[])) AS version) AS v
+WHERE j.id = v.id AND j.status = 'running'
+"""
+
+stats_sql = """
+SELECT entity_type, status, COUNT(*) AS count, MIN(run_at) AS next_run_at
+FROM embedding_job
+GROUP BY entity_type, status
+"""
+
+
+def get_job_handler(entity_type: str) -> Callable[..., None]:
+    if entity_type == 'terminology':
+        from apps.terminology.curd.terminology import save_embeddings
+        return save_embeddings
+    if entity_type == 'data_training':
+        from apps.data_training.curd.data_training import save_embeddings
+        return save_embeddings
+    if entity_type == 'table':
+        from apps.datasource.crud.table import save_table_embedding
+        return save_table_embedding
+    if entity_type == 'datasource':
+        from apps.datasource.crud.table import save_ds_embedding
+        return save_ds_embedding
+    raise ValueError(f"Unknown embedding job type: {entity_type}")
+
+
+def _heartbeat(ids: List[int], done: threading.Event):
+    # a third of the stale timeout, so a slow batch is never taken for the job of a stopped process
+    interval = max(settings.EMBEDDING_JOB_STALE_TIMEOUT / 3, 1)
+    while not done.wait(interval):
+        try:
+            with engine.begin() as conn:
+                conn.execute(text(heartbeat_sql), {'ids': ids})
+        except Exception as e:
+            SQLBotLogUtil.warning(f"Embedding job heartbeat failed: {e}")
+
+
+def _run_jobs(entity_type: str, jobs: list):
+    ids = [job.id for job in jobs]
+    versions = [job.version for job in jobs]
+    start_time = time.time()
+    done = threading.Event()
+    heartbeat = threading.Thread(target=_heartbeat, args=(ids, done), name='embedding-job-heartbeat', daemon=True)
+    heartbeat.start()
+    try:
+        get_job_handler(entity_type)(session_maker, [job.entity_id for job in jobs], raise_errors=True)
+    except Exception as e:
+        done.set()
+        SQLBotLogUtil.error(f"Embedding jobs of {entity_type} failed: {e}\n{traceback.format_exc()}")
+        with engine.begin() as conn:
+            conn.execute(text(fail_sql), {'ids': ids, 'versions': versions, 'error': str(e),
+                                          'max_attempts': settings.EMBEDDING_JOB_MAX_ATTEMPTS,
+                                          'debounce': settings.EMBEDDING_JOB_DEBOUNCE})
+        return
+    done.set()
+    with engine.begin() as conn:
+        conn.execute(text(complete_sql), {'ids': ids, 'versions': versions})
+    SQLBotLogUtil.info(f"Embedding jobs of {entity_type}: {len(jobs)} finished in {time.time() - start_time:.2f}s")
+
+
+def _work():
+    while not _stop_event.is_set():
+        try:
+            with engine.begin() as conn:
+                jobs = conn.execute(text(claim_sql), {'stale_timeout': settings.EMBEDDING_JOB_STALE_TIMEOUT,
+                                                      'limit': max(settings.EMBEDDING_BATCH_SIZE, 1)}).fetchall()
+        except Exception as e:
+            SQLBotLogUtil.error(f"Claim embedding jobs failed: {e}")
+            jobs = []
+        if not jobs:
+            _stop_event.wait(settings.EMBEDDING_JOB_POLL_INTERVAL)
+            continue
+
+        jobs_by_type: dict[str, list] = {}
+        for job in jobs:
+            jobs_by_type.setdefault(job.entity_type, []).append(job)
+        for entity_type, typed_jobs in jobs_by_type.items():
+            try:
+                _run_jobs(entity_type, typed_jobs)
+            except Exception as e:
+                # the jobs are claimed again after the stale timeout
+                SQLBotLogUtil.error(f"Update embedding jobs of {entity_type} failed: {e}")
+
+
+class EmbeddingJobQueue:
+    """Embedding jobs kept in the embedding_job table, one row per entity so repeated edits coalesce."""
+
+    @staticmethod
+    def enqueue(entity_type: str, ids: List[int]):
+        ids = list(dict.fromkeys(_id for _id in ids if _id is not None)) if ids else []
+        if not ids:
+            return
+        try:
+            with engine.begin() as conn:
+                conn.execute(text(enqueue_sql), {'entity_type': entity_type, 'ids': ids,
+                                                 'debounce': settings.EMBEDDING_JOB_DEBOUNCE,
+                                                 'max_delay': settings.EMBEDDING_JOB_MAX_DELAY})
+        except Exception as e:
+            SQLBotLogUtil.error(f"Enqueue {len(ids)} embedding job(s) of {entity_type} failed: {e}")
+
+    @staticmethod
+    def stats() -> dict:
+        with engine.connect() as conn:
+            rows = conn.execute(text(stats_sql)).fetchall()
+        with _lock:
+            workers = len([worker for worker in _workers if worker.is_alive()])
+        return {"backlog": sum(row.count for row in rows if row.status != 'failed'),
+                "workers": workers,
+                "jobs": [{"entity_type": row.entity_type, "status": row.status, "count": row.count,
+                          "next_run_at": row.next_run_at} for row in rows]}
+
+    @staticmethod
+    def start():
+        with _lock:
+            if _workers:
+                return
+            _stop_event.clear()
+            for index in range(max(settings.EMBEDDING_JOB_WORKERS, 1)):
+                worker = threading.Thread(target=_work, name=f'embedding-job-{index}', daemon=True)
+                worker.start()
+                _workers.append(worker)
+        SQLBotLogUtil.info(f"Embedding job queue started with {settings.EMBEDDING_JOB_WORKERS} worker(s)")
+
+    @staticmethod
+    def stop():
+        _stop_event.set()
+        with _lock:
+            _workers.clear()
+
 
 def run_save_terminology_embeddings(ids: List[int]):
-    from apps.terminology.curd.terminology import save_embeddings
-    executor.submit(save_embeddings, session_maker, ids)
+    EmbeddingJobQueue.enqueue('terminology', ids)
 
 
 def fill_empty_terminology_embeddings():
@@ -24,8 +227,7 @@ def fill_empty_terminology_embeddings():
 
 
 def run_save_data_training_embeddings(ids: List[int]):
-    from apps.data_training.curd.data_training import save_embeddings
-    executor.submit(save_embeddings, session_maker, ids)
+    EmbeddingJobQueue.enqueue('data_training', ids)
 
 
 def fill_empty_data_training_embeddings():
@@ -34,13 +236,11 @@ def fill_empty_data_training_embeddings():
 
 
 def run_save_table_embeddings(ids: List[int]):
-    from apps.datasource.crud.table import save_table_embedding
-    executor.submit(save_table_embedding, session_maker, ids)
+    EmbeddingJobQueue.enqueue('table', ids)
 
 
 def run_save_ds_embeddings(ids: List[int]):
-    from apps.datasource.crud.table import save_ds_embedding
-    executor.submit(save_ds_embedding, session_maker, ids)
+    EmbeddingJobQueue.enqueue('datasource', ids)
 
 
 def fill_empty_table_and_ds_embeddings():
@@ -12,6 +12,8 @@ from starlette.middleware.cors import CORSMiddleware
 
 from alembic import command
 from apps.api import api_router
+from apps.datasource.crud.schema_refresh import SchemaRefresher
+from apps.db.ds_pool import DsPoolCache
 from common.utils.embedding_threads import fill_empty_table_and_ds_embeddings
 from apps.system.crud.aimodel_manage import async_model_info
 from apps.system.crud.assistant import init_dynamic_cors
@@ -19,7 +21,9 @@ from apps.system.middleware.auth import TokenMiddleware
 from common.core.config import settings
 from common.core.response_middleware import ResponseMiddleware, exception_handler
 from common.core.sqlbot_cache import init_sqlbot_cache
-from common.utils.embedding_threads import fill_empty_terminology_embeddings, fill_empty_data_training_embeddings
+from common.utils.cancellation import CancellationRegistry
+from common.utils.embedding_threads import fill_empty_terminology_embeddings, fill_empty_data_training_embeddings, \
+    EmbeddingJobQueue
 from common.utils.utils import SQLBotLogUtil
 
 
@@ -48,10 +52,17 @@ async def lifespan(app: FastAPI):
     init_terminology_embedding_data()
     init_data_training_embedding_data()
     init_table_and_ds_embedding()
+    SchemaRefresher.start()
+    EmbeddingJobQueue.start()
+    CancellationRegistry.start()
     SQLBotLogUtil.info("✅ SQLBot 初始化完成")
     await sqlbot_xpack.core.clean_xpack_cache()
     await async_model_info()  # 异步加密已有模型的密钥和地址
     yield
+    SchemaRefresher.stop()
+    EmbeddingJobQueue.stop()
+    CancellationRegistry.stop()
+    DsPoolCache.clear()
     SQLBotLogUtil.info("SQLBot 应用关闭")
 
 
@@ -0,0 +1,99 @@
+"""
+Micro-benchmark for query result post-processing.
+
+Compares the row based pipeline (Decimal per cell, convert_large_numbers_in_object_array,
+prepare_for_orjson, safe_convert_to_string with apply) with the column based one in DataFormat,
+and checks that both produce identical output.
+
+Run from the backend directory:
+    python scripts/benchmark/data_format_benchmark.py [rows] [columns]
+"""
+import os
+import random
+import sys
+import timeit
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+import orjson  # noqa: E402
+import pandas as pd  # noqa: E402
+
+from common.utils.data_format import DataFormat  # noqa: E402
+from common.utils.utils import prepare_for_orjson  # noqa: E402
+
+
+def make_rows(row_count: int, column_count: int):
+    random.seed(0)
+    start = datetime(2024, 1, 1)
+    generators = [
+        lambda i: i,
+        lambda i: random.randint(-10 ** 17, 10 ** 17),
+        lambda i: random.random() * 10 ** random.randint(-8, 12),
+        lambda i: Decimal(f'{random.randint(0, 10 ** 6)}.{random.randint(0, 99):02d}'),
+        lambda i: f'name_{i}',
+        lambda i: None if i % 7 == 0 else random.random(),
+        lambda i: start + timedelta(minutes=i),
+        lambda i: None if i % 5 == 0 else f'text {i}',
+    ]
+    fields = [f'col_{c}' for c in range(column_count)]
+    rows = [tuple(generators[c % len(generators)](i) for c in range(column_count)) for i in range(row_count)]
+    return fields, rows
+
+
+def legacy_safe_convert_to_string(df):
+    df_copy = df.copy()
+
+    def format_value(x):
+        if pd.isna(x):
+            return ""
+
+        return "\u200b" + str(x)
+
+    for col in df_copy.columns:
+        df_copy[col] = df_copy[col].apply(format_value)
+
+    return df_copy
+
+
+def legacy_pipeline(fields, rows):
+    data = [{fields[i]: float(value) if isinstance(value, Decimal) else value for i, value in enumerate(row)}
+            for row in rows]
+    data = DataFormat.convert_large_numbers_in_object_array(data)
+    return prepare_for_orjson(data)
+
+
+def columnar_pipeline(fields, rows):
+    columns = DataFormat.convert_decimal_columns(DataFormat.rows_to_columns(rows, len(fields)))
+    return DataFormat.process_result_columns(columns)
+
+
+def main():
+    row_count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    column_count = int(sys.argv[2]) if len(sys.argv) > 2 else 30
+    fields, rows = make_rows(row_count, column_count)
+
+    legacy = legacy_pipeline(fields, rows)
+    columns = columnar_pipeline(fields, rows)
+    assert orjson.dumps(legacy) == orjson.dumps(DataFormat.columns_to_object_array(fields, columns)), \
+        'post-processing output differs'
+
+    df = pd.DataFrame([list(row) for row in zip(*columns)], columns=fields)
+    assert legacy_safe_convert_to_string(df).to_markdown(index=False) == \
+           DataFormat.safe_convert_to_string(df).to_markdown(index=False), 'markdown output differs'
+
+    number = 20
+    print(f'{row_count} rows x {column_count} columns, best of 3 x {number} runs')
+    for name, func in [
+        ('row post-processing', lambda: legacy_pipeline(fields, rows)),
+        ('column post-processing', lambda: columnar_pipeline(fields, rows)),
+        ('row safe_convert_to_string', lambda: legacy_safe_convert_to_string(df)),
+        ('column safe_convert_to_string', lambda: DataFormat.safe_convert_to_string(df)),
+    ]:
+        cost = min(timeit.repeat(func, number=number, repeat=3)) / number
+        print(f'{name:<32}{cost * 1000:>10.2f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""
+Startup benchmark for database drivers.
+
+Each measurement runs in a fresh interpreter and reports import time and peak RSS of:
+  - the driver registry alone (what apps.db.driver / apps.db.db import now),
+  - every driver loaded eagerly (what the module level imports used to cost),
+  - each driver on its own (what the first query of one datasource type costs).
+
+Run from the backend directory:
+    python scripts/benchmark/driver_import_benchmark.py [repeat]
+"""
+import json
+import os
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+PROBE = """
+import json, resource, sys, time
+modules = json.loads(sys.argv[1])
+start = time.perf_counter()
+from apps.db import driver_registry
+failed = []
+for name in modules:
+    try:
+        driver_registry.load_driver(name)
+    except Exception as e:
+        failed.append(name)
+cost = time.perf_counter() - start
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({"ms": cost * 1000, "rss_mb": rss / 1024, "failed": failed}))
+"""
+
+
+def probe(modules: list[str], repeat: int) -> dict:
+    results = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', PROBE, json.dumps(modules)], cwd=BACKEND_DIR,
+                                capture_output=True, text=True, check=True).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+    best = min(results, key=lambda item: item['ms'])
+    return best
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    sys.path.insert(0, BACKEND_DIR)
+    from apps.db.driver_registry import driver_modules
+
+    modules = list(dict.fromkeys(driver_modules.values()))
+    cases = [('registry only (lazy)', []), ('all drivers (eager)', modules)]
+    cases += [(f'  {name}', [name]) for name in modules]
+
+    print(f'best of {repeat} fresh interpreters')
+    print(f'{"case":<32}{"import ms":>12}{"peak rss MB":>14}')
+    for name, case_modules in cases:
+        result = probe(case_modules, repeat)
+        note = f'  (not installed: {", ".join(result["failed"])})' if result['failed'] else ''
+        print(f'{name:<32}{result["ms"]:>12.1f}{result["rss_mb"]:>14.1f}{note}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""
+Parity check and throughput benchmark of the embedding backends.
+
+Loads the local model with the torch backend and with the onnx backend (EMBEDDING_ONNX_FILE, see
+scripts/export_onnx_embedding_model.py), checks that the int8 vectors stay close to the current ones and rank
+a small corpus the same way, then measures single query latency and batch throughput of both.
+
+Run from the backend directory:
+    python scripts/benchmark/embedding_backend_benchmark.py [batch size] [min cosine similarity]
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+import numpy as np  # noqa: E402
+
+from apps.ai_model.embedding import EmbeddingModelCache, EmbeddingModelInfo, local_embedding_model  # noqa: E402
+
+questions = [
+    '本月销售额', '上个月各地区的订单数量', '今年销售额最高的十个产品', '客户的平均订单金额是多少',
+    '按月统计退货率', '哪个门店的利润最高', '库存低于安全库存的商品', '新用户的留存率',
+    'sales this month', 'top 10 customers by revenue', 'average delivery time per region',
+    'monthly active users of last year',
+]
+
+documents = [
+    '# Table: orders, 订单\n[\n(id:bigint),\n(customer_id:bigint, 客户),\n(amount:numeric, 订单金额),\n'
+    '(created_at:timestamp, 下单时间)\n]\n',
+    '# Table: products, 产品\n[\n(id:bigint),\n(name:varchar, 产品名称),\n(price:numeric, 单价)\n]\n',
+    '# Table: stores, 门店\n[\n(id:bigint),\n(region:varchar, 地区),\n(profit:numeric, 利润)\n]\n',
+    '# Table: inventory, 库存\n[\n(product_id:bigint),\n(quantity:int, 库存数量),\n(safety_stock:int, 安全库存)\n]\n',
+    '# Table: users, 用户\n[\n(id:bigint),\n(registered_at:timestamp, 注册时间),\n(last_login:timestamp)\n]\n',
+    '# Table: returns, 退货\n[\n(order_id:bigint),\n(returned_at:timestamp, 退货时间)\n]\n',
+    '# Table: shipments\n[\n(order_id:bigint),\n(region:varchar),\n(delivered_at:timestamp)\n]\n',
+]
+
+
+def load(backend: str):
+    config = EmbeddingModelInfo(folder=local_embedding_model.folder, name=local_embedding_model.name,
+                                backend=backend)
+    return EmbeddingModelCache.new_local_instance(config)
+
+
+def main():
+    batch_size = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+    min_similarity = float(sys.argv[2]) if len(sys.argv) > 2 else 0.99
+
+    models = {}
+    for backend in ['torch', 'onnx']:
+        cost = timeit.timeit(lambda: models.__setitem__(backend, load(backend)), number=1)
+        print(f'{"load " + backend:<32}{cost * 1000:>10.2f} ms')
+
+    vectors = {backend: np.asarray(model.embed_documents(questions + documents), dtype=np.float32)
+               for backend, model in models.items()}
+    similarities = np.sum(vectors['torch'] * vectors['onnx'], axis=1)
+    print(f'cosine similarity torch/onnx: min {similarities.min():.5f}, mean {similarities.mean():.5f}')
+    assert similarities.min() >= min_similarity, 'onnx vectors differ from the torch vectors'
+
+    rankings = {backend: np.argsort(-(vector[:len(questions)] @ vector[len(questions):].T), axis=1)[:, 0]
+                for backend, vector in vectors.items()}
+    agreement = float(np.mean(rankings['torch'] == rankings['onnx']))
+    print(f'top 1 document agreement: {agreement:.0%}')
+
+    batch = (questions * (batch_size // len(questions) + 1))[:batch_size]
+    for backend, model in models.items():
+        cost = min(timeit.repeat(lambda: model.embed_query(questions[0]), number=20, repeat=3)) / 20
+        print(f'{backend + " embed_query":<32}{cost * 1000:>10.2f} ms')
+        cost = min(timeit.repeat(lambda: model.embed_documents(batch), number=3, repeat=3)) / 3
+        print(f'{backend + " embed_documents":<32}{len(batch) / cost:>10.1f} texts/s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""
+Micro-benchmark for table retrieval by embedding.
+
+Compares the per table cosine_similarity loop with the float32 matrix of TableEmbeddingMatrix
+(one matrix-vector product plus argpartition), and checks that both select the same tables.
+
+Run from the backend directory:
+    python scripts/benchmark/table_embedding_matrix_benchmark.py [tables] [dimension] [top]
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+import numpy as np  # noqa: E402
+
+from apps.datasource.embedding.table_matrix import TableEmbeddingMatrix  # noqa: E402
+from apps.datasource.embedding.utils import cosine_similarity  # noqa: E402
+
+
+def loop_search(rows, q_embedding, top):
+    scored = sorted(((cosine_similarity(q_embedding, embedding), table_id) for table_id, embedding in rows),
+                    key=lambda item: item[0], reverse=True)
+    return [table_id for _, table_id in scored[:top]]
+
+
+def main():
+    table_count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    dimension = int(sys.argv[2]) if len(sys.argv) > 2 else 768
+    top = int(sys.argv[3]) if len(sys.argv) > 3 else 10
+
+    rng = np.random.default_rng(0)
+    embeddings = rng.standard_normal((table_count, dimension)).astype(np.float32)
+    rows = [(table_id, embeddings[table_id - 1].tolist()) for table_id in range(1, table_count + 1)]
+    q_embedding = rng.standard_normal(dimension).astype(np.float32).tolist()
+    all_ids = [row[0] for row in rows]
+    some_ids = all_ids[::2]
+
+    matrix = TableEmbeddingMatrix.build(rows, dimension)
+    expected = loop_search(rows, q_embedding, top)
+    assert [table_id for table_id, _ in matrix.search(q_embedding, all_ids, top)] == expected, 'selection differs'
+
+    print(f'{table_count} tables x {dimension} dimensions, top {top}')
+    print(f'{"build matrix":<32}{timeit.timeit(lambda: TableEmbeddingMatrix.build(rows, dimension), number=1) * 1000:>10.2f} ms')
+    for name, func, number in [
+        ('cosine_similarity loop', lambda: loop_search(rows, q_embedding, top), 1),
+        ('matrix, all tables', lambda: matrix.search(q_embedding, all_ids, top), 100),
+        ('matrix, half of the tables', lambda: matrix.search(q_embedding, some_ids, top), 100),
+    ]:
+        cost = min(timeit.repeat(func, number=number, repeat=3)) / number
+        print(f'{name:<32}{cost * 1000:>10.3f} ms')
+
+
+if __name__ == '__main__':
+    main()
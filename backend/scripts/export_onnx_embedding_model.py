@@ -0,0 +1,50 @@
+"""
+Export the local embedding model to ONNX and quantize it to int8 for EMBEDDING_BACKEND = 'onnx'.
+
+The model is written to the folder of EMBEDDING_ONNX_FILE, next to the shipped model and not into it, as
+onnx/model.onnx and onnx/model_qint8_<config>.onnx with its own tokenizer and config. Set EMBEDDING_ONNX_FILE
+to the quantized file if it is not the default. Needs the optional "onnx" dependencies.
+
+The vectors of the onnx backend differ slightly from the torch ones, so the stored embeddings have to be made
+again after switching EMBEDDING_BACKEND. Clear them and restart, they are filled again at startup:
+    UPDATE terminology SET embedding = NULL;
+    UPDATE data_training SET embedding = NULL;
+    UPDATE core_table SET embedding = NULL;
+    UPDATE core_datasource SET embedding = NULL;
+
+Run from the backend directory:
+    python scripts/export_onnx_embedding_model.py [avx2|avx512|avx512_vnni|arm64]
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from sentence_transformers import SentenceTransformer  # noqa: E402
+from sentence_transformers.backend import export_dynamic_quantized_onnx_model  # noqa: E402
+
+from apps.ai_model.embedding import local_embedding_model  # noqa: E402
+from common.core.config import settings  # noqa: E402
+
+
+def main():
+    quantization_config = sys.argv[1] if len(sys.argv) > 1 else 'avx2'
+    model_path = local_embedding_model.name
+    onnx_file = os.path.join(settings.LOCAL_MODEL_PATH, settings.EMBEDDING_ONNX_FILE)
+    onnx_model_path = os.path.dirname(os.path.dirname(onnx_file))
+    if os.path.abspath(onnx_model_path) == os.path.abspath(model_path):
+        sys.exit(f"EMBEDDING_ONNX_FILE points into the shipped model folder {model_path}, use another folder")
+
+    # exports onnx/model.onnx in memory, the shipped model folder is only read
+    model = SentenceTransformer(model_path, backend='onnx', device='cpu',
+                                model_kwargs={'provider': 'CPUExecutionProvider'})
+    model.save_pretrained(onnx_model_path)
+    export_dynamic_quantized_onnx_model(model, quantization_config, onnx_model_path)
+    exported_file = os.path.join(onnx_model_path, 'onnx', f'model_qint8_{quantization_config}.onnx')
+    print(f"Exported {exported_file}")
+    if os.path.abspath(exported_file) != os.path.abspath(onnx_file):
+        print(f"Set EMBEDDING_ONNX_FILE to {os.path.relpath(exported_file, settings.LOCAL_MODEL_PATH)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,5 @@
+import os
+import tempfile
+
+# keep the log files of the modules under test out of the source tree
+os.environ.setdefault('LOG_DIR', os.path.join(tempfile.gettempdir(), 'sqlbot-test-logs'))
@@ -0,0 +1,62 @@
+import asyncio
+import threading
+
+import pytest
+
+from apps.db.bulkhead import DsBulkhead, _async_waiters, _waiting_ds
+from common.core.config import settings
+from common.error import DatasourceBusyError
+
+
+@pytest.fixture
+def one_slot(monkeypatch):
+    monkeypatch.setattr(settings, 'DS_QUERY_CONCURRENCY', 1)
+    monkeypatch.setattr(settings, 'DS_QUERY_QUEUE_SIZE', 1)
+
+
+def test_async_waiter_is_woken_by_release_from_thread(one_slot):
+    async def run():
+        DsBulkhead.acquire('ds-wake')
+        threads_before = threading.active_count()
+        waiter = asyncio.create_task(DsBulkhead.acquire_async('ds-wake', timeout=5))
+        await asyncio.sleep(0.05)
+        assert not waiter.done()
+        # waiting does not park a thread
+        assert threading.active_count() == threads_before
+        threading.Thread(target=DsBulkhead.release, args=('ds-wake',)).start()
+        await asyncio.wait_for(waiter, 1)
+        DsBulkhead.release('ds-wake')
+
+    asyncio.run(run())
+    assert not _async_waiters and 'ds-wake' not in _waiting_ds
+
+
+def test_async_waiter_times_out_and_queue_is_bounded(one_slot):
+    async def run():
+        await DsBulkhead.acquire_async('ds-busy')
+        waiter = asyncio.create_task(DsBulkhead.acquire_async('ds-busy', timeout=0.1))
+        await asyncio.sleep(0.01)
+        with pytest.raises(DatasourceBusyError):
+            await DsBulkhead.acquire_async('ds-busy', timeout=0.1)
+        with pytest.raises(DatasourceBusyError):
+            await waiter
+        DsBulkhead.release('ds-busy')
+
+    asyncio.run(run())
+    assert not _async_waiters and 'ds-busy' not in _waiting_ds
+
+
+def test_cancelled_async_waiter_leaves_the_queue(one_slot):
+    async def run():
+        DsBulkhead.acquire('ds-cancel')
+        waiter = asyncio.create_task(DsBulkhead.acquire_async('ds-cancel', timeout=5))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        DsBulkhead.release('ds-cancel')
+        await asyncio.wait_for(DsBulkhead.acquire_async('ds-cancel'), 1)
+        DsBulkhead.release('ds-cancel')
+
+    asyncio.run(run())
+    assert not _async_waiters and 'ds-cancel' not in _waiting_ds
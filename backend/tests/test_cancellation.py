@@ -0,0 +1,31 @@
+from common.utils import cancellation
+from common.utils.cancellation import CancellationRegistry, CancellationToken
+
+
+def test_cancel_of_a_task_in_another_process_is_sent_and_applied(monkeypatch):
+    sent = []
+    monkeypatch.setattr(cancellation, '_listener', object())
+    monkeypatch.setattr(cancellation, '_notify', lambda key, reason: sent.append((key, reason)))
+
+    # not running here, the cancel goes to the other processes
+    assert CancellationRegistry.cancel(42, 'cancelled by user')
+    assert sent == [(42, 'cancelled by user')]
+
+    # the process running the task receives the notification
+    token = CancellationToken()
+    CancellationRegistry.register(42, token)
+    try:
+        cancellation._on_notify('{"key": 42, "reason": "cancelled by user"}')
+        assert token.cancelled and token.reason == 'cancelled by user'
+    finally:
+        CancellationRegistry.unregister(42, token)
+
+
+def test_cancel_without_listener_stays_local(monkeypatch):
+    monkeypatch.setattr(cancellation, '_listener', None)
+    assert not CancellationRegistry.cancel('unknown-task')
+    token = CancellationToken()
+    CancellationRegistry.register('local-task', token)
+    assert CancellationRegistry.cancel('local-task')
+    assert token.cancelled
+    CancellationRegistry.unregister('local-task', token)
@@ -0,0 +1,32 @@
+import pytest
+
+from apps.datasource.models.datasource import CoreDatasource, DatasourceConf
+from apps.db.db_sql import get_pg_search_path, get_pg_search_path_option, get_all_fields_sql, get_names_filter
+
+
+def test_search_path_keeps_schema_as_written():
+    assert get_pg_search_path('Sales') == '"Sales"'
+    assert get_pg_search_path('a"b') == '"a""b"'
+
+
+def test_search_path_option_escapes_libpq_separators():
+    assert get_pg_search_path_option('My Schema') == '-c search_path="My\\ Schema"'
+    assert get_pg_search_path_option('a\\b') == '-c search_path="a\\\\b"'
+
+
+@pytest.mark.parametrize('ds_type', ['mysql', 'sqlServer', 'pg', 'excel', 'redshift', 'oracle', 'ck', 'dm', 'doris',
+                                     'starrocks', 'kingbase'])
+def test_all_fields_sql_reads_only_the_given_tables(ds_type):
+    conf = DatasourceConf(database='db', dbSchema='public')
+    sql, param = get_all_fields_sql(CoreDatasource(type=ds_type), conf, ['orders', "o'neil"])
+    assert "IN (" in sql and "'orders'" in sql and "'o''neil'" in sql
+    assert param in ('db', 'public')
+
+
+def test_names_filter_escapes_for_the_driver():
+    assert get_names_filter('pg', 'c.relname', []) == '1 = 0'
+    assert get_names_filter('mysql', 'TABLE_NAME', ['a\\b']) == "(TABLE_NAME IN ('a\\\\b'))"
+    assert get_names_filter('doris', 'TABLE_NAME', ['a%']) == "(TABLE_NAME IN ('a%%'))"
+    assert get_names_filter('kingbase', 'c.relname', ['{x}']) == "(c.relname IN ('{{x}}'))"
+    assert get_names_filter('sqlServer', 'C.TABLE_NAME', ['t']) == "(C.TABLE_NAME IN (N't'))"
+    assert get_names_filter('oracle', 'T', [f't{index}' for index in range(1001)]).count(' IN (') == 2
@@ -0,0 +1,13 @@
+import time
+
+from apps.db.ds_health import DsHealthCache
+
+
+def test_version_is_cached_for_its_own_ttl():
+    DsHealthCache.set_version('ds-version', '8.0')
+    # failed version queries are cached with a short ttl
+    DsHealthCache.set_version('ds-no-version', '', ttl=0)
+    time.sleep(0.01)
+    assert DsHealthCache.get_version('ds-version') == '8.0'
+    assert DsHealthCache.get_version('ds-no-version') is None
+    DsHealthCache.clear()
@@ -0,0 +1,38 @@
+import pytest
+
+from apps.datasource.models.datasource import CoreDatasource
+from apps.db.ds_pool import DsPoolCache, get_ds_pool_key
+from apps.system.schemas.system_schema import AssistantOutDsSchema
+from common.core.config import settings
+
+
+class FakePool:
+    def __init__(self):
+        self.disposed = False
+
+    def dispose(self):
+        self.disposed = True
+
+
+@pytest.fixture(autouse=True)
+def clear_pools():
+    DsPoolCache.clear()
+    yield
+    DsPoolCache.clear()
+
+
+def test_unsaved_datasource_pool_is_reused_and_evicted(monkeypatch):
+    pool = DsPoolCache.get(None, 'conf', FakePool)
+    assert DsPoolCache.get(None, 'conf', FakePool) is pool
+
+    monkeypatch.setattr(settings, 'DS_POOL_UNSAVED_IDLE_TIMEOUT', -1)
+    saved = DsPoolCache.get(1, 'conf', FakePool)
+    DsPoolCache.evict_idle(force=True)
+    assert pool.disposed
+    assert not saved.disposed
+
+
+def test_assistant_datasource_does_not_share_pool_key():
+    assert get_ds_pool_key(CoreDatasource(id=1)) == 1
+    assert get_ds_pool_key(AssistantOutDsSchema(id=1, name='out')) != 1
+    assert get_ds_pool_key(CoreDatasource()) is None
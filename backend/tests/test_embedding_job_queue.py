@@ -0,0 +1,76 @@
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+import pytest
+
+from apps.datasource.crud import table
+from common.utils import embedding_threads
+
+
+class FakeEngine:
+
+    def __init__(self):
+        self.executed = []
+
+    @contextmanager
+    def begin(self):
+        yield self
+
+    def execute(self, statement, params=None):
+        self.executed.append((str(statement), params))
+
+
+class FakeSessionMaker:
+
+    def __call__(self):
+        return SimpleNamespace()
+
+    def remove(self):
+        pass
+
+
+def failing_model():
+    raise RuntimeError('embedding model is unavailable')
+
+
+@pytest.fixture
+def engine(monkeypatch):
+    fake = FakeEngine()
+    monkeypatch.setattr(embedding_threads, 'engine', fake)
+    return fake
+
+
+def test_failed_handler_marks_jobs_failed(engine, monkeypatch):
+    monkeypatch.setattr(table.EmbeddingModelCache, 'get_model', staticmethod(failing_model))
+    jobs = [SimpleNamespace(id=1, entity_type='table', entity_id=10, version=3),
+            SimpleNamespace(id=2, entity_type='table', entity_id=11, version=1)]
+
+    embedding_threads._run_jobs('table', jobs)
+
+    statements = [statement for statement, _ in engine.executed]
+    assert statements == [embedding_threads.fail_sql]
+    params = engine.executed[0][1]
+    assert params['ids'] == [1, 2]
+    assert params['versions'] == [3, 1]
+    assert 'embedding model is unavailable' in params['error']
+
+
+def test_finished_handler_completes_jobs(engine, monkeypatch):
+    calls = []
+    monkeypatch.setattr(embedding_threads, 'get_job_handler',
+                        lambda entity_type: lambda session_maker, ids, raise_errors=False: calls.append(
+                            (ids, raise_errors)))
+
+    embedding_threads._run_jobs('datasource', [SimpleNamespace(id=5, entity_type='datasource', entity_id=7,
+                                                               version=2)])
+
+    assert calls == [([7], True)]
+    assert [statement for statement, _ in engine.executed] == [embedding_threads.complete_sql]
+
+
+def test_handlers_swallow_errors_outside_the_queue(monkeypatch):
+    monkeypatch.setattr(table.EmbeddingModelCache, 'get_model', staticmethod(failing_model))
+
+    table.save_table_embedding(FakeSessionMaker(), [1])
+    with pytest.raises(RuntimeError):
+        table.save_table_embedding(FakeSessionMaker(), [1], raise_errors=True)
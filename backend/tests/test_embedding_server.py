@@ -0,0 +1,50 @@
+import asyncio
+
+import pytest
+
+from apps.ai_model.embedding_server import MicroBatcher
+
+
+class FakeModel:
+    def __init__(self):
+        self.calls = []
+
+    def embed_documents(self, texts):
+        self.calls.append(list(texts))
+        if 'bad' in texts:
+            raise ValueError('bad text')
+        return [[float(len(text))] for text in texts]
+
+
+def test_failed_batch_only_fails_the_bad_request():
+    async def run():
+        model = FakeModel()
+        batcher = MicroBatcher(model, max_batch_size=10, max_wait=0.05)
+        batcher.start()
+        try:
+            results = await asyncio.gather(batcher.embed(['a']), batcher.embed(['bad']), batcher.embed(['ccc']),
+                                           return_exceptions=True)
+        finally:
+            await batcher.stop()
+        return model, results
+
+    model, results = asyncio.run(run())
+    assert model.calls[0] == ['a', 'bad', 'ccc']
+    assert results[0] == [[1.0]]
+    assert isinstance(results[1], ValueError)
+    assert results[2] == [[3.0]]
+
+
+def test_single_request_is_not_retried():
+    async def run():
+        model = FakeModel()
+        batcher = MicroBatcher(model, max_batch_size=10, max_wait=0)
+        batcher.start()
+        try:
+            with pytest.raises(ValueError):
+                await batcher.embed(['bad'])
+        finally:
+            await batcher.stop()
+        return model
+
+    assert asyncio.run(run()).calls == [['bad']]
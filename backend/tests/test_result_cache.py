@@ -0,0 +1,38 @@
+import datetime
+import math
+import uuid
+from decimal import Decimal
+
+from apps.db.result_cache import dumps_result, loads_result, get_cache_key
+
+
+def test_result_round_trip_keeps_value_types():
+    tz = datetime.timezone(datetime.timedelta(hours=8))
+    columns = [
+        [1, None, 3],
+        ['a', 'b', None],
+        [1.5, float('nan'), None],
+        [datetime.datetime(2024, 1, 2, 3, 4, 5, 6, tzinfo=tz), datetime.datetime(2024, 1, 2), None],
+        [datetime.date(2024, 1, 2), datetime.time(3, 4, 5), datetime.timedelta(days=1, seconds=2)],
+        [Decimal('1.10'), b'\x00\x01', uuid.UUID(int=1)],
+        [{'k': [1, 2]}, [1, 'x'], True],
+    ]
+    result = {"fields": [f"c{index}" for index in range(len(columns))], "columns": columns, "truncated": False,
+              "fetch_time": 0.1, "bytes_read": 10, "sql": "U0VMRUNUIDE="}
+
+    loaded = loads_result(dumps_result(result))
+
+    assert loaded["fields"] == result["fields"]
+    assert loaded["truncated"] is False and loaded["sql"] == result["sql"]
+    assert loaded["columns"][0:2] == columns[0:2]
+    assert loaded["columns"][2][0] == 1.5 and math.isnan(loaded["columns"][2][1]) and loaded["columns"][2][2] is None
+    assert loaded["columns"][3:] == columns[3:]
+    assert [type(value) for value in loaded["columns"][5]] == [Decimal, bytes, uuid.UUID]
+    assert "tagged" not in loaded
+
+
+def test_cache_key_changes_with_datasource_config():
+    key = get_cache_key(1, 'conf-a', 'SELECT a FROM t', 'fp')
+    assert key == get_cache_key(1, 'conf-a', 'SELECT a FROM t;', 'fp')
+    assert key != get_cache_key(1, 'conf-b', 'SELECT a FROM t', 'fp')
+    assert key.startswith('1:')
@@ -0,0 +1,77 @@
+import pytest
+
+from apps.db.constant import DB
+from apps.db.sql_limit import apply_row_limit
+
+
+@pytest.mark.parametrize('db, sql, expected', [
+    # the limit is appended, dialect functions and casts keep their text
+    (DB.mysql, "SELECT IFNULL(`name`, '-') AS n FROM `t` ORDER BY n",
+     "SELECT IFNULL(`name`, '-') AS n FROM `t` ORDER BY n\nLIMIT 100"),
+    (DB.doris, "SELECT DATE_FORMAT(dt, '%Y-%m') AS m, COUNT(*) FROM t GROUP BY m",
+     "SELECT DATE_FORMAT(dt, '%Y-%m') AS m, COUNT(*) FROM t GROUP BY m\nLIMIT 100"),
+    (DB.starrocks, "SELECT IFNULL(a, 0) FROM t", "SELECT IFNULL(a, 0) FROM t\nLIMIT 100"),
+    (DB.pg, 'SELECT "a"::int, b::text FROM "S"."T" WHERE c ILIKE \'%x%\'',
+     'SELECT "a"::int, b::text FROM "S"."T" WHERE c ILIKE \'%x%\'\nLIMIT 100'),
+    (DB.redshift, "SELECT NVL(a, 0), GETDATE() FROM t", "SELECT NVL(a, 0), GETDATE() FROM t\nLIMIT 100"),
+    (DB.ck, "SELECT toStartOfMonth(dt) AS m, count() FROM t GROUP BY m",
+     "SELECT toStartOfMonth(dt) AS m, count() FROM t GROUP BY m\nLIMIT 100"),
+    (DB.pg, "SELECT a FROM t -- newest first", "SELECT a FROM t -- newest first\nLIMIT 100"),
+    # a larger limit only has its number changed
+    (DB.mysql, "SELECT IFNULL(a, 0) FROM t limit 1000", "SELECT IFNULL(a, 0) FROM t limit 100"),
+    (DB.mysql, "SELECT a FROM t LIMIT 20, 1000", "SELECT a FROM t LIMIT 20, 100"),
+    (DB.pg, "SELECT a::int FROM t LIMIT 1000 OFFSET 10", "SELECT a::int FROM t LIMIT 100 OFFSET 10"),
+    (DB.ck, "SELECT toStartOfMonth(dt) FROM t LIMIT 1000", "SELECT toStartOfMonth(dt) FROM t LIMIT 100"),
+    (DB.pg, "SELECT a FROM (SELECT a FROM t LIMIT 5000) s LIMIT 1000",
+     "SELECT a FROM (SELECT a FROM t LIMIT 5000) s LIMIT 100"),
+    (DB.sqlServer, "SELECT TOP 1000 ISNULL(a, 0) FROM [t]", "SELECT TOP 100 ISNULL(a, 0) FROM [t]"),
+    (DB.sqlServer, "SELECT a FROM t ORDER BY a OFFSET 0 ROWS FETCH NEXT 1000 ROWS ONLY",
+     "SELECT a FROM t ORDER BY a OFFSET 0 ROWS FETCH NEXT 100 ROWS ONLY"),
+    (DB.oracle, "SELECT NVL(a, 0) FROM t FETCH FIRST 1000 ROWS ONLY",
+     "SELECT NVL(a, 0) FROM t FETCH FIRST 100 ROWS ONLY"),
+    # TOP after SELECT DISTINCT, ROWNUM around oracle queries
+    (DB.sqlServer, "SELECT DISTINCT ISNULL(a, 0) FROM [t] ORDER BY 1",
+     "SELECT DISTINCT TOP 100 ISNULL(a, 0) FROM [t] ORDER BY 1"),
+    (DB.oracle, "SELECT NVL(a, 0) FROM t ORDER BY a",
+     "SELECT * FROM (SELECT NVL(a, 0) FROM t ORDER BY a) sqlbot_limit_t WHERE ROWNUM <= 100"),
+    # a smaller limit, no query or a limit that can not be applied safely leaves the sql as it is
+    (DB.mysql, "SELECT a FROM t LIMIT 10", "SELECT a FROM t LIMIT 10"),
+    (DB.pg, "UPDATE t SET a = 1", "UPDATE t SET a = 1"),
+    (DB.sqlServer, "SELECT a FROM t UNION SELECT b FROM u", "SELECT a FROM t UNION SELECT b FROM u"),
+    (DB.pg, "SELECT a FROM t OFFSET 10", "SELECT a FROM t OFFSET 10"),
+    (DB.ck, "SELECT a FROM t UNION ALL SELECT b FROM u", "SELECT a FROM t UNION ALL SELECT b FROM u"),
+    (DB.ck, "SELECT a FROM t FORMAT JSON", "SELECT a FROM t FORMAT JSON"),
+])
+def test_apply_row_limit_keeps_sql_text(db, sql, expected):
+    assert apply_row_limit(sql, db, 100) == expected
+
+
+def test_apply_row_limit_strips_semicolon():
+    assert apply_row_limit("SELECT a FROM t;", DB.pg, 100) == "SELECT a FROM t\nLIMIT 100"
+
+
+def test_apply_row_limit_without_limit():
+    assert apply_row_limit("SELECT a FROM t", DB.pg, 0) == "SELECT a FROM t"
+
+
+@pytest.mark.parametrize('db, sql, version, expected', [
+    # a join with duplicate column names can not be wrapped, oracle 12c and later use FETCH FIRST instead
+    (DB.oracle, "SELECT a.id, b.id FROM a JOIN b ON a.x = b.x", None,
+     "SELECT a.id, b.id FROM a JOIN b ON a.x = b.x"),
+    (DB.oracle, "SELECT * FROM a JOIN b ON a.x = b.x", '11.2.0.4.0', "SELECT * FROM a JOIN b ON a.x = b.x"),
+    (DB.dm, "SELECT a.id, b.id FROM a, b", None, "SELECT a.id, b.id FROM a, b"),
+    (DB.oracle, "SELECT a.id, b.id FROM a JOIN b ON a.x = b.x", '19.0.0.0.0',
+     "SELECT a.id, b.id FROM a JOIN b ON a.x = b.x\nFETCH FIRST 100 ROWS ONLY"),
+    # the ROWNUM limit asked for by the oracle template is kept
+    (DB.oracle, "SELECT a FROM t WHERE b = 1 AND ROWNUM <= 1000", None,
+     "SELECT a FROM t WHERE b = 1 AND ROWNUM <= 1000"),
+    (DB.oracle, "SELECT * FROM (SELECT a FROM t ORDER BY a) WHERE ROWNUM <= 10", '19.0.0.0.0',
+     "SELECT * FROM (SELECT a FROM t ORDER BY a) WHERE ROWNUM <= 10"),
+    (DB.oracle, "SELECT a FROM t WHERE x IN (SELECT y FROM u WHERE ROWNUM <= 3)", None,
+     "SELECT * FROM (SELECT a FROM t WHERE x IN (SELECT y FROM u WHERE ROWNUM <= 3)) sqlbot_limit_t "
+     "WHERE ROWNUM <= 100"),
+    (DB.oracle, "SELECT NVL(a, 0) FROM t ORDER BY a", '12.1.0.2.0',
+     "SELECT NVL(a, 0) FROM t ORDER BY a\nFETCH FIRST 100 ROWS ONLY"),
+])
+def test_apply_row_limit_on_oracle(db, sql, version, expected):
+    assert apply_row_limit(sql, db, 100, version) == expected
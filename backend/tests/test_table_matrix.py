@@ -0,0 +1,42 @@
+from apps.datasource.embedding.table_matrix import TableEmbeddingMatrixCache
+
+
+class FakeResult:
+    def __init__(self, value):
+        self.value = value
+
+    def scalar(self):
+        return self.value
+
+    def all(self):
+        return self.value
+
+
+class FakeSession:
+    """table_embedding_version row and the table embeddings of one datasource."""
+
+    def __init__(self):
+        self.version = None
+        self.rows = [(1, [1.0, 0.0]), (2, [0.0, 1.0])]
+        self.row_reads = 0
+
+    def execute(self, statement, params=None):
+        if 'table_embedding_version' in str(statement):
+            return FakeResult(self.version)
+        self.row_reads += 1
+        return FakeResult(list(self.rows))
+
+
+def test_matrix_is_rebuilt_when_another_process_bumps_the_version():
+    session = FakeSession()
+    ds_id = 'matrix-version-test'
+    assert TableEmbeddingMatrixCache.search(session, ds_id, [1.0, 0.0], [1, 2], 1)[0][0] == 1
+    TableEmbeddingMatrixCache.search(session, ds_id, [1.0, 0.0], [1, 2], 1)
+    assert session.row_reads == 1
+
+    # embeddings changed by another process, only the version row tells
+    session.rows = [(1, [0.0, 1.0]), (2, [1.0, 0.0])]
+    session.version = 1
+    assert TableEmbeddingMatrixCache.search(session, ds_id, [1.0, 0.0], [1, 2], 1)[0][0] == 2
+    assert session.row_reads == 2
+    TableEmbeddingMatrixCache.invalidate(ds_id)